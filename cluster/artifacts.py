@@ -0,0 +1,246 @@
+
+import os
+import time
+import errno
+import cPickle
+import hashlib
+import numpy as np
+
+# eviction frees the cache down to this fraction of max_bytes, so that it is not rescanned
+#   on every put once the cache is full
+_evict_frac = 0.9
+
+
+def digest(obj):
+	'''
+	returns str - a hash of obj that is stable across runs.  Arrays are hashed by
+		their contents, lists, tuples and dicts element by element, and everything else
+		by its repr.
+	'''
+	h = hashlib.sha1()
+	_update_digest(h, obj)
+	return h.hexdigest()
+
+
+def _update_digest(h, obj):
+	if isinstance(obj, np.ndarray):
+		h.update("ndarray%s%s" % (obj.dtype.str, obj.shape))
+		h.update(np.ascontiguousarray(obj).data)
+	elif isinstance(obj, (list, tuple)):
+		h.update("%s%d" % (type(obj).__name__, len(obj)))
+		for item in obj:
+			_update_digest(h, item)
+	elif isinstance(obj, dict):
+		h.update("dict%d" % len(obj))
+		for key in sorted(obj.keys()):
+			_update_digest(h, key)
+			_update_digest(h, obj[key])
+	else:
+		h.update(repr(obj))
+
+
+def file_digest(path, chunk_size=2 ** 20):
+	'''
+	returns str - a hash of the contents of the file at path.  Unlike its path or mtime,
+		it stays the same when the file is copied and changes whenever its contents do.
+	'''
+	h = hashlib.sha1()
+	f = open(path, 'rb')
+	try:
+		for chunk in iter(lambda: f.read(chunk_size), ''):
+			h.update(chunk)
+	finally:
+		f.close()
+	return h.hexdigest()
+
+
+def _tree_files(root, ext):
+	for dirpath, dirnames, filenames in os.walk(root):
+		dirnames.sort()
+		for f in sorted(filenames):
+			if ext is None or f.endswith(ext):
+				yield os.path.join(dirpath, f)
+
+
+def tree_digest(root, ext=None):
+	'''
+	returns str - a hash of the manifest of every file under root (ending with ext if
+		given): its path relative to root and the digest of its contents
+	'''
+	return digest(map(lambda path: (os.path.relpath(path, root), file_digest(path)), _tree_files(root, ext)))
+
+
+def tree_stat_digest(root, ext=None):
+	'''
+	returns str - like tree_digest, but of the size and mtime of each file instead of its
+		contents, so no file is read.  For inputs too large to hash on every run.
+	'''
+	manifest = list()
+	for path in _tree_files(root, ext):
+		stat = os.stat(path)
+		manifest.append( (os.path.relpath(path, root), stat.st_size, stat.st_mtime) )
+	return digest(manifest)
+
+
+def _ignore_missing(func, path, *args):
+	'''
+	returns func(path, *args), or None if path does not exist (anymore)
+	'''
+	try:
+		return func(path, *args)
+	except OSError as e:
+		if e.errno != errno.ENOENT:
+			raise
+		return None
+
+
+class ArtifactStore:
+	'''
+	Disk cache of pipeline results keyed by a hash of the stage name and every input and
+		parameter the result depends on, so changing a parameter never reuses a stale result.
+		NumPy arrays are stored as .npy files that can be memory-mapped, everything else as
+		binary pickles.  When the cache grows past max_bytes, the least recently used
+		artifacts are removed.  The directory is only scanned when the running total of
+		what this store wrote crosses max_bytes, so it may be shared by several processes
+		(e.g. pool workers), each of which evicts what it finds.
+	'''
+
+	def __init__(self, cache_dir, max_bytes=None, read=True, write=True):
+		'''
+		cache_dir - str directory for the artifacts.  Created if needed
+		max_bytes - int size limit of cache_dir, or None for no limit
+		read, write - bool whether to use existing artifacts and store new ones
+		'''
+		self.cache_dir = cache_dir
+		self.max_bytes = max_bytes
+		self.read = read
+		self.write = write
+		self.hits = 0
+		self.misses = 0
+		# bytes in cache_dir as of the last scan plus what was written since, or None before
+		#   the first scan
+		self.total = None
+		try:
+			os.makedirs(cache_dir)
+		except:
+			pass
+
+	def key(self, name, *params):
+		'''
+		returns str - the key of the artifact made by stage name from params.  To chain
+			stages, pass the key of an upstream artifact as one of the params instead of
+			the artifact itself.
+		'''
+		return "%s-%s" % (name, digest(params))
+
+	def _path(self, key, ext):
+		return os.path.join(self.cache_dir, key + ext)
+
+	def get(self, key, mmap_mode=None):
+		'''
+		returns (bool, object) - whether key was in the cache, and the artifact
+		'''
+		if not self.read:
+			return False, None
+		for ext in [".npy", ".pckl"]:
+			path = self._path(key, ext)
+			if not os.path.exists(path):
+				continue
+			try:
+				if ext == ".npy":
+					value = np.load(path, mmap_mode=mmap_mode)
+				else:
+					f = open(path, 'rb')
+					try:
+						value = cPickle.load(f)
+					finally:
+						f.close()
+			except Exception as e:
+				print "\tError loading %s from the cache: %s" % (key, e)
+				break
+			# the access time is what eviction goes by
+			_ignore_missing(os.utime, path, None)
+			self.hits += 1
+			return True, value
+		self.misses += 1
+		return False, None
+
+	def put(self, key, value):
+		if not self.write:
+			return
+		ext = ".npy" if isinstance(value, np.ndarray) else ".pckl"
+		path = self._path(key, ext)
+		# written under a temporary name so a crash never leaves a truncated artifact
+		tmp_path = "%s.%d.tmp" % (path, os.getpid())
+		f = open(tmp_path, 'wb')
+		try:
+			if ext == ".npy":
+				np.save(f, value)
+			else:
+				cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+		except Exception as e:
+			print "\tCould not write %s to the cache: %s" % (key, e)
+			f.close()
+			os.remove(tmp_path)
+			return
+		f.close()
+		os.rename(tmp_path, path)
+		if self.max_bytes is None:
+			return
+		if self.total is not None:
+			self.total += os.path.getsize(path)
+		if self.total is None or self.total > self.max_bytes:
+			self.evict(keep=path)
+
+	def cached(self, key, compute, mmap_mode=None):
+		'''
+		returns the artifact for key, calling compute() to make it on a cache miss
+		'''
+		found, value = self.get(key, mmap_mode)
+		if found:
+			print "\tRead %s from the cache" % key
+			return value
+		value = compute()
+		self.put(key, value)
+		return value
+
+	def size(self):
+		return sum(map(lambda (path, size, atime): size, self._artifacts()))
+
+	def _artifacts(self):
+		artifacts = list()
+		for f in os.listdir(self.cache_dir):
+			if f.endswith(".npy") or f.endswith(".pckl"):
+				path = os.path.join(self.cache_dir, f)
+				# another process may have evicted it since the listing
+				stat = _ignore_missing(os.stat, path)
+				if stat is not None:
+					artifacts.append( (path, stat.st_size, max(stat.st_atime, stat.st_mtime)) )
+		return artifacts
+
+	def evict(self, keep=None):
+		'''
+		Removes the least recently used artifacts until the cache fits in _evict_frac of
+			max_bytes.
+			keep - path that is never removed
+		'''
+		if self.max_bytes is None:
+			return
+		artifacts = self._artifacts()
+		total = sum(map(lambda (path, size, atime): size, artifacts))
+		artifacts.sort(key=lambda (path, size, atime): atime)
+		for path, size, atime in artifacts:
+			if total <= _evict_frac * self.max_bytes:
+				break
+			if path == keep:
+				continue
+			_ignore_missing(os.remove, path)
+			total -= size
+			print "\tEvicted %s from the cache" % os.path.basename(path)
+		self.total = total
+
+	def print_stats(self):
+		total = self.hits + self.misses
+		print "Cache %s: %d hits, %d misses (%.1f%% hit rate), %.1f MB" % (self.cache_dir, self.hits,
+			self.misses, 100. * self.hits / total if total else 0., self.size() / float(2 ** 20))
+
@@ -0,0 +1,143 @@
+
+import utils
+
+# Cliques of the graph whose edges are the pairs with weight <= a threshold.  Vertex sets
+#   are bitsets (python ints), so intersecting neighborhoods is a single &.
+#   A clique of size k exists iff some vertex v and k - 1 of its neighbors form one, which
+#   is searched depth first.  The number of colors of a greedy coloring bounds the size
+#   of any clique, which prunes most of the search.
+
+# thresholds tried by find_best_clique
+_thresh_step = 0.05
+
+
+def _bits(s):
+	''' generator of the vertices in bitset s, lowest first '''
+	while s:
+		b = s & -s
+		yield b.bit_length() - 1
+		s ^= b
+
+def _count(s):
+	return bin(s).count('1')
+
+def _color_bound(adj, cands):
+	'''
+	returns int - the number of colors of a greedy coloring of cands, an upper bound on
+		the size of a clique in cands
+	'''
+	num_colors = 0
+	uncolored = cands
+	while uncolored:
+		num_colors += 1
+		avail = uncolored
+		while avail:
+			b = avail & -avail
+			uncolored ^= b
+			avail &= ~b & ~adj[b.bit_length() - 1]
+	return num_colors
+
+def find_clique(adj, cands, k):
+	'''
+	returns list(int) - k mutually adjacent vertices of bitset cands, or None
+		adj - list(int) the bitset of neighbors of each vertex
+	'''
+	if k <= 0:
+		return list()
+	if _count(cands) < k or _color_bound(adj, cands) < k:
+		return None
+	for v in _bits(cands):
+		cands ^= 1 << v
+		clique = find_clique(adj, adj[v] & cands, k - 1)
+		if clique is not None:
+			return [v] + clique
+		if _count(cands) < k:
+			break
+	return None
+
+
+class CliqueGraph:
+	'''
+	Graph whose edges are added in order of increasing weight.  Each new edge (u, v) can only
+		complete cliques that contain both u and v, so checking whether the edge made a clique
+		of size k only searches the common neighbors of u and v.
+	'''
+
+	def __init__(self, n):
+		self.adj = [0] * n
+
+	def add_edge(self, u, v):
+		self.adj[u] |= 1 << v
+		self.adj[v] |= 1 << u
+
+	def clique_with_edge(self, u, v, k):
+		'''
+		returns list(int) - a clique of size k containing u and v, or None
+		'''
+		clique = find_clique(self.adj, self.adj[u] & self.adj[v], k - 2)
+		if clique is None:
+			return None
+		return [u, v] + clique
+
+	def has_clique(self, k):
+		cands = (1 << len(self.adj)) - 1
+		return find_clique(self.adj, cands, k) is not None
+
+
+def _first_clique(edges, n, k):
+	'''
+	Adds edges in order until one completes a clique of size k.
+	returns (list(int), int) - the clique and the index of the edge, or (None, None)
+	'''
+	graph = CliqueGraph(n)
+	for x, (u, v, weight) in enumerate(edges):
+		graph.add_edge(u, v)
+		clique = graph.clique_with_edge(u, v, k)
+		if clique is not None:
+			return clique, x
+	return None, None
+
+def thresholds():
+	''' returns list(float) - _thresh_step, 2 * _thresh_step, ... while <= 1 '''
+	threshes = list()
+	thresh = _thresh_step
+	while thresh <= 1:
+		threshes.append(thresh)
+		thresh += _thresh_step
+	return threshes
+
+def find_best_clique(sim_mat, size):
+	'''
+	Raises a threshold by _thresh_step until the graph of pairs with sim_mat <= threshold
+		has a clique of at least size vertices.  Of the largest cliques at that threshold, returns
+		one whose largest weight is smallest, or None if no threshold gives such a clique.
+	returns list(int)
+	'''
+	n = len(sim_mat)
+	if not n:
+		return None
+	edges = utils.get_sorted_edges(sim_mat)
+	threshes = thresholds()
+	if size > 1:
+		# the first edge that completes a clique of size gives the smallest max weight any
+		#   clique of size can have
+		clique, x = _first_clique(edges, n, size)
+		if clique is None:
+			return None
+		threshes = filter(lambda thresh: thresh >= edges[x][2], threshes)
+	if not threshes:
+		return None
+	thresh = threshes[0]
+	edges = filter(lambda edge: edge[2] <= thresh, edges)
+
+	# larger cliques may exist by the time the threshold is reached
+	graph = CliqueGraph(n)
+	for u, v, weight in edges:
+		graph.add_edge(u, v)
+	biggest = max(size, 1)
+	while graph.has_clique(biggest + 1):
+		biggest += 1
+	if biggest == 1:
+		return [0]
+	return sorted(_first_clique(edges, n, biggest)[0])
+
@@ -1,6 +1,8 @@
 
 import network2
 import utils
+import cliques
+import pairwise
 import doc
 
 import multiprocessing
@@ -26,9 +28,29 @@ class Cluster:
 		else:
 			self.label = None
 
+
+def member_index(clusters):
+	'''
+	Index from each member to the position of its cluster in clusters
+	:return: { id(member) : cluster_idx }.  If a member is in several clusters, the first wins
+	'''
+	index = dict()
+	for x in xrange(len(clusters) - 1, -1, -1):
+		for member in clusters[x].members:
+			index[id(member)] = x
+	return index
+
 class BaseCONFIRM(object):
 	
 	NEW_CLUSTER = -1
+
+	# whether doc_similarity(x, y) == doc_similarity(y, x), so similarity matrices only
+	#   compute half of the pairs
+	symmetric_similarity = False
+
+	# worker processes for the similarity matrices
+	sim_mat_processes = 1
+
 	def __init__(self, docs, sim_thresh=None, **kwargs):
 		self.docs = docs
 		self.clusters = list()
@@ -135,41 +157,32 @@ class BaseCONFIRM(object):
 	def get_docs(self):
 		return self.docs
 
+	def _sim_mat(self, items, func, top_k=None):
+		'''
+		returns np.array - func over every pair of items, 1.0 on the diagonal.  With top_k,
+			(np.array, np.array) the indices and values of the top_k largest of each row.
+		'''
+		sim = lambda item1, item2: 1.0 if item1 == item2 else func(item1, item2)
+		if top_k is not None:
+			return pairwise.cross_matrix(items, items, sim, self.sim_mat_processes, k=top_k)
+		mode = 'symmetric' if self.symmetric_similarity else 'asymmetric'
+		return pairwise.pairwise_matrix(items, sim, mode, self.sim_mat_processes)
+
 	# Can be expensive if there are lots of clusters
-	def get_cluster_sim_mat(self):
-		mat = []
-		for clust1 in self.clusters:
-			row = []
-			for clust2 in self.clusters:
-				if clust1 == clust2:
-					row.append(1.0)
-				else:
-					row.append(self.cluster_similarity(clust1, clust2))
-			mat.append(row)
-		return mat
+	def get_cluster_sim_mat(self, top_k=None):
+		return self._sim_mat(self.clusters, self.cluster_similarity, top_k)
 
 	# not reccommended unless the data size is small
-	def get_doc_sim_mat(self):
-		mat = []
-		for doc1 in self.docs:
-			row = []
-			for doc2 in self.docs:
-				if doc1 == doc2:
-					row.append(1.0)
-				else:
-					row.append(self.doc_similarity(doc1, doc2))
-			mat.append(row)
-		return mat
+	def get_doc_sim_mat(self, top_k=None):
+		return self._sim_mat(self.docs, self.doc_similarity, top_k)
 
 	# may be expensive
-	def get_doc_cluster_sim_mat(self):
-		mat = []
-		for _doc in self.docs:
-			row = []
-			for cluster in self.clusters:
-				row.append(self.cluster_doc_similarity(cluster, _doc))
-			mat.append(row)
-		return mat
+	def get_doc_cluster_sim_mat(self, top_k=None):
+		'''
+		returns np.array - docs x clusters, or the top_k of each row (see _sim_mat)
+		'''
+		return pairwise.cross_matrix(self.docs, self.clusters, lambda _doc, cluster: self.cluster_doc_similarity(cluster, _doc),
+			self.sim_mat_processes, k=top_k)
 
 
 class AnalysingCONFIRM(BaseCONFIRM):
@@ -404,17 +417,8 @@ class WavgNetCONFIRM(RegionCONFIRM):
 		sim_vec = cluster.center.global_region_sim(_doc)
 		cluster.network.learn(sim_vec, 1)
 
-	def get_cluster_sim_mat(self):
-		mat = []
-		for clust1 in self.clusters:
-			row = []
-			for clust2 in self.clusters:
-				if clust1 == clust2:
-					row.append(1.0)
-				else:
-					row.append(self.cluster_doc_similarity(clust1, clust2.center))
-			mat.append(row)
-		return mat
+	def get_cluster_sim_mat(self, top_k=None):
+		return self._sim_mat(self.clusters, lambda clust1, clust2: self.cluster_doc_similarity(clust1, clust2.center), top_k)
 
 class PerfectWavgNetCONFIRM(WavgNetCONFIRM, PerfectCONFIRM):
 	pass
@@ -470,18 +474,16 @@ class MSTInitCONFIRM(BaseCONFIRM):
 
 	def _init_clusters(self):
 		sub_docs = self.docs[:self.num_instances]
-		sim_mat = utils.pairwise(sub_docs, 
-			lambda x, y: max(self.doc_similarity(x, y), self.doc_similarity(y, x)))
+		sim_mat = pairwise.pairwise_matrix(sub_docs, self.doc_similarity, 'max')
 
 		edges = utils.minimum_spanning_tree(sim_mat)
-		ccs = utils.get_ccs(range(self.num_instances), edges) 
-		biggest_cc = max(map(len, ccs))
-		while biggest_cc > self.num_init:
-			edge_to_remove = random.sample(edges, 1)[0]
-			edges.remove(edge_to_remove)
-			ccs = utils.get_ccs(range(self.num_instances), edges)
-			biggest_cc = max(map(len, ccs))
-		cc = ccs[utils.argmax(map(len, ccs))]
+		forest = utils.ForestComponents(len(sub_docs), edges)
+		while len(forest.largest_cc()) > self.num_init:
+			# swap the removed edge with the last so removal is O(1)
+			idx = random.randrange(len(edges))
+			edges[idx], edges[-1] = edges[-1], edges[idx]
+			forest.remove_edge(edges.pop())
+		cc = forest.largest_cc()
 
 		for idx in cc:
 			self._add_cluster(self.docs[idx], member=False)
@@ -501,14 +503,13 @@ class MaxCliqueInitCONFIRM(BaseCONFIRM):
 	def _init_clusters(self):
 		super(MaxCliqueInitCONFIRM, self)._init_clusters()
 		sub_docs = self.docs[:self.num_instances]
-		sim_mat = utils.pairwise(sub_docs, 
-			lambda x, y: max(self.doc_similarity(x, y), self.doc_similarity(y, x)))
+		sim_mat = pairwise.pairwise_matrix(sub_docs, self.doc_similarity, 'max')
 
 		print
 		print "Doc Sim Mat"
 		utils.print_mat(utils.apply_mat(sim_mat, lambda x: "%3.2f" % x))
 
-		idxs = utils.find_best_clique(sim_mat, self.num_clust)
+		idxs = cliques.find_best_clique(sim_mat, self.num_clust)
 
 		print 
 		print "Cluster Labels:"
@@ -655,8 +656,7 @@ class OneNNInitGlobalThresholdCONFIRM(InterpolatedThresholdCONFIRM):
 	
 	def _init_global_thresh(self):
 		sub_docs = self.docs[:20]
-		sim_mat = utils.pairwise(sub_docs, 
-			lambda x, y: max(self.doc_similarity(x, y), self.doc_similarity(y, x)))
+		sim_mat = pairwise.pairwise_matrix(sub_docs, self.doc_similarity, 'max').tolist()
 		for x in xrange(len(sim_mat)):
 			del sim_mat[x][x]
 		self.global_thresh = .7 #utils.avg(map(max, sim_mat))
@@ -825,6 +825,7 @@ class ParallelCONFIRM(BaseCONFIRM):
 	def __init__(self, docs, processes=4, **kwargs):
 		super(ParallelCONFIRM, self).__init__(docs, **kwargs)
 		self.num_processes = processes
+		self.sim_mat_processes = processes
 		self.pool = multiprocessing.Pool(processes=processes)
 
 	def _calc_sim_scores(self, _doc):
@@ -835,35 +836,6 @@ class ParallelCONFIRM(BaseCONFIRM):
 		tmp =  self.pool.map(calc_single_val, self.clusters)#, len(self.clusters) / self.num_processes + 1)
 		print tmp
 		return tmp
-
-	def get_cluster_sim_mat(self):
-		mat = [ [0] * (len(self.clusters)) for _ in xrange(len(self.clusters))]
-		confirm = self
-		nclusters = len(self.clusters)
-		def calc_single_val(val): 
-			i = val / nclusters
-			j = val % nclusters
-			if i == j:
-				mat[i][j] = 1.0
-			else:
-				mat[i][j] = confirm.cluster_similarity(confirm.clusters[i], confirm.clusters[j])
-		self.pool.map(calc_single_val, xrange(nclusters ** 2), 100)
-		return mat
-
-	# may be expensive
-	def get_doc_cluster_sim_mat(self):
-		mat = [ [0] * (len(self.clusters)) for _ in xrange(len(self.docs))]
-		confirm = self
-		nclusters = len(self.clusters)
-		def calc_single_val(val): 
-			i = val / nclusters
-			j = val % nclusters
-			if i == j:
-				mat[i][j] = 1.0
-			else:
-				mat[i][j] = confirm.cluster_doc_similarity(confirm.clusters[j], confirm.docs[i])
-		self.pool.map(calc_single_value, xrange(nclusters * len(self.docs)), 100)
-		return mat
 		
 		
 class TestCONFIRM(MaxCliqueInitCONFIRM, RedistributePruningCONFIRM, TwoPassCONFIRM, InfoCONFIRM):
@@ -1,10 +1,11 @@
 #!/usr/bin/python
 
-import PIL
+import os
 import tkFileDialog
 import random
 import doc
 import utils
+import thumbs
 import sys
 from Tkinter import *
 from ttk import Style
@@ -12,15 +13,21 @@ from PIL import Image, ImageTk
 
 
 
+#Milliseconds between checks for finished thumbnails
+_pollInterval = 50
+
 class ClusterFrame(Frame):
-    def __init__(self, parent, cluster):
+    def __init__(self, parent, cluster, thumbCache=None):
         Frame.__init__(self,parent)
 
+        if (thumbCache == None):
+            thumbCache = thumbs.ThumbnailCache()
+        self.thumbs = thumbs.ThumbnailService(thumbCache)
+
         self.cluster = cluster
         self.prototype = self.cluster.center
-        self.protoImg = self.cluster.center.draw()
 
-        img = resizeImage(self.protoImg,800)
+        img = thumbCache.get(self.prototype, 800)
         i = ImageTk.PhotoImage(img)
 
         self.protolbl = Label(self,image=i, bg="grey", width=800, height=800, padx=5, pady=5)
@@ -40,6 +47,14 @@ class ClusterFrame(Frame):
         self.thumbCanvas.bind("<Button-4>", lambda event: self.thumbCanvas.yview("scroll", -1, 'units'))
         self.thumbCanvas.bind("<Button-5>", lambda event: self.thumbCanvas.yview("scroll", 1, 'units'))
 
+        self.pollThumbs()
+
+    def pollThumbs(self):
+        try:
+            self.thumbs.poll()
+        finally:
+            # keep polling even if a callback failed, or no thumbnail is shown again
+            self.after(_pollInterval, self.pollThumbs)
 
     def fillThumbs(self):
         members =self.cluster.members
@@ -51,16 +66,20 @@ class ClusterFrame(Frame):
 
         total = len(members)
 
+        #Thumbnails are at most 400 tall, so every member gets a 400 tall slot
+        #and each is placed in its slot when it has been loaded
         for k,m in enumerate(members):
-            print "adding Image to thumbnails (%d/%d)" % (k+1,total)
-            img = resizeImage(m.draw(), 400)
-            i = ImageTk.PhotoImage(img)
-            self.thumbCanvas.create_image(x,y,image=i)
-            self.thumbImgs.append(i)
-            y += i.height()+10
+            self.thumbs.request(m, 400, lambda img, k=k, y=y: self.addThumb(img, k, x, y))
+            y += 400+10
 
         self.thumbCanvas.config(scrollregion=(0,0,x,y))
 
+    def addThumb(self, img, k, x, y):
+        print "adding Image to thumbnails (%d/%d)" % (k+1,len(self.cluster.members))
+        i = ImageTk.PhotoImage(img)
+        self.thumbCanvas.create_image(x,y,image=i)
+        self.thumbImgs.append(i)
+
 
 def main(args):
 
@@ -74,31 +93,14 @@ def main(args):
 
     clustering = utils.load_obj(path)
 
+    #thumbnails are kept next to the clustering
+    cache = thumbs.ThumbnailCache(path + ".thumbs", context=(os.path.abspath(path), os.path.getmtime(path)))
+
     root = Tk()
-    frame = ClusterFrame(root, clustering[C])
+    frame = ClusterFrame(root, clustering[C], thumbCache=cache)
     frame.grid()
     root.mainloop()  
 
-def resizeImage(img, scale):
-    
-    wsize = hsize = scale
-
-    width =  img.size[0]
-    height = img.size[1]
-
-    if(width > height):
-        wpercent = (scale/float(width))
-        hsize = int((float(height)*float(wpercent)))
-    else:
-        hpercent = (scale/float(height))
-        wsize = int((float(width)*float(hpercent)))
-    
-    
-    i = img.resize((4*wsize,4*hsize), PIL.Image.NEAREST)
-    i = i.resize((2*wsize,2*hsize), PIL.Image.BILINEAR)
-    i = i.resize((wsize,hsize),PIL.Image.ANTIALIAS)
-    return i
-
 def insertTag(tag, *args):
         for widget in args:
             widget.bindtags((tag,) + widget.bindtags())
@@ -0,0 +1,141 @@
+
+import random
+import resource
+import numpy as np
+import scipy.spatial.distance
+
+# descriptors matched against the codebook at a time, bounding the distance block to
+#   _block_size x codebook_size
+_block_size = 2048
+
+# at most this many members of a codeword's cell are costed against each other to find
+#   a candidate for its medoid
+_medoid_sample_size = 1000
+
+
+def peak_memory_mb():
+	''' returns float - the peak resident memory of this process in MB (linux reports KB) '''
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def nearest_codewords(descriptors, codebook, metric='cityblock', block_size=_block_size):
+	'''
+	returns (np.array, np.array) - the index of the closest codeword to each descriptor
+		and the distance to it.  Descriptors are compared block_size at a time.
+	'''
+	num_descriptors = descriptors.shape[0]
+	indices = np.zeros(num_descriptors, dtype=np.int64)
+	dists = np.zeros(num_descriptors)
+	for start in xrange(0, num_descriptors, block_size):
+		block = scipy.spatial.distance.cdist(descriptors[start:start + block_size], codebook, metric=metric)
+		indices[start:start + block_size] = block.argmin(axis=1)
+		dists[start:start + block_size] = block[np.arange(block.shape[0]), indices[start:start + block_size]]
+	return indices, dists
+
+
+def quantize(descriptors, codebook, metric='cityblock', block_size=_block_size):
+	'''
+	returns np.array - the index of the closest codeword to each descriptor, the same as
+		cdist(codebook, [descriptor]).argmin() for each descriptor, but computed for a
+		whole page of descriptors in block_size x codebook_size distance blocks.
+	'''
+	if descriptors is None or not len(descriptors):
+		return np.zeros(0, dtype=np.int64)
+	return nearest_codewords(np.asarray(descriptors, dtype=np.float64), codebook, metric, block_size)[0]
+
+
+def seed_codewords(descriptors, k, metric='cityblock'):
+	'''
+	k-means++ seeding: each next seed is drawn with probability proportional to its
+		distance from the closest seed so far.  Only one distance per descriptor is kept.
+		returns np.array - the indices of the k seed descriptors
+	'''
+	num_descriptors = descriptors.shape[0]
+	seeds = [random.randint(0, num_descriptors - 1)]
+	min_dists = scipy.spatial.distance.cdist(descriptors, descriptors[seeds], metric=metric)[:, 0]
+	while len(seeds) < k:
+		total = min_dists.sum()
+		if total > 0:
+			seed = int(np.searchsorted(np.cumsum(min_dists), random.random() * total))
+			seed = min(seed, num_descriptors - 1)
+		else:
+			# every descriptor is a duplicate of a seed
+			seed = random.choice(list(set(xrange(num_descriptors)) - set(seeds)))
+		seeds.append(seed)
+		dists = scipy.spatial.distance.cdist(descriptors, descriptors[seed:seed + 1], metric=metric)[:, 0]
+		min_dists = np.minimum(min_dists, dists)
+	return np.array(seeds)
+
+
+def _cell_medoid(descriptors, members, curr_medoid, metric):
+	'''
+	returns int - the medoid of a codeword's cell, members.  Large cells are sampled to find
+		a candidate, which only replaces the current medoid if its summed distance to the
+		whole cell is lower, so the cost of the cell never goes up.
+	'''
+	sample = members
+	if len(members) > _medoid_sample_size:
+		sample = np.array(random.sample(members, _medoid_sample_size - 1))
+	candidates = np.union1d(sample, [curr_medoid])
+	costs = scipy.spatial.distance.cdist(descriptors[candidates], descriptors[candidates], metric=metric).sum(axis=1)
+	candidate = candidates[costs.argmin()]
+	if sample is not members and candidate != curr_medoid:
+		# the sample only nominates the candidate; the whole cell decides
+		costs = scipy.spatial.distance.cdist(descriptors[[curr_medoid, candidate]], descriptors[members],
+			metric=metric).sum(axis=1)
+		candidates = np.array([curr_medoid, candidate])
+	# ties keep the current medoid
+	return candidate if costs.min() < costs[candidates == curr_medoid][0] else curr_medoid
+
+
+def build_codebook(descriptors, k, metric='cityblock', max_iters=30, _print=False):
+	'''
+	k-medoids over descriptors (e.g. SURFs) with sampled medoid candidates.  The codewords
+		are seeded with k-means++ and then each is moved to the medoid of the descriptors
+		closest to it (see _cell_medoid) until no codeword moves.  The full pairwise distance
+		matrix is never built, so memory is O(N * block_size + k + sample_size^2) instead of
+		O(N^2).
+		returns np.array - k x D array of codewords, each one of the descriptors
+	'''
+	descriptors = np.asarray(descriptors, dtype=np.float64)
+	if descriptors.shape[0] <= k:
+		return descriptors.copy()
+
+	indices = seed_codewords(descriptors, k, metric)
+	for iter_num in xrange(max_iters):
+		assignments = nearest_codewords(descriptors, descriptors[indices], metric)[0]
+		new_indices = indices.copy()
+		for x in xrange(k):
+			members = np.where(assignments == x)[0]
+			if len(members):
+				new_indices[x] = _cell_medoid(descriptors, members, indices[x], metric)
+		num_moved = (new_indices != indices).sum()
+		indices = new_indices
+		if _print:
+			print "\t\tIteration %d: %d codewords moved" % (iter_num + 1, num_moved)
+		if not num_moved:
+			break
+
+	codebook = descriptors[indices]
+	if _print:
+		print_codebook_quality(descriptors, codebook, metric)
+	return codebook
+
+
+def codebook_quality(descriptors, codebook, metric='cityblock'):
+	'''
+	returns (float, int) - the mean distance of the descriptors to their closest codeword
+		and the number of codewords that no descriptor is closest to
+	'''
+	indices, dists = nearest_codewords(np.asarray(descriptors, dtype=np.float64), codebook, metric)
+	num_unused = codebook.shape[0] - len(np.unique(indices))
+	return dists.mean(), num_unused
+
+
+def print_codebook_quality(descriptors, codebook, metric='cityblock'):
+	mean_dist, num_unused = codebook_quality(descriptors, codebook, metric)
+	print "\tCodebook: %d codewords from %d descriptors" % (codebook.shape[0], descriptors.shape[0])
+	print "\t\tMean %s distance to closest codeword: %.3f" % (metric, mean_dist)
+	print "\t\tUnused codewords: %d" % num_unused
+	print "\t\tPeak memory: %.1f MB" % peak_memory_mb()
+
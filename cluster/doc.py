@@ -73,6 +73,32 @@ def get_docs_nested(data_dir, pr=True):
 	return all_docs
 
 
+def iter_docs_nested(data_dir, unload=False):
+	'''
+	Generator of the Documents two directories down from data_dir, like get_docs_nested,
+		but each Document is only read when it is reached.  Documents that
+		cannot be read are skipped.
+		unload - boolean to only keep the id, label and size of each Document.  Its
+			features are read from its file again when they are used.
+	'''
+	for _dir in sorted(os.listdir(data_dir)):
+		r_dir = os.path.join(data_dir, _dir)
+		if not os.path.isdir(r_dir):
+			continue
+		for f in sorted(os.listdir(r_dir)):
+			if not f.endswith(".txt") or blacklist.contains(f[0:-4]):
+				continue
+			try:
+				_doc = get_doc(r_dir, f)
+				_doc._load_check()
+			except Exception, e:
+				traceback.print_exc()
+				continue
+			if unload:
+				_doc.unload()
+			yield _doc
+
+
 
 class Document:
 	'''
@@ -94,6 +120,9 @@ class Document:
 		self.feature_sets = list()
 		self.feature_set_names = list()
 		self.feature_name_map = dict()
+		# incremented whenever the features are modified in place, so values derived from
+		#   them can tell they are stale
+		self.version = 0
 		if not LOAD_DOC_LAZY and self.source_file:
 			self.load()
 	
@@ -115,6 +144,18 @@ class Document:
 
 		return cpy
 
+	def unload(self):
+		'''
+		Frees the features of a document that can be reloaded from its file.  The id,
+			label and size are kept.
+		'''
+		if not self.source_file:
+			return
+		self.loaded = False
+		self.feature_sets = list()
+		self.feature_set_names = list()
+		self.feature_name_map = dict()
+
 	def _load_check(self):
 		if not self.loaded:
 			self.load()
@@ -265,6 +306,7 @@ class Document:
 		self.size = (max(self.size[0], other.size[0]), max(self.size[1], other.size[1]))
 		for feature_set1, feature_set2 in zip(self.feature_sets, other.feature_sets):
 			feature_set1.aggregate(feature_set2)
+		self.modified()
 
 		self.prune()
 
@@ -275,6 +317,7 @@ class Document:
 		'''
 		for feature_set in self.feature_sets:
 			feature_set.prune()
+		self.modified()
 
 	def final_prune(self):
 		'''
@@ -283,6 +326,7 @@ class Document:
 		'''
 		for feature_set in self.feature_sets:
 			feature_set.prune_final()
+		self.modified()
 
 	def push_away(self, other):
 		'''
@@ -292,6 +336,12 @@ class Document:
 		other._load_check()
 		for feature_set1, feature_set2 in zip(self.feature_sets, other.feature_sets):
 			feature_set1.push_away(feature_set2)
+		self.modified()
+
+	def modified(self):
+		''' Marks the features as changed in place '''
+		# documents pickled before versions existed start at 0
+		self.version = getattr(self, 'version', 0) + 1
 
 	def match_vector(self, other, feature_type):
 		self._load_check()
@@ -0,0 +1,52 @@
+
+import doc
+
+
+class DocStore:
+	'''
+	Maps document ids to the feature files they were loaded from.  Worker processes
+		are handed a DocStore once and then only receive document ids, loading (and
+		caching) the Documents themselves instead of unpickling copies for every task.
+	'''
+
+	def __init__(self, docs=None):
+		'''
+		docs - list(Document) to make available by id
+		'''
+		self.sources = dict()
+		self.docs = dict()
+		if docs:
+			self.add_docs(docs)
+
+	def add_docs(self, docs):
+		for _doc in docs:
+			self.sources[_doc._id] = _doc.source_file
+
+	def can_load(self, docs):
+		'''
+		returns True if every doc can be reloaded by id from its feature file.
+			Prototypes made by Document.copy() have no source file.
+		'''
+		for _doc in docs:
+			if not _doc.source_file or self.sources.get(_doc._id) != _doc.source_file:
+				return False
+		return True
+
+	def get(self, _id):
+		if _id not in self.docs:
+			_doc = doc.Document(_id, self.sources[_id])
+			_doc._load_check()
+			self.docs[_id] = _doc
+		return self.docs[_id]
+
+	def get_docs(self, ids):
+		return map(self.get, ids)
+
+	def __getstate__(self):
+		# only the id -> file mapping is sent to workers, never loaded Documents
+		return {'sources': self.sources}
+
+	def __setstate__(self, state):
+		self.sources = state['sources']
+		self.docs = dict()
+
@@ -76,6 +76,21 @@ def parse_args():
 				'this is a lower-bound on the value used')
 	group.add_argument('--minpts-perc', type=float, default=0.1,
 			help='For adaptive min_pts, multiplier for the cluster size')
+	group.add_argument('--processes', type=int, default=1,
+			help='number of worker processes used to refine clusters and build prototypes')
+	group.add_argument('--prototypes', type=str, default='fold', choices=['fold', 'tree'],
+			help='build prototypes by folding members in sequentially or by aggregating them in a balanced tree')
+	group.add_argument('--check-prototypes', default=False, action='store_true',
+			help='compare tree prototypes against the sequential fold on the refined clusters')
+
+	parser.add_argument('--save-model', type=str, default='',
+			help='directory to save the prototypes and classifier of each run to, for classifying new documents with model.py')
+	parser.add_argument('--chunk-size', type=int, default=0,
+			help='classify all documents this many at a time instead of building the full bootstrap feature matrix.  Document features are read from disk a chunk at a time')
+	parser.add_argument('--save-assignments', type=str, default='',
+			help='directory to write the bootstrap assignment of every document of each run to (with --chunk-size)')
+	parser.add_argument('--cache-dir', type=str, default='',
+			help='directory to cache feature and similarity matrices in across runs')
 
 	args = parser.parse_args()
 	return args
@@ -93,7 +108,11 @@ def process_args(args):
 	num_types =  map(int, args.num_types.split(",")) if not args.rand_exemplars else []
 	num_types.sort()
 
-	docs = doc.get_docs_nested(get_data_dir(args.dataset))
+	if args.chunk_size > 0:
+		# features are only read when documents are matched, a chunk at a time
+		docs = list(doc.iter_docs_nested(get_data_dir(args.dataset), unload=True))
+	else:
+		docs = doc.get_docs_nested(get_data_dir(args.dataset))
 	random.shuffle(docs)
 	num_docs = len(docs)
 
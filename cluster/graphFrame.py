@@ -1,12 +1,14 @@
 #!/usr/bin/python
 
-import PIL
+import os
 import tkFileDialog
+import multiprocessing
 import random
 import doc
 import utils
 import sys
 import mds
+import thumbs
 import driver
 from hierarchy import Hierarchy
 from Tkinter import *
@@ -41,8 +43,14 @@ class Point:
     def __div__(self,other):
         return self.point.__div__(other)
 
+#Size of the thumbnail shown when hovering over a point
+_hoverSize = 300
+
+#Milliseconds between checks for finished thumbnails
+_pollInterval = 50
+
 class GraphFrame(Frame):
-    def __init__(self, parent, hierarchy, showReps=False):
+    def __init__(self, parent, hierarchy, showReps=False, thumbService=None):
         
         self.width = 800
         self.height = 800
@@ -55,6 +63,13 @@ class GraphFrame(Frame):
         #self.docs = docs.members
         self.hierarchy = hierarchy
         self.displayRepresentatives = showReps
+
+        #Thumbnails are loaded in the background and shared with popup windows.
+        #Only one frame polls the service.
+        if (thumbService == None):
+            thumbService = thumbs.ThumbnailService(thumbs.ThumbnailCache())
+            self.after(_pollInterval, self.pollThumbs)
+        self.thumbs = thumbService
         
         #precompute similarity matrix. Does not change.
         #self.similarities = utils.pairwise(self.docs, lambda x,y: x.similarity(y))
@@ -118,7 +133,7 @@ class GraphFrame(Frame):
        
             hierarchy = Hierarchy(representatives=reps)
        
-        frame = GraphFrame(popup, hierarchy)
+        frame = GraphFrame(popup, hierarchy, thumbService=self.thumbs)
         frame.pack(fill=BOTH, expand=1)
         
     def mouseDown(self, event):
@@ -134,10 +149,14 @@ class GraphFrame(Frame):
         #print tag
         point = self.findHierarchy(tag)
         #print "Found point"
-        thumbIm = self.getPhotoImage(point, 300)
+        self.hovered = point
         
+        def show(img):
+            #Only show the thumbnail if the mouse has not moved on to another point
+            if (self.hovered is point):
+                self.displayThumb(ImageTk.PhotoImage(img), title=point.hierarchy.uId)
         
-        self.displayThumb(thumbIm, title=point.hierarchy.uId)
+        self.thumbs.request(point.hierarchy.center, _hoverSize, show)
         
         
         #print "generated Thumb"
@@ -178,7 +197,7 @@ class GraphFrame(Frame):
         
         hierarchy = Hierarchy(representatives=map(lambda s: self.findHierarchy(s).hierarchy, self.selected))
         
-        frame = GraphFrame(popup, hierarchy, showReps=True)
+        frame = GraphFrame(popup, hierarchy, showReps=True, thumbService=self.thumbs)
         frame.pack(fill=BOTH,expand=1)
 
     def shiftDoubleClickPoint(self,event):
@@ -236,26 +255,24 @@ class GraphFrame(Frame):
 
         point = self.findHierarchy(docTag)
 
-        im = self.getPhotoImage(point,800)
+        def show(img):
+            im = ImageTk.PhotoImage(img)
 
-        popup = Toplevel(self)
-        popup.title("Doc " + str(point.hierarchy.uId))
-    
+            popup = Toplevel(self)
+            popup.title("Doc " + str(point.hierarchy.uId))
 
-        lbl = Label(popup, image=im)
-        lbl.image = im
-        lbl.pack()
+            lbl = Label(popup, image=im)
+            lbl.image = im
+            lbl.pack()
 
-    def getPhotoImage(self, point, size=800):
-        
-        if(point.image == None):
-            _doc = point.hierarchy.center
+        self.thumbs.request(point.hierarchy.center, 800, show)
 
-            point.image = _doc.draw()
-        
-        im = ImageTk.PhotoImage(resizeImage(point.image, size))
-        
-        return im
+    def pollThumbs(self):
+        try:
+            self.thumbs.poll()
+        finally:
+            # keep polling even if a callback failed, or no thumbnail is shown again
+            self.after(_pollInterval, self.pollThumbs)
 
     def findHierarchy(self, docTag):
         idx = docTag[4:]
@@ -295,6 +312,9 @@ class GraphFrame(Frame):
         #normalize points to fit in view
         self.points = self.normalizeHierarchy(hierarchy)
         self.drawPoints(self.points)
+
+        #Render the hover thumbnails before they are asked for
+        self.thumbs.prefetch(map(lambda p: p.hierarchy.center, self.points), _hoverSize)
         
     
     def displayThumb(self, thumb, title=""):
@@ -453,34 +473,28 @@ def main(args):
     clustering = utils.load_obj(path)
     #clustering  = doc.get_docs_nested(driver.get_data_dir("very_small"))
         
-    hierarchy = Hierarchy.createHierarchy(clustering)
+    # layouts are saved next to the clustering and only reused if it has not changed since
+    layoutPath = path + ".layout"
+    if (os.path.exists(layoutPath) and os.path.getmtime(layoutPath) >= os.path.getmtime(path)):
+        print "Loading Layouts"
+        hierarchy = Hierarchy.loadHierarchy(clustering, layoutPath)
+    else:
+        hierarchy = Hierarchy.createHierarchy(clustering)
+
+    print "Computing Layouts"
+    hierarchy.reduce(processes=multiprocessing.cpu_count())
+    hierarchy.saveLayouts(layoutPath)
+
+    #thumbnails are kept next to the clustering too
+    cache = thumbs.ThumbnailCache(path + ".thumbs", context=(os.path.abspath(path), os.path.getmtime(path)))
 
     print "Starting GUI"
     root = Tk()
-    frame = GraphFrame(root, hierarchy)
+    frame = GraphFrame(root, hierarchy, thumbService=thumbs.ThumbnailService(cache))
     frame.pack(fill=BOTH,expand=1)
+    frame.pollThumbs()
     root.mainloop()  
 
-def resizeImage(img, scale):
-    
-    wsize = hsize = scale
-
-    width =  img.size[0]
-    height = img.size[1]
-
-    if(width > height):
-        wpercent = (scale/float(width))
-        hsize = int((float(height)*float(wpercent)))
-    else:
-        hpercent = (scale/float(height))
-        wsize = int((float(width)*float(hpercent)))
-    
-    
-    i = img.resize((4*wsize,4*hsize), PIL.Image.NEAREST)
-    i = i.resize((2*wsize,2*hsize), PIL.Image.BILINEAR)
-    i = i.resize((wsize,hsize),PIL.Image.ANTIALIAS)
-    return i
-
 def insertTag(tag, *args):
         for widget in args:
             widget.bindtags((tag,) + widget.bindtags())
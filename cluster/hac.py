@@ -0,0 +1,147 @@
+
+import numpy as np
+import scipy.spatial.distance
+
+_linkages = ['single', 'complete', 'average']
+
+
+def _square_distances(distances):
+	'''
+	returns a float square distance matrix with an infinite diagonal.
+		distances - square matrix (list of lists or array) or a condensed
+			distance vector as returned by scipy.spatial.distance.pdist
+	'''
+	mat = np.array(distances, dtype=np.float64)
+	if mat.ndim == 1:
+		mat = scipy.spatial.distance.squareform(mat, checks=False)
+	else:
+		mat = mat.copy()
+	np.fill_diagonal(mat, np.inf)
+	return mat
+
+
+def _lance_williams(method, row_a, row_b):
+	'''
+	returns the distances of every cluster to the union of clusters a and b.  For
+		'average', the rows are the sums of member distances, which add up.
+	'''
+	if method == 'single':
+		return np.minimum(row_a, row_b)
+	elif method == 'complete':
+		return np.maximum(row_a, row_b)
+	elif method == 'average':
+		return row_a + row_b
+	raise Exception("Unknown linkage method %r.  Choose from %s" % (method, _linkages))
+
+
+def _row_nn(mat, i):
+	'''
+	returns (float, int) - the distance to and index of the nearest cluster after i,
+		the lowest index on ties
+	'''
+	row = mat[i, i + 1:]
+	if not len(row):
+		return np.inf, -1
+	j = int(np.argmin(row))
+	return row[j], i + 1 + j
+
+
+def linkage(distances, method='single'):
+	'''
+	Builds the full agglomerative hierarchy.  Each cluster caches its nearest cluster
+		after it, so a merge only rescans the rows that pointed at the merged clusters,
+		which is O(n^2) in practice.  Cluster distances are updated with the Lance-Williams
+		formula, so member pairs are never revisited.  Each merge is the closest pair
+		(x, y) with the lowest x, then y, on ties, as selector.HAC scanned for them.
+		returns list( (dist, x, y) ) - the merges in the order they are made.
+			x and y are point indices contained in the two merged clusters.
+	'''
+	if method not in _linkages:
+		raise Exception("Unknown linkage method %r.  Choose from %s" % (method, _linkages))
+	mat = _square_distances(distances)
+	num_points = mat.shape[0]
+	sizes = np.ones(num_points)
+	# average distances are the sum over member pairs divided by their number, as
+	#   selector.averageLink computes them, so they tie exactly when it would
+	totals = mat.copy() if method == 'average' else mat
+
+	# a cluster lives in the row of its smallest point that has not been merged away
+	active = np.ones(num_points, dtype=bool)
+	nn_dist = np.empty(num_points)
+	nn = np.empty(num_points, dtype=np.int64)
+	for i in xrange(num_points):
+		nn_dist[i], nn[i] = _row_nn(mat, i)
+
+	merges = list()
+	while len(merges) < num_points - 1:
+		keep = int(np.argmin(nn_dist))
+		drop = int(nn[keep])
+		merges.append( (nn_dist[keep], keep, drop) )
+
+		sizes[keep] += sizes[drop]
+		active[drop] = False
+		row = _lance_williams(method, totals[keep], totals[drop])
+		row[~active] = np.inf
+		if method == 'average':
+			totals[keep, :] = row
+			totals[:, keep] = row
+			row = row / (sizes[keep] * sizes)
+		mat[keep, :] = row
+		mat[:, keep] = row
+		mat[keep, keep] = np.inf
+		mat[drop, :] = np.inf
+		mat[:, drop] = np.inf
+		nn_dist[drop] = np.inf
+
+		# rows whose nearest cluster was merged are rescanned
+		for i in np.flatnonzero(active & ((nn == keep) | (nn == drop))):
+			nn_dist[i], nn[i] = _row_nn(mat, i)
+		nn_dist[keep], nn[keep] = _row_nn(mat, keep)
+
+		# earlier rows may now be nearest to the merged cluster
+		dists = mat[:keep, keep]
+		closer = active[:keep] & ((dists < nn_dist[:keep]) | ((dists == nn_dist[:keep]) & (keep < nn[:keep])))
+		nn_dist[:keep][closer] = dists[closer]
+		nn[:keep][closer] = keep
+
+	return merges
+
+
+def cut(merges, num_points, k):
+	'''
+	Applies the merges in order until k clusters remain.
+		returns list(list(int)) ordered as selector.HAC always ordered them: clusters
+		are sorted by their smallest point, and a merged cluster lists the members of
+		the cluster with the smaller point first.
+	'''
+	parents = range(num_points)
+	members = dict( (x, [x]) for x in xrange(num_points) )
+
+	def find(x):
+		while parents[x] != x:
+			parents[x] = parents[parents[x]]
+			x = parents[x]
+		return x
+
+	for dist, x, y in merges[:max(num_points - k, 0)]:
+		root_x, root_y = find(x), find(y)
+		first, second = min(root_x, root_y), max(root_x, root_y)
+		parents[second] = first
+		members[first] += members.pop(second)
+
+	return map(lambda root: members[root], sorted(members.keys()))
+
+
+def HAC(distances, k=10, method='single'):
+	'''
+	returns list(list(int)) - k clusters of the indices of distances.
+		distances - square or condensed distance matrix
+		method - one of 'single', 'complete', 'average'
+	'''
+	num_points = len(distances)
+	if np.ndim(distances) == 1:
+		num_points = scipy.spatial.distance.num_obs_y(np.asarray(distances))
+	if num_points <= k:
+		return [[x] for x in xrange(num_points)]
+	return cut(linkage(distances, method), num_points, k)
+
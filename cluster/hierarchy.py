@@ -4,17 +4,41 @@ import selector
 import utils
 import sys
 import mds
+import multiprocessing
+import numpy as np
+
+# set in the parent before the pool forks, so workers reach the nodes without pickling docs
+_workerNodes = None
+
+
+def _reduceParHelper(task):
+    idx, classic, dim, landmarks = task
+    node = _workerNodes[idx]
+    node.reduce(classic, dim, landmarks)
+    return idx, node.layoutState()
+
 
 class Hierarchy:
 
     nextId = [0]
     
     @classmethod
-    def createHierarchy(cls, clustering):
-	
+    def createHierarchy(cls, clustering, repIndices=None):
+	'''
+	repIndices - for each cluster, the indices of its representative members, as saved in
+	    root.repIndices.  Selected with selector.selectWithHac when not given
+	'''
 	root = cls()
 	
-	psuedo = selector.selectWithHac(clustering)
+	if (repIndices == None):
+	    psuedo = selector.selectWithHac(clustering)
+	    repIndices = []
+	    for i, reps in enumerate(psuedo):
+		memberIdx = dict((id(m), j) for j, m in enumerate(clustering[i].members))
+		repIndices.append(map(lambda r: memberIdx[id(r)], reps))
+	else:
+	    psuedo = map(lambda (c, idxs): map(lambda j: c.members[j], idxs), zip(clustering, repIndices))
+	root.repIndices = repIndices
 	
 	map(lambda x: root.addRepresentative(cls(x.center)), clustering)
 	
@@ -23,6 +47,21 @@ class Hierarchy:
 	
 	return root
 	
+    @classmethod
+    def loadHierarchy(cls, clustering, layoutPath):
+	'''
+	createHierarchy with the representatives, sim matrices and layouts saved to layoutPath
+	    by saveLayouts.  The saved representatives are only used if they fit clustering.
+	'''
+	state = utils.load_obj(layoutPath)
+	repIndices = state['repIndices']
+	if (repIndices == None or len(repIndices) != len(clustering) or
+		any(map(lambda (c, idxs): any(map(lambda j: j >= len(c.members), idxs)), zip(clustering, repIndices)))):
+	    return cls.createHierarchy(clustering)
+	root = cls.createHierarchy(clustering, repIndices)
+	root.applyLayoutState(state['nodes'])
+	return root
+	
     def __init__(self, center = None, representatives = None, uId = None):
 	self.center = center
 	self.representatives = representatives
@@ -30,6 +69,11 @@ class Hierarchy:
 	self.mdsPos = None
 	self.simMat = None
 	
+	# (classic, dim, landmarks) -> np.array of the positions of the representatives,
+	#   followed by the center if there is one
+	self.layouts = {}
+	self.repIndices = None
+	
 	if(uId == None):
 	    self.uId = self.nextId[0]
 	    self.nextId[0] += 1
@@ -52,32 +96,100 @@ class Hierarchy:
 	self.center = center
 	
 	
-    def reduce(self, classic=False, dim=2):
+    def reduce(self, classic=False, dim=2, landmarks=None, processes=1):
+	'''
+	Embeds the representatives of this node and, recursively, of its subtrees.  Layouts
+	    are computed once per node and parameters, so reducing again only reuses them.
+	landmarks - when there are more than this many points, they are embedded with landmark
+	    MDS from their similarities to this many landmarks, without the full simMat
+	processes - the subtrees of the children are embedded by this many worker processes
+	'''
 	if(self.representatives == None):
 	    return
 	
-	docs = map(lambda x: x.center, self.representatives)
-    
-	if (self.center != None):
-	    docs.append(self.center)
-	
-	if (self.simMat == None):
-	    self.simMat = utils.pairwise(docs, lambda x,y: x.similarity(y))
+	self._embed(classic, dim, landmarks)
 	
-	points = []
-	if(classic):
-	    points = mds.classicMDS(self.simMat,dim)
+	if (processes > 1):
+	    self._reduceChildrenPar(classic, dim, landmarks, processes)
 	else:
-	    points = mds.reduction(self.simMat,dim)
-	    
+	    map(lambda x: x.reduce(classic,dim,landmarks), self.representatives)
+	
+    def _embed(self, classic, dim, landmarks):
+	key = (classic, dim, landmarks)
+	if key not in self.layouts:
+	    docs = map(lambda x: x.center, self.representatives)
+	
+	    if (self.center != None):
+		docs.append(self.center)
+	
+	    if (landmarks != None and len(docs) > landmarks):
+		points = mds.landmarkReduction(docs, dim, landmarks)
+	    else:
+		if (self.simMat == None):
+		    self.simMat = utils.pairwise(docs, lambda x,y: x.similarity(y))
+		if(classic):
+		    points = mds.classicMDS(self.simMat,dim)
+		else:
+		    points = mds.reduction(self.simMat,dim)
+	    self.layouts[key] = np.asarray(points)
+	
+	points = self.layouts[key]
 	if (self.center != None):    
 	    self.centerPos = points[-1]
 	    self.mdsPos = points[:-1]
 	else:
 	    self.mdsPos = points[:]
-	    
-	map(lambda x: x.reduce(classic,dim), self.representatives)
-    
+	
+    def _reduceChildrenPar(self, classic, dim, landmarks, processes):
+	global _workerNodes
+	_workerNodes = self.representatives
+	tasks = [(idx, classic, dim, landmarks) for idx, child in enumerate(self.representatives)
+	    if child.representatives != None]
+	pool = multiprocessing.Pool(processes)
+	try:
+	    for idx, state in pool.imap_unordered(_reduceParHelper, tasks):
+		child = self.representatives[idx]
+		child.applyLayoutState(state)
+		# every layout is cached now, so this only sets the positions
+		child.reduce(classic, dim, landmarks)
+	    pool.close()
+	finally:
+	    pool.terminate()
+	    pool.join()
+	    _workerNodes = None
+	
+    def layoutState(self, path=()):
+	'''
+	returns dict - (child index path) -> (simMat, layouts) of this node and its subtrees
+	'''
+	state = {path: (self.simMat, self.layouts)}
+	if (self.representatives != None):
+	    for i, child in enumerate(self.representatives):
+		state.update(child.layoutState(path + (i,)))
+	return state
+	
+    def applyLayoutState(self, state, path=()):
+	'''
+	Takes the sim matrices and layouts of layoutState().  Layouts that do not fit the
+	    number of points of their node are left out.
+	'''
+	if (self.representatives == None or path not in state):
+	    return
+	simMat, layouts = state[path]
+	numPoints = len(self.representatives) + (1 if self.center != None else 0)
+	if (simMat != None and len(simMat) == numPoints):
+	    self.simMat = simMat
+	for key, points in layouts.items():
+	    if (len(points) == numPoints):
+		self.layouts[key] = points
+	for i, child in enumerate(self.representatives):
+	    child.applyLayoutState(state, path + (i,))
+	
+    def saveLayouts(self, path):
+	'''
+	Writes the representatives and every computed sim matrix and layout to path
+	'''
+	utils.save_obj({'repIndices': self.repIndices, 'nodes': self.layoutState()}, path)
 	
     def __repr__(self):
 	children = None
@@ -2,12 +2,23 @@
 
 import numpy as np
 import sys
+import random
 import utils
+import pairwise
+import scipy.linalg
+import scipy.sparse.linalg
+import scipy.spatial.distance
 import doc
 import driver
 from sklearn.manifold import MDS
 from sklearn.metrics import euclidean_distances as dist
 
+# points embedded from their dissimilarities to this many landmarks by landmarkMDS
+_numLandmarks = 200
+
+# larger gram matrices use a Lanczos solver for the top eigenpairs
+_lanczosSize = 500
+
 class shapeArray:
 
     def __init__(self, data):
@@ -47,90 +58,106 @@ def hierarchyReduction(hierarchy, dim = 2, classic=False):
     map(lambda x: hierarchyReduction(x,dim), hierarchy.representatives)
 
 
-def getMat(value, n):
-    return [[value] * n for i in range(n)]
+def dissimilarities(simMat):
+    return 1 - np.asarray(simMat, dtype=np.float64)
 
 
-def stress(D, X, distance=utils.euclideanDistance):
-    
-    denominator = 0.0
-    numerator = 0.0
-    
-    for i in range(len(D)):
-        for j in range(i,len(D)):
-            d = D[i][j]
-            f = distance(X[i],X[j])
-            numerator += (f- d) ** 2
-            denominator += d ** 2
+def stress(D, X, metric='euclidean'):
+    '''
+    Kruskal stress of embedding X against dissimilarities D, over the pairs i <= j
+    '''
+    D = np.asarray(D, dtype=np.float64)
+    F = scipy.spatial.distance.cdist(X, X, metric)
+    upper = np.triu_indices(len(D))
+    numerator = ((F[upper] - D[upper]) ** 2).sum()
+    denominator = (D[upper] ** 2).sum()
     return np.sqrt(numerator/denominator)
 
+
+def doubleCenter(B):
+    '''
+    Turns squared dissimilarities B into the gram matrix -1/2 J B J, in place
+    '''
+    rowMeans = B.mean(axis=1)
+    colMeans = B.mean(axis=0)
+    B -= rowMeans[:, np.newaxis]
+    B -= colMeans[np.newaxis, :]
+    B += rowMeans.mean()
+    B *= -0.5
+    return B
+
+
+def topEigen(B, dim):
+    '''
+    returns (np.array, np.array) - the dim largest eigenvalues of symmetric B, largest first,
+        and their eigenvectors as columns.  Only those eigenpairs are computed.
+    '''
+    n = len(B)
+    dim = min(dim, n)
+    if n > _lanczosSize and dim < n - 1:
+        W, V = scipy.sparse.linalg.eigsh(B, k=dim, which='LA')
+    else:
+        W, V = scipy.linalg.eigh(B, eigvals=(n - dim, n - 1), overwrite_a=True)
+    order = np.argsort(W)[::-1]
+    return W[order], V[:, order]
+
+
 def classicMDS(simMat, dim = 2):
-    dis = map(lambda x: map(lambda y: 1-y, x), simMat)
-    
-    D = np.array(dis)
-    
-    
-    n = len(D)
-    Ones = np.array(getMat(1, n))
-    
-    I = np.array(getMat(0,n))
-    
-    for x in range(n):
-        I[x][x] = 1
+    D = dissimilarities(simMat)
+    W, V = topEigen(doubleCenter(D * D), dim)
 
+    # negative eigenvalues come from non-euclidean dissimilarities and add no dimension
+    X = V * np.sqrt(np.maximum(W, 0))
 
-    J = np.matrix(I - (1/float(n))*Ones)
-    
-    P = np.matrix(D*D)
-    
-    B = -0.5 * J * P * J
-    
+    print "Stress:", stress(D, X)
 
-    W,V = np.linalg.eigh(B)
+    return X
 
-    top = [0] * dim
-    
-    w = W[:]
-    
-    w = sorted(w, reverse=True)
-    
 
-    idx = np.where(W == w[0])
-    vectors = V[:,idx[0]]
-    values = W[idx]
-    
-    for i in range(1,dim):
-        idx = np.where(W == w[i])
-        vectors = np.append(vectors, V[:,idx[0]], axis = 1)
-        values = np.append(values, W[idx])
-            
-        
-        
+def chooseLandmarks(n, numLandmarks):
+    return sorted(random.sample(xrange(n), min(n, numLandmarks)))
 
-    
-    L = np.array(getMat(0.0,dim))
-    for i in range(dim):
-        L[i,i] = values[i]
-        
-    L = np.sqrt(L)
 
+def landmarkMDS(landmarkSims, landmarks, dim = 2):
+    '''
+    Landmark MDS (de Silva and Tenenbaum): classical MDS of the landmarks, then every point
+        is placed by triangulating its dissimilarities to the landmarks.  Costs O(n * m)
+        instead of O(n^2) for n points and m landmarks.
+    landmarkSims - n x m similarities of each point to each landmark
+    landmarks - the index of each landmark among the n points
+    '''
+    D2 = dissimilarities(landmarkSims) ** 2
+    W, V = topEigen(doubleCenter(D2[landmarks].copy()), dim)
+    keep = W > 0
+    pseudoInverse = (V[:, keep] / np.sqrt(W[keep])).T
+
+    X = np.zeros( (len(D2), dim) )
+    X[:, :keep.sum()] = -0.5 * np.dot(D2 - D2[landmarks].mean(axis=0), pseudoInverse.T)
+
+    print "Landmark Stress:", stress(np.sqrt(D2[landmarks]), X[landmarks])
 
-    X = np.array(vectors * L)
-    
-    print "Stress:", stress(dis,X)
-    
     return X
 
+
+def landmarkReduction(docs, dim = 2, numLandmarks = _numLandmarks, processes = 1):
+    '''
+    Embeds docs from their similarities to numLandmarks random landmark docs
+    '''
+    landmarks = chooseLandmarks(len(docs), numLandmarks)
+    landmarkSims = pairwise.cross_matrix(docs, map(lambda idx: docs[idx], landmarks),
+        lambda x,y: x.similarity(y), processes)
+    return landmarkMDS(landmarkSims, landmarks, dim)
+
 def reduction(simMat,N=2):
 
     #change similarity matrix into dissimilarity matrix
-    dis = map(lambda x: map(lambda y: 1-y, x), simMat)
+    dis = dissimilarities(simMat)
     #dis = dist(simMat)
     #dis = simMat
 
     #configure MDS to run 10 times. Also specify that data will be a dissimilarity matrix
     mds = MDS(n_components=N, n_init=10,max_iter=3000, metric=True, dissimilarity="precomputed")
-    mat = np.array(dis)
+    mat = dis
     
     #Run MDS
     fit = mds.fit(mat)
@@ -0,0 +1,120 @@
+
+import random
+import numpy as np
+
+# rows of the distance matrix summed at a time when costing medoid candidates
+_chunk_size = 512
+
+
+def medoid_costs(candidates, members, distances, chunk_size=_chunk_size):
+	'''
+	returns np.array - the summed distance of each candidate to all members.
+		Only a chunk_size x len(members) block of distances is copied at a time.
+		candidates - np.array of point indices
+		members - np.array of point indices
+		distances - square np.array
+	'''
+	costs = np.zeros(len(candidates))
+	for start in xrange(0, len(candidates), chunk_size):
+		rows = candidates[start:start + chunk_size]
+		costs[start:start + chunk_size] = distances[np.ix_(rows, members)].sum(axis=1)
+	return costs
+
+
+def medoid(members, distances, sample_size=None, chunk_size=_chunk_size):
+	'''
+	returns int - the member with the least summed distance to all other members.
+		Ties go to the earliest member.
+		sample_size - if given and there are more members, only a random sample of
+			the members are considered as the medoid (each is still costed
+			against every member)
+	'''
+	members = np.asarray(members, dtype=np.int64)
+	candidates = members
+	if sample_size and len(members) > sample_size:
+		candidates = np.sort(np.array(random.sample(members, sample_size), dtype=np.int64))
+	costs = medoid_costs(candidates, members, distances, chunk_size)
+	return candidates[costs.argmin()]
+
+
+def assign_points_to_clusters(medoids, distances):
+	distances_to_medoids = distances[:, medoids]
+	return medoids[np.argmin(distances_to_medoids, axis=1)]
+
+
+# *_medoids[k] is the index of the instance that is the medoid for the kth cluster
+# clusters[n] is the cluster assignment in [0,k-1] for the nth instance
+def cluster(distances, k=3, maxIters=100000, indent=2, _print=False):
+	'''
+	k-medoids clustering of a square distance matrix.
+		returns (np.array, np.array) - clusters[n] is the medoid of the nth point and
+			medoids[k] is the index of the medoid of the kth cluster
+	'''
+	m = distances.shape[0] # number of points
+
+	# Pick k random medoids.
+	curr_medoids = np.array([-1]*k)
+	while not len(np.unique(curr_medoids)) == k:
+		curr_medoids = np.array(random.sample(xrange(m), k))
+	old_medoids = np.array([-1]*k) # Doesn't matter what we initialize these to.
+	new_medoids = np.array([-1]*k)
+
+	iter_num = 1
+	# Until the medoids stop updating, do the following:
+	while not ((old_medoids == curr_medoids).all()):
+		# Assign each point to cluster with closest medoid.
+		if _print:
+			print "%sIteration %d" % (indent * "\t", iter_num)
+		iter_num += 1
+		clusters = assign_points_to_clusters(curr_medoids, distances)
+
+		# Update cluster medoids to be lowest cost point.
+		for x, curr_medoid in enumerate(curr_medoids):
+			cluster_members = np.where(clusters == curr_medoid)[0]
+			if not len(cluster_members):
+				# a duplicate of another medoid took all of its points
+				new_medoids[x] = curr_medoid
+				continue
+			# costs are summed afresh each iteration: correcting them by the points that moved
+			#   drifts by rounding and changes which of tied members argmin picks
+			new_medoids[x] = cluster_members[medoid_costs(cluster_members, cluster_members, distances).argmin()]
+
+		old_medoids[:] = curr_medoids[:]
+		curr_medoids[:] = new_medoids[:]
+		if iter_num > maxIters:
+			break
+
+	return clusters, curr_medoids
+
+
+def total_cost(medoids, distances):
+	return distances[:, medoids].min(axis=1).sum()
+
+
+def clara(distances, k=3, num_samples=5, sample_size=None, maxIters=100000, indent=2, _print=False):
+	'''
+	CLARA: runs k-medoids on num_samples random subsets of the points and keeps the
+		medoids that give the lowest total distance over all points.  Only the
+		sample_size x sample_size distances of a subset are clustered at a time.
+		Returns the same as cluster()
+	'''
+	m = distances.shape[0]
+	if sample_size is None:
+		sample_size = 40 + 2 * k
+	if sample_size >= m:
+		return cluster(distances, k, maxIters, indent, _print)
+
+	best_medoids = None
+	best_cost = None
+	for x in xrange(num_samples):
+		sample = np.sort(np.array(random.sample(xrange(m), sample_size)))
+		sample_medoids = cluster(distances[np.ix_(sample, sample)], k, maxIters, indent, _print)[1]
+		medoids = sample[sample_medoids]
+		cost = total_cost(medoids, distances)
+		if _print:
+			print "%sSample %d cost: %f" % (indent * "\t", x, cost)
+		if best_cost is None or cost < best_cost:
+			best_cost = cost
+			best_medoids = medoids
+	return assign_points_to_clusters(best_medoids, distances), best_medoids
+
@@ -7,12 +7,108 @@ import math
 import sys
 import os
 
-import sklearn.metrics
+import numpy as np
+import scipy.sparse
+from cluster import member_index
 
 _counts = ['TP', 'TN', 'FP', 'FN']
 eps = 10e-10
 _output_dir = "output/"
 
+
+def _comb2(counts):
+	return (counts * (counts - 1) / 2.0).sum()
+
+def entropy(counts):
+	'''
+	returns float - the entropy (natural log) of the distribution with these counts
+	'''
+	counts = counts[counts > 0].astype(np.float64)
+	if not len(counts):
+		return 1.0
+	total = counts.sum()
+	return -((counts / total) * (np.log(counts) - math.log(total))).sum()
+
+
+class ContingencyMatrix:
+	'''
+	Sparse label x cluster matrix of document counts.  Every metric of a clustering with
+		known labels is derived from it, so they cost O(#nonzero entries) instead of a pass
+		over the documents each.  The formulas follow sklearn.metrics.
+	'''
+
+	def __init__(self, true_labels, predicted_labels, num_labels, num_clusters):
+		'''
+		true_labels, predicted_labels - np.array the label and cluster index of each doc
+		'''
+		self.num_docs = len(true_labels)
+		self.mat = scipy.sparse.coo_matrix( (np.ones(self.num_docs, dtype=np.int64), (true_labels, predicted_labels)),
+			shape=(num_labels, num_clusters)).tocsr()
+		self.mat.sum_duplicates()
+		self.label_counts = np.asarray(self.mat.sum(axis=1)).ravel()
+		self.cluster_counts = np.asarray(self.mat.sum(axis=0)).ravel()
+
+	def dense(self):
+		return self.mat.toarray()
+
+	def assigned_counts(self, cluster_labels):
+		'''
+		returns np.array - predicted label x true label counts when each cluster predicts its
+			label in cluster_labels (-1 predicts no label)
+		'''
+		num_labels = self.mat.shape[0]
+		assigned = np.asarray(cluster_labels)
+		valid = np.where(assigned >= 0)[0]
+		indicator = scipy.sparse.coo_matrix( (np.ones(len(valid), dtype=np.int64), (valid, assigned[valid])),
+			shape=(self.mat.shape[1], num_labels)).tocsr()
+		return np.asarray((self.mat * indicator).todense()).T
+
+	def pr_counts(self, cluster_labels):
+		'''
+		returns dict(str -> np.array) - the TP, TN, FP and FN count of each label, with each
+			label as the positive class
+		'''
+		conf_mat = self.assigned_counts(cluster_labels)
+		tp = np.diag(conf_mat)
+		fp = conf_mat.sum(axis=1) - tp
+		fn = self.label_counts - tp
+		tn = self.num_docs - tp - fp - fn
+		return {'TP': tp, 'TN': tn, 'FP': fp, 'FN': fn}
+
+	def mutual_info(self):
+		coo = self.mat.tocoo()
+		nz = coo.data.astype(np.float64)
+		if not len(nz):
+			return 0.0
+		n = float(self.num_docs)
+		outer = self.label_counts[coo.row].astype(np.float64) * self.cluster_counts[coo.col]
+		return ((nz / n) * (np.log(nz) + math.log(n) - np.log(outer))).sum()
+
+	def homogeneity_completeness_v_measure(self):
+		if not self.num_docs:
+			return 1.0, 1.0, 1.0
+		entropy_c = entropy(self.label_counts)
+		entropy_k = entropy(self.cluster_counts)
+		mi = self.mutual_info()
+		homogeneity = mi / entropy_c if entropy_c else 1.0
+		completeness = mi / entropy_k if entropy_k else 1.0
+		if homogeneity + completeness == 0.0:
+			return homogeneity, completeness, 0.0
+		return homogeneity, completeness, 2.0 * homogeneity * completeness / (homogeneity + completeness)
+
+	def ari(self):
+		num_classes = (self.label_counts > 0).sum()
+		num_clusters = (self.cluster_counts > 0).sum()
+		if (num_classes == num_clusters == 1 or num_classes == num_clusters == 0 or
+				num_classes == num_clusters == self.num_docs):
+			return 1.0
+		sum_comb_c = _comb2(self.label_counts)
+		sum_comb_k = _comb2(self.cluster_counts)
+		sum_comb = _comb2(self.mat.data)
+		prod_comb = sum_comb_c * sum_comb_k / (self.num_docs * (self.num_docs - 1) / 2.0)
+		mean_comb = (sum_comb_c + sum_comb_k) / 2.0
+		return (sum_comb - prod_comb) / (mean_comb - prod_comb)
+
 class KnownClusterAnalyzer:
 
 	def __init__(self, confirm):
@@ -23,25 +119,22 @@ class KnownClusterAnalyzer:
 		self.docs = utils.flatten(map(lambda cluster: cluster.members, self.clusters))
 		self.all_labels = self.get_all_labels()
 		self.num_docs = len(self.docs)
+		self.cluster_index = member_index(self.clusters)
+
+		# one pass over the docs builds the contingency matrix everything else comes from
+		self.labels = sorted(self.all_labels)
+		self.label_idx = {label: x for x, label in enumerate(self.labels)}
+		self.true_labels = np.array(map(lambda _doc: self.label_idx[_doc.label], self.docs), dtype=np.int64)
+		self.predicted_labels = np.array(utils.flatten(map(lambda (x, cluster): [x] * len(cluster.members),
+			enumerate(self.clusters))), dtype=np.int64)
+		self.contingency = ContingencyMatrix(self.true_labels, self.predicted_labels, len(self.labels), len(self.clusters))
+		self.cluster_label_idxs = np.array(map(lambda cluster: self.label_idx.get(cluster.label, -1), self.clusters),
+			dtype=np.int64)
 
 		self.label_pr_mats = self.calc_label_pr_mats()
-		self.label_cluster_mat = self.calc_label_cluster_counts()
-		self.total_counts = {count: 0 for count in _counts}
-		for label in self.label_pr_mats:
-			for count in _counts:
-				n = self.label_pr_mats[label][count]
-				self.total_counts[count] += n
-		#print json.dumps(self.label_pr_mats, indent=4)
-
-		labels = list(self.all_labels)
-		mapping = {label: labels.index(label) for label in labels}
-		self.true_labels = map(lambda _doc: mapping[_doc.label], self.docs)
-		self.predicted_labels = list()
-		for _doc in self.docs:
-			for x, _cluster in enumerate(self.clusters):
-				if _doc in _cluster.members:
-					self.predicted_labels.append(x)
-					break
+		self.total_counts = {count: sum(map(lambda label: self.label_pr_mats[label][count], self.labels))
+			for count in _counts}
+		self.h_c_v = self.contingency.homogeneity_completeness_v_measure()
 
 	def preprocess_clusters(self):
 		self.clusters.sort(key=lambda cluster: len(cluster.members), reverse=True)
@@ -93,14 +186,13 @@ class KnownClusterAnalyzer:
 
 	def get_true_doc_histogram(self):
 		counts = collections.defaultdict(int)
-		for _doc in self.docs:
-			counts[_doc.label] += 1
+		counts.update(zip(self.labels, self.contingency.label_counts.tolist()))
 		return counts
 
 	def get_doc_histogram(self):
 		counts = collections.defaultdict(int)
-		for cluster in self.clusters:
-			counts[cluster.label] += len(cluster.members)
+		for cluster, size in zip(self.clusters, self.contingency.cluster_counts.tolist()):
+			counts[cluster.label] += size
 		return counts
 
 	def get_cluster_histogram(self):
@@ -144,7 +236,7 @@ class KnownClusterAnalyzer:
 	def print_label_cluster_mat(self):
 		print "LABEL-CLUSTER MATRIX:"
 		print "\tSeries of matricies.  Labels are rows.  Clusters are columns."
-		mat = self.label_cluster_mat
+		mat = self.calc_label_cluster_counts()
 		labels = sorted(mat.keys())
 		mat = utils.format_as_mat(mat)
 		clusters_per_mat = 20
@@ -272,9 +364,8 @@ class KnownClusterAnalyzer:
 			print "There are less than two clusters"
 			return
 
-		cluster_sim_mat = self.confirm.get_cluster_sim_mat()
-		for row in cluster_sim_mat:
-			row.sort(reverse=True)
+		# each row is sorted with the cluster itself first
+		idxs, cluster_sim_mat = self.confirm.get_cluster_sim_mat(top_k=6)
 
 		top_1 = list()
 		top_3 = list()
@@ -367,7 +458,7 @@ class KnownClusterAnalyzer:
 			if _doc.label != best_cluster.label:	
 				num_closest_to_incorrect_cluster += 1
 				post += "#"
-			if _doc not in best_cluster.members:
+			if self.clusters[self.cluster_index[id(_doc)]] is not best_cluster:
 				post += "^"
 			print "%s%s" % (utils.pad_to_len("%s %s" % (_doc._id, (_doc.label + post)), 50), "\t".join(to_print))
 
@@ -515,45 +606,27 @@ class KnownClusterAnalyzer:
 		'''
 		:return: { label : { cluster_id : #occurances, }, }
 		'''
-		counts = {label: {cluster._id: 0 for cluster in self.clusters} for label in self.all_labels}
-		for cluster in self.clusters:
-			for doc in cluster.members:
-				counts[doc.label][cluster._id] += 1
+		mat = self.contingency.dense()
+		ids = map(lambda cluster: cluster._id, self.clusters)
+		counts = {label: {_id: 0 for _id in ids} for label in self.labels}
+		for x, label in enumerate(self.labels):
+			for _id, count in zip(ids, mat[x].tolist()):
+				counts[label][_id] += count
 		return counts
 
 	def calc_label_pr_mats(self):
 		'''
 		:return: {label : { count_type (TP, etc) : #occurances, }, }
 		'''
-		counts = {label: {count: 0 for count in ['TP', 'TN', 'FP', 'FN']} for label in self.all_labels}
-		for cluster in self.clusters:
-			for doc in cluster.members:
-				true_label = doc.label
-				for label in self.all_labels:
-					if label == true_label:
-						# actual positive
-						if true_label == cluster.label:
-							# True positive
-							counts[label]['TP'] += 1
-						else:
-							# False negative
-							counts[label]['FN'] += 1
-					elif label == cluster.label:
-						# predicted positive (TP already covered)
-						counts[label]['FP'] += 1
-					else:
-						counts[label]['TN'] += 1
-		return counts
+		counts = self.contingency.pr_counts(self.cluster_label_idxs)
+		return {label: {count: int(counts[count][x]) for count in _counts} for x, label in enumerate(self.labels)}
 
 	def calc_conf_mat(self):
 		'''
 		:return: {predicted_label : {actual_label : #occurances, }, }
 		'''
-		counts = {label: {label: 0 for label in self.all_labels} for label in self.all_labels}
-		for cluster in self.clusters:
-			for doc in cluster.members:
-				counts[cluster.label][doc.label] += 1
-		return counts
+		mat = self.contingency.assigned_counts(self.cluster_label_idxs)
+		return {label: dict(zip(self.labels, map(int, mat[x]))) for x, label in enumerate(self.labels)}
 
 
 	def get_counts(self, label):
@@ -598,71 +671,25 @@ class KnownClusterAnalyzer:
 		return c.most_common(1)[0][0]
 
 	def accuracy(self):
-		total_docs = 0
-		correct = 0
-		for cluster in self.clusters:
-			total_docs += len(cluster.members)
-			correct += len(filter(lambda doc: doc.label == cluster.label, cluster.members))
-		return float(correct) / total_docs
+		return self.total_counts['TP'] / float(self.num_docs)
 
 	def label_entropy(self):
-		label_entropy = 0.0
-		label_counts = self.get_true_doc_histogram()
-		for label in self.all_labels:
-			prob = eps + label_counts[label] / float(self.num_docs)  # in the original paper, this is different
-			label_entropy += prob * math.log(prob)
-		label_entropy *= -1
-		return label_entropy
+		prob = eps + self.contingency.label_counts / float(self.num_docs)  # in the original paper, this is different
+		return -(prob * np.log(prob)).sum()
 
 	def cluster_entropy(self):
-		cluster_entropy = 0.0
-		for cluster in self.clusters:
-			prob = eps + len(cluster.members) / float(self.num_docs)  # in the original paper, this is different
-			cluster_entropy += prob * math.log(prob)
-		cluster_entropy *= -1
-		return cluster_entropy
+		prob = eps + self.contingency.cluster_counts / float(self.num_docs)  # in the original paper, this is different
+		return -(prob * np.log(prob)).sum()
 
 	def v_measure(self):
-		#h = self.homogeneity()
-		#c = self.completeness()
-		#return utils.harmonic_mean(h, c)
-		return sklearn.metrics.v_measure_score(self.true_labels, self.predicted_labels)
+		return self.h_c_v[2]
 
 	def completeness(self):
-		#if len(self.clusters) == 1:
-		#	return 1.0
-
-		## H(K|C)
-		#num = 0.0
-		#label_counts = self.get_true_doc_histogram()
-		#for label in self.all_labels:
-		#	for cluster in self.clusters:
-		#		one = self.label_cluster_mat[label][cluster._id] / float(self.num_docs)
-		#		two = self.label_cluster_mat[label][cluster._id] / float(label_counts[label])
-		#		num += one * math.log(two + eps)
-		#num *= -1
-
-		#return 1.0 - (num / self.cluster_entropy())
-		return sklearn.metrics.completeness_score(self.true_labels, self.predicted_labels)
+		return self.h_c_v[1]
 
 	def homogeneity(self):
-		#if len(self.all_labels) == 1:
-		#	return 1.0
-
-		## H(C|K)
-		#num = 0.0
-		#for cluster in self.clusters:
-		#	for label in self.all_labels:
-		#		one = self.label_cluster_mat[label][cluster._id] / float(self.num_docs)
-		#		two = self.label_cluster_mat[label][cluster._id] / float(len(cluster.members))
-		#		num += one * math.log(two + eps)
-		#num *= -1
-		#
-		## H(C)
-
-		#return 1.0 - (num / self.label_entropy())
-		return sklearn.metrics.homogeneity_score(self.true_labels, self.predicted_labels)
+		return self.h_c_v[0]
 
 	def ari(self):
-		return sklearn.metrics.adjusted_rand_score(self.true_labels, self.predicted_labels)
+		return self.contingency.ari()
 
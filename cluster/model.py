@@ -0,0 +1,141 @@
+
+import os
+import sys
+import time
+import cPickle
+import itertools
+import numpy as np
+
+import doc
+
+_default_batch_size = 200
+
+
+class ProjectModel:
+	'''
+	Everything needed to assign new documents of a project to the clusters found by
+		ncluster.bootstrap_cluster without re-clustering: the refined prototypes, the
+		column offsets of each prototype's match features and the fitted classifier.
+	'''
+
+	def __init__(self, prototypes, classifier, feature_type='all', cluster_labels=None):
+		'''
+		prototypes - list(Document) the cluster centers features are matched against
+		classifier - fitted sklearn classifier over the prototype match features
+		feature_type - passed to Document.match_vector
+		cluster_labels - optional majority label of each cluster, for reporting
+		'''
+		self.prototypes = prototypes
+		self.classifier = classifier
+		self.feature_type = feature_type
+		self.cluster_labels = cluster_labels
+		self.throughput = None
+
+		# offsets[n] is the col index of the start of the nth prototype's features.
+		# A match vector has one entry per prototype element, whatever it is matched against
+		self.offsets = [0]
+		for prototype in self.prototypes:
+			width = len(prototype.match_vector(self.prototypes[0], self.feature_type))
+			self.offsets.append(self.offsets[-1] + width)
+
+	def num_features(self):
+		return self.offsets[-1]
+
+	def extract_features(self, docs):
+		feature_mat = np.zeros( (len(docs), self.num_features()) )
+		for x, _doc in enumerate(docs):
+			for y, prototype in enumerate(self.prototypes):
+				feature_mat[x, self.offsets[y]:self.offsets[y + 1]] = prototype.match_vector(_doc, self.feature_type)
+		return feature_mat
+
+	def predict(self, docs):
+		''' returns an array with the index of the cluster assigned to each of docs '''
+		return self.classifier.predict(self.extract_features(docs))
+
+	def classify(self, docs, batch_size=_default_batch_size, _print=True):
+		'''
+		Generator of (doc, cluster_idx) for an iterable of docs.  Docs are matched against
+			the prototypes and labeled batch_size at a time, so docs can be streamed from disk.
+			self.throughput holds the measured docs/second.
+		'''
+		docs = iter(docs)
+		num_classified = 0
+		self.throughput = 0.0
+		start_time = time.time()
+		while True:
+			batch = list(itertools.islice(docs, batch_size))
+			if not batch:
+				break
+			assignments = self.predict(batch)
+			num_classified += len(batch)
+			self.throughput = num_classified / max(time.time() - start_time, 1e-6)
+			if _print:
+				print "\t%d Documents classified (%.2f docs/sec)" % (num_classified, self.throughput)
+			for _doc, assignment in zip(batch, assignments):
+				yield _doc, assignment
+
+	def assignment_line(self, _doc, assignment):
+		label = self.cluster_labels[assignment] if self.cluster_labels else ""
+		return "%s\t%d\t%s\n" % (_doc._id, assignment, label)
+
+	def write_assignments(self, docs, out_file, batch_size=_default_batch_size, _print=True):
+		'''
+		Classifies an iterable of docs batch_size at a time, appending a
+			"doc_id\tcluster_idx\tlabel" line for each to out_file as it goes.
+			Only one batch of docs and features is held in memory.
+		'''
+		out = open(out_file, 'a')
+		try:
+			for _doc, assignment in self.classify(docs, batch_size, _print):
+				out.write(self.assignment_line(_doc, assignment))
+		finally:
+			out.close()
+
+	def save(self, path):
+		f = open(path, 'wb')
+		try:
+			cPickle.dump(self, f, cPickle.HIGHEST_PROTOCOL)
+		finally:
+			f.close()
+
+
+def load_model(path):
+	f = open(path, 'rb')
+	try:
+		return cPickle.load(f)
+	finally:
+		f.close()
+
+
+def read_assignments(path):
+	'''
+	returns list( (doc_id, cluster_idx) ) in the order they were written by
+		ProjectModel.write_assignments
+	'''
+	assignments = list()
+	for line in open(path).readlines():
+		tokens = line.rstrip("\n").split("\t")
+		assignments.append( (tokens[0], int(tokens[1])) )
+	return assignments
+
+
+def main(args):
+	if len(args) not in [4, 5]:
+		print "Usage: model.py project.model data_dir out_file [batch_size]"
+		print "     Assigns every document under data_dir to a cluster of the saved project model"
+		sys.exit(0)
+
+	model_file = args[1]
+	data_dir = args[2]
+	out_file = args[3]
+	batch_size = int(args[4]) if len(args) == 5 else _default_batch_size
+
+	project_model = load_model(model_file)
+	open(out_file, 'w').close()
+	project_model.write_assignments(doc.iter_docs_nested(data_dir), out_file, batch_size)
+	print "Throughput: %.2f docs/sec" % project_model.throughput
+
+
+if __name__ == "__main__":
+	main(sys.argv)
+
@@ -1,7 +1,10 @@
 
 import os
 import metric
+import model
+import artifacts
 import cluster
+import docstore
 import selector
 import numpy as np
 import scipy.spatial.distance
@@ -10,7 +13,10 @@ import sklearn.cluster
 import sklearn.linear_model
 import sklearn.metrics
 import utils
+import math
 import random
+import collections
+import multiprocessing
 from constants import *
 
 
@@ -108,19 +114,121 @@ def form_clusters_alt(instances, l_idx):
 	return clusters
 	
 
-def set_cluster_center(_cluster):
-	center = _cluster.members[0].copy()
-	for _doc in _cluster.members[1:]:
-		center.aggregate(_doc)
+# smallest number of members worth shipping to a worker as one subtree
+_min_subtree_size = 16
+
+def reduce_partials(partials):
+	'''
+	Aggregates partial prototypes pairwise, then pairs of the results, and so on.
+		The partials are modified.  Returns the (unpruned) root prototype.
+	'''
+	while len(partials) > 1:
+		next_level = list()
+		for x in xrange(0, len(partials), 2):
+			if x + 1 < len(partials):
+				partials[x].aggregate(partials[x + 1])
+			next_level.append(partials[x])
+		partials = next_level
+	return partials[0]
+
+def tree_aggregate(docs):
+	'''
+	Aggregates docs in a balanced binary tree instead of folding them one at a
+		time into a single center.  docs are not modified.
+		Returns the (unpruned) root prototype.
+	'''
+	partials = list()
+	for x in xrange(0, len(docs), 2):
+		partial = docs[x].copy()
+		if x + 1 < len(docs):
+			partial.aggregate(docs[x + 1])
+		partials.append(partial)
+	return reduce_partials(partials)
+
+def set_cluster_center(_cluster, method='fold'):
+	'''
+	method - 'fold' aggregates members sequentially into a copy of the first member
+			 'tree' aggregates members in a balanced tree (see tree_aggregate)
+	'''
+	if method == 'tree':
+		center = tree_aggregate(_cluster.members)
+	else:
+		center = _cluster.members[0].copy()
+		for _doc in _cluster.members[1:]:
+			center.aggregate(_doc)
 	center.final_prune()
 	_cluster.center = center
 	return center
 
 
-def set_cluster_centers(clusters):
+def set_cluster_centers(clusters, method='fold', processes=1):
 	clusters = filter(lambda c: len(c.members), clusters)
+	if method == 'tree' and processes > 1:
+		members = utils.flatten(map(lambda _cluster: _cluster.members, clusters))
+		store = docstore.DocStore(members)
+		if store.can_load(members):
+			set_cluster_centers_tree_par(clusters, store, processes)
+			return
 	for _cluster in clusters:
-		set_cluster_center(_cluster)
+		set_cluster_center(_cluster, method)
+
+def _tree_aggregate_par_helper(task):
+	idx, chunk, member_ids = task
+	return idx, chunk, tree_aggregate(_worker_store.get_docs(member_ids))
+
+def set_cluster_centers_tree_par(clusters, store, processes):
+	'''
+	Builds tree prototypes for all clusters with the subtrees computed on a pool of workers.
+		Each cluster's members are cut into at most $processes contiguous chunks, workers reduce
+		each chunk to a partial prototype, and the partials are reduced and pruned at the root.
+	'''
+	tasks = list()
+	for idx, _cluster in enumerate(clusters):
+		member_ids = map(lambda _doc: _doc._id, _cluster.members)
+		chunk_size = max(_min_subtree_size, int(math.ceil(len(member_ids) / float(processes))))
+		for chunk, start in enumerate(xrange(0, len(member_ids), chunk_size)):
+			tasks.append( (idx, chunk, member_ids[start:start + chunk_size]) )
+	tasks.sort(key=lambda task: len(task[2]), reverse=True)
+
+	partials = collections.defaultdict(dict)
+	pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(store,))
+	try:
+		for idx, chunk, partial in pool.imap_unordered(_tree_aggregate_par_helper, tasks, chunksize=1):
+			partials[idx][chunk] = partial
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+	for idx, _cluster in enumerate(clusters):
+		by_chunk = partials[idx]
+		center = reduce_partials(map(lambda chunk: by_chunk[chunk], sorted(by_chunk)))
+		center.final_prune()
+		_cluster.center = center
+
+def compare_prototypes(clusters, processes=1):
+	'''
+	Checks tree prototypes against the sequential fold on a labeled clustering.  For each
+		construction, prints the mean similarity of members to their own prototype and the
+		accuracy of assigning every doc to its most similar prototype.  Similarity is the
+		fraction of prototype elements matched (the mean of the match vector).
+		Leaves the tree prototypes as the cluster centers.
+	'''
+	clusters = filter(lambda c: len(c.members), clusters)
+	docs = utils.flatten(map(lambda _cluster: _cluster.members, clusters))
+	doc_sim = lambda center, _doc: utils.avg(center.match_vector(_doc, 'all'))
+
+	print "%s\n%s\n%s" % ("*" * 30, "Prototype Check:", "*" * 30)
+	print "method cohesion nearest_acc"
+	for method in ['fold', 'tree']:
+		set_cluster_centers(clusters, method, processes)
+		cohesion = utils.avg([doc_sim(_cluster.center, _doc) for _cluster in clusters for _doc in _cluster.members])
+		correct = 0
+		for _doc in docs:
+			sims = map(lambda _cluster: doc_sim(_cluster.center, _doc), clusters)
+			if clusters[utils.argmax(sims)].label == _doc.label:
+				correct += 1
+		print "%s %.5f %.5f" % (method, cohesion, float(correct) / len(docs))
 
 
 # Note that there are many ways we could do this
@@ -141,20 +249,30 @@ def cluster_dist_mats(clusters, feature_type='match', dist_metric='euclidean'):
 	dist_mats = map(lambda _cluster: cluster_dist_mat(_cluster, feature_type, dist_metric), clusters)
 	return dist_mats
 
-def split_cluster(_cluster, dist_mat, args):
-	'''
-	Splits a cluster using Logan's OPTICS
-		Returns a list of resulting clusters (perhaps just the original)
-	'''
+def calc_min_pts(num_members, args):
 	if args.no_auto_minpts:
-		min_size = args.minpts
+		return args.minpts
 	else:
-		min_size = int(max(args.minpts, args.minpts_perc * len(_cluster.members)))
+		return int(max(args.minpts, args.minpts_perc * num_members))
+
+def split_indices(dist_mat, min_size):
+	'''
+	Runs Logan's OPTICS over dist_mat
+		Returns a list of lists of indices into the rows of dist_mat
+	'''
 	reachabilities = selector.OPTICS(dist_mat, min_size)
 	indices = selector.separateClusters(reachabilities, min_size)
 
 	# comes back as selector.dataPoint classes
-	indices = map(lambda l: map(lambda dp: dp._id, l), indices)
+	return map(lambda l: map(lambda dp: dp._id, l), indices)
+
+def split_cluster(_cluster, dist_mat, args):
+	'''
+	Splits a cluster using Logan's OPTICS
+		Returns a list of resulting clusters (perhaps just the original)
+	'''
+	min_size = calc_min_pts(len(_cluster.members), args)
+	indices = split_indices(dist_mat, min_size)
 	clusters = form_clusters_alt(_cluster.members, indices)
 
 	return clusters
@@ -204,6 +322,39 @@ def extract_features(docs, seeds, feature_types='all',  _print=False):
 
 
 
+def calc_offsets(seeds, feature_type='all'):
+	'''
+	returns list(int) - the offsets returned by extract_features for seeds
+	'''
+	offsets = [0]
+	for seed in seeds:
+		offsets.append(offsets[-1] + len(_extract_features(seeds[0], seed, feature_type)))
+	return offsets
+
+
+def doc_keys(docs):
+	'''
+	returns list - the id and the digest of the feature file of each doc, so cached
+		features follow the contents of the files.  Prototypes made by Document.copy()
+		have no feature file.
+	'''
+	return map(lambda _doc: (_doc._id, artifacts.file_digest(_doc.source_file) if _doc.source_file else None), docs)
+
+
+def cached_extract_features(store, docs, seeds, feature_type='all'):
+	'''
+	extract_features, but the feature matrix is read from the artifact store when the
+		same docs were matched against the same seeds before.
+		returns (np.array, list(int), str) - also the key of the feature matrix
+	'''
+	if store is None:
+		feature_mat, offsets = extract_features(docs, seeds, feature_type)
+		return feature_mat, offsets, None
+	key = store.key("features", doc_keys(docs), doc_keys(seeds), feature_type)
+	feature_mat = store.cached(key, lambda: extract_features(docs, seeds, feature_type)[0])
+	return feature_mat, calc_offsets(seeds, feature_type), key
+
+
 def print_cluster_analysis(clusters):
 	class Mock:
 		pass
@@ -214,6 +365,7 @@ def print_cluster_analysis(clusters):
 	analyzer.print_label_conf_mat()
 	analyzer.print_label_cluster_mat()
 	analyzer.print_metric_info()
+	return analyzer
 
 def get_acc_v_measure(clusters):
 	class Mock:
@@ -249,6 +401,7 @@ def get_random_exemplars(docs, num_exemplars):
 def get_oracle_exemplars(docs, num_exemplars, num_types):
 	all_exemplars = list()
 	exemplar_index = dict()
+	exemplar_rows = dict()  # id(exemplar) -> index into all_exemplars
 
 	docs_by_type = sort_by_type(docs)
 	num_total_types = len(docs_by_type)
@@ -269,15 +422,12 @@ def get_oracle_exemplars(docs, num_exemplars, num_types):
 
 			# add unique cur_exemplars to global list of exemplars
 			for exemplar in cur_exemplars:
-				if exemplar not in all_exemplars:
+				if id(exemplar) not in exemplar_rows:
+					exemplar_rows[id(exemplar)] = len(all_exemplars)
 					all_exemplars.append(exemplar)
 
 			# create index into global list for cur_exemplars
-			cur_exemplar_index = list()
-			for exemplar in cur_exemplars:
-				idx = all_exemplars.index(exemplar)
-				assert(idx >= 0)
-				cur_exemplar_index.append(idx)
+			cur_exemplar_index = map(lambda exemplar: exemplar_rows[id(exemplar)], cur_exemplars)
 			exemplar_index[(num_e, num_t)] = cur_exemplar_index
 
 	return all_exemplars, exemplar_index
@@ -285,12 +435,13 @@ def get_oracle_exemplars(docs, num_exemplars, num_types):
 
 def load_exemplars_from_file(docs, _file):
 	exemplars = []
+	by_id = dict()
+	for _doc in reversed(docs):
+		by_id[_doc._id] = _doc
 	for line in open(_file,'r').readlines():
 		line = line.rstrip()
-		for _doc in docs:
-			if _doc._id == line:
-				exemplars.append(_doc)
-				break
+		if line in by_id:
+			exemplars.append(by_id[line])
 	return exemplars
 	
 
@@ -312,30 +463,96 @@ def calculate_feature_col_indices(index, offsets):
 	return cols
 
 def cluster_refinement(initial_clusters, args):
-	set_cluster_centers(initial_clusters)
+	if args.processes > 1:
+		members = utils.flatten(map(lambda _cluster: _cluster.members, initial_clusters))
+		store = docstore.DocStore(members)
+		if store.can_load(members):
+			return cluster_refinement_par(initial_clusters, store, args)
+
+	set_cluster_centers(initial_clusters, args.prototypes)
 	dist_mats = cluster_dist_mats(initial_clusters)
 	sclusters = utils.flatten(map(
 		lambda _cluster, dist_mat: split_cluster(_cluster, dist_mat, args), 
 			initial_clusters, dist_mats))
 
 	return sclusters
+
+# set in each worker process by the pool initializer
+_worker_store = None
+
+def _init_worker(store):
+	global _worker_store
+	_worker_store = store
+
+def _refine_cluster_par_helper(task):
+	idx, member_ids, min_size, method = task
+	_cluster = cluster.Cluster(_worker_store.get_docs(member_ids))
+	set_cluster_center(_cluster, method)
+	dist_mat = cluster_dist_mat(_cluster)
+	indices = split_indices(dist_mat, min_size)
+	return idx, _cluster.center, indices
+
+def cluster_refinement_par(initial_clusters, store, args):
+	'''
+	Same as cluster_refinement, but each initial cluster is refined in its own task
+		on a pool of args.processes workers.  Tasks only carry member ids; workers
+		load the features from store.  Largest clusters are scheduled first so a
+		single big cluster does not hold up the end of the run.
+	'''
+	tasks = list()
+	for idx, _cluster in enumerate(initial_clusters):
+		if _cluster.members:
+			member_ids = map(lambda _doc: _doc._id, _cluster.members)
+			tasks.append( (idx, member_ids, calc_min_pts(len(member_ids), args), args.prototypes) )
+	tasks.sort(key=lambda task: len(task[1]), reverse=True)
+
+	results = dict()
+	pool = multiprocessing.Pool(processes=args.processes, initializer=_init_worker, initargs=(store,))
+	try:
+		for idx, center, indices in pool.imap_unordered(_refine_cluster_par_helper, tasks, chunksize=1):
+			results[idx] = (center, indices)
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+	# reassemble in the original cluster order
+	sclusters = list()
+	for idx, _cluster in enumerate(initial_clusters):
+		if idx in results:
+			center, indices = results[idx]
+			_cluster.center = center
+			sclusters += form_clusters_alt(_cluster.members, indices)
+
+	return sclusters
 	
-def create_bootstrap_features(sclusters, docs, subset_size):
-	set_cluster_centers(sclusters)
+def create_bootstrap_features(sclusters, docs, subset_size, center_method='fold', processes=1):
+	set_cluster_centers(sclusters, center_method, processes)
 	prototypes = map(lambda _cluster: _cluster.center, sclusters)
 	bootstrap_features = extract_features(docs, prototypes)[0]
 
-	training_labels = np.zeros(subset_size, dtype=np.int16)
+	# docs that are in no cluster keep label 0
+	index = cluster.member_index(sclusters)
 	subset = docs[:subset_size]
-	for x, _doc in enumerate(subset):
-		for y,  _cluster in enumerate(sclusters):
-			if _doc in _cluster.members:
-				training_labels[x] = y
-				break
+	training_labels = np.array(map(lambda _doc: index.get(id(_doc), 0), subset), dtype=np.int16)
 	training_features = bootstrap_features[:subset_size,:]
 	
 	return bootstrap_features, training_features, training_labels 
 
+def create_training_features(sclusters, docs, subset_size, center_method='fold', processes=1):
+	'''
+	Like create_bootstrap_features, but only the features of the training subset
+		are extracted.  The rest of docs are matched when they are classified.
+	'''
+	set_cluster_centers(sclusters, center_method, processes)
+	prototypes = map(lambda _cluster: _cluster.center, sclusters)
+	subset = docs[:subset_size]
+	training_features = extract_features(subset, prototypes)[0]
+
+	index = cluster.member_index(sclusters)
+	training_labels = np.array(map(lambda _doc: index.get(id(_doc), 0), subset), dtype=np.int16)
+	return training_features, training_labels
+
 def rf_sim_mat(feature_mat):
 	random_matrix = compute_random_matrix(feature_mat)
 	rf = train_random_forest(feature_mat, random_matrix)
@@ -354,9 +571,26 @@ def calc_sim_matrix(feature_mat, distance):
 	elif distance == 'euclidean':
 		return euclidean_sim_mat(feature_mat)
 
-def bootstrap_cluster(sclusters, docs, subset_size):
+def create_project_model(sclusters, lr):
+	prototypes = map(lambda _cluster: _cluster.center, sclusters)
+	for _cluster in sclusters:
+		_cluster.set_label()
+	cluster_labels = map(lambda _cluster: _cluster.label, sclusters)
+	return model.ProjectModel(prototypes, lr, 'all', cluster_labels)
+
+def save_project_model(project_model, model_file):
+	project_model.save(model_file)
+	print "Saved project model to %s" % model_file
+
+def bootstrap_cluster(sclusters, docs, subset_size, center_method='fold', processes=1, model_file=None,
+		chunk_size=0, assignment_file=None):
+	if chunk_size > 0:
+		return stream_bootstrap_cluster(sclusters, docs, subset_size, chunk_size, center_method,
+			processes, model_file, assignment_file)
+
 	# Construct features for training and prediction
-	bootstrap_features, training_features, training_labels = create_bootstrap_features(sclusters, docs, subset_size)
+	bootstrap_features, training_features, training_labels = create_bootstrap_features(
+		sclusters, docs, subset_size, center_method, processes)
 
 	# Train LR classifier and predict clusters for all of data
 	lr = sklearn.linear_model.LogisticRegression(penalty='l1')
@@ -364,8 +598,46 @@ def bootstrap_cluster(sclusters, docs, subset_size):
 	assignments = lr.predict(bootstrap_features)
 	bootstrap_clusters = form_clusters(docs, assignments)
 
+	# new docs of the project can later be classified against the same prototypes with model.py
+	if model_file:
+		save_project_model(create_project_model(sclusters, lr), model_file)
+
 	return bootstrap_clusters 
 
+def stream_bootstrap_cluster(sclusters, docs, subset_size, chunk_size, center_method='fold', processes=1,
+		model_file=None, assignment_file=None):
+	'''
+	Same result as bootstrap_cluster, but the full feature matrix is never built.
+		Docs are matched against the prototypes and classified chunk_size at a time, and
+		each doc's features are unloaded once it is classified, so only one chunk of docs
+		is loaded at a time (docs read with doc.iter_docs_nested(unload=True) start unloaded).
+		assignment_file - str file to also write each doc's assignment to, or None
+	'''
+	training_features, training_labels = create_training_features(
+		sclusters, docs, subset_size, center_method, processes)
+
+	lr = sklearn.linear_model.LogisticRegression(penalty='l1')
+	lr.fit(training_features, training_labels)
+	del training_features
+
+	project_model = create_project_model(sclusters, lr)
+	if model_file:
+		save_project_model(project_model, model_file)
+
+	out = open(assignment_file, 'w') if assignment_file else None
+	assignments = np.zeros(len(docs), dtype=np.int64)
+	try:
+		for x, (_doc, assignment) in enumerate(project_model.classify(docs, chunk_size, _print=False)):
+			assignments[x] = assignment
+			if out:
+				out.write(project_model.assignment_line(_doc, assignment))
+			_doc.unload()
+	finally:
+		if out:
+			out.close()
+
+	return form_clusters(docs, assignments)
+
 def initial_cluster(mat, k, subset, distance):
 	assignments = spectral_cluster(mat, k, distance)
 	initial_clusters = form_clusters(subset, assignments)
@@ -373,9 +645,9 @@ def initial_cluster(mat, k, subset, distance):
 
 def print_clusters(clusters, title, tag):
 	print "%s\n%s\n%s" % ("*" * 30, "%s Clusters:" % title, "*" * 30)
-	print_cluster_analysis(clusters)
+	analyzer = print_cluster_analysis(clusters)
 
-	acc, v = get_acc_v_measure(clusters)
+	acc, v = analyzer.accuracy(), analyzer.v_measure()
 	num_clusters = len(clusters)
 	print "tag K subset num_e num_t purity v K'"
 	print "%s %.5f %.5f %d" % (tag, acc, v, num_clusters)
@@ -401,8 +673,10 @@ def confirm(docs, Ks, subset_sizes, num_exemplars, num_types, args):
 	if args.rule_only:
 		feature_types.append('rule')
 
+	store = artifacts.ArtifactStore(args.cache_dir) if args.cache_dir else None
 	for feature_type in feature_types:
-		all_feature_mat, exemplar_offsets = extract_features(largest_subset, all_exemplars, feature_type)
+		all_feature_mat, exemplar_offsets, features_key = cached_extract_features(store, largest_subset,
+			all_exemplars, feature_type)
 
 		for num_e, num_t in sorted(exemplar_index.keys()):
 			
@@ -423,7 +697,10 @@ def confirm(docs, Ks, subset_sizes, num_exemplars, num_types, args):
 
 				for distance in distances:
 					# precompute similarity matrix for subset.  To be used for every K
-					if distance == 'rf':
+					if distance == 'rf' and store:
+						sim_mat_key = store.key("sim_mat", features_key, cols, subset_size, distance)
+						sim_mat = store.cached(sim_mat_key, lambda: calc_sim_matrix(feature_mat, distance))
+					elif distance == 'rf':
 						sim_mat = calc_sim_matrix(feature_mat, distance)
 					else:
 						sim_mat = feature_mat
@@ -436,12 +713,22 @@ def confirm(docs, Ks, subset_sizes, num_exemplars, num_types, args):
 
 						sclusters = cluster_refinement(initial_clusters, args)
 						print_clusters(sclusters, title="Refine", tag="%s_%s" % ('refine', tag))
-
-						bootstrap_clusters = bootstrap_cluster(sclusters, docs, subset_size)
+						if args.check_prototypes:
+							compare_prototypes(sclusters, args.processes)
+
+						model_file = None
+						if args.save_model:
+							model_file = os.path.join(args.save_model, "%s.model" % tag.replace(' ', '_'))
+						assignment_file = None
+						if args.save_assignments:
+							assignment_file = os.path.join(args.save_assignments, "%s.assignments" % tag.replace(' ', '_'))
+						bootstrap_clusters = bootstrap_cluster(sclusters, docs, subset_size, args.prototypes,
+							args.processes, model_file, args.chunk_size, assignment_file)
 						print_clusters(bootstrap_clusters, title="Bootstrap", tag="%s_%s" % ('bootstrap', tag))
 						if args.no_refine:
-							no_refine_bootstrap_clusters = bootstrap_cluster(initial_clusters, docs, subset_size)
+							no_refine_bootstrap_clusters = bootstrap_cluster(initial_clusters, docs, subset_size,
+								args.prototypes, args.processes, chunk_size=args.chunk_size)
 							print_clusters(no_refine_bootstrap_clusters, title="No Refine", tag="%s_%s" % ('norefine', tag))
-							
-
 
+	if store:
+		store.print_stats()
@@ -0,0 +1,241 @@
+
+import os
+import time
+import multiprocessing
+import artifacts
+import numpy as np
+
+# Fills the matrix of func(x, y) over all pairs of items in block_size x block_size tiles.
+#   Tiles are independent tasks for a process pool and the unit of checkpointing when the
+#   matrix is backed by a file.
+#
+# modes:
+#	'symmetric' - func(x, y) for y >= x, mirrored below the diagonal
+#	'asymmetric' - func(x, y) for every ordered pair
+#	'max', 'min' - func(x, y) for every ordered pair, then each pair takes the max (min)
+#		of func(x, y) and func(y, x).  Same as 'symmetric' with
+#		lambda x, y: max(func(x, y), func(y, x)) but calls func half as often.
+
+_block_size = 64
+
+# tiles written between flushes of a file backed matrix
+_checkpoint_interval = 20
+
+_modes = ['symmetric', 'asymmetric', 'max', 'min']
+
+# set once in each worker by _init_worker so tasks only carry a tile
+_worker_rows = None
+_worker_cols = None
+_worker_func = None
+_worker_mode = None
+
+
+def _init_worker(rows, cols, func, mode):
+	global _worker_rows, _worker_cols, _worker_func, _worker_mode
+	_worker_rows = rows
+	_worker_cols = cols
+	_worker_func = func
+	_worker_mode = mode
+
+
+def blocks(n, block_size, mode):
+	'''
+	returns list( (int, int) ) - the first row and column of each tile.  Symmetric
+		matrices skip the tiles below the diagonal.
+	'''
+	starts = range(0, n, block_size)
+	return [(r, c) for r in starts for c in starts if mode != 'symmetric' or c >= r]
+
+
+def compute_block(row_items, col_items, func, mode, r, c, block_size):
+	'''
+	returns np.array - func over rows r:r+block_size and columns c:c+block_size.  Entries
+		of a symmetric matrix below the diagonal are left as 0.
+	'''
+	rows = row_items[r:r + block_size]
+	cols = col_items[c:c + block_size]
+	block = np.zeros( (len(rows), len(cols)) )
+	for x, item1 in enumerate(rows):
+		for y, item2 in enumerate(cols):
+			if mode == 'symmetric' and c + y < r + x:
+				continue
+			block[x, y] = func(item1, item2)
+	return block
+
+
+def top_k(block, k):
+	'''
+	returns (np.array, np.array) - the column indices and values of the k largest entries
+		of each row of block, largest first
+	'''
+	k = min(k, block.shape[1])
+	idxs = np.argsort(-block, axis=1, kind='mergesort')[:, :k]
+	return idxs, block[np.arange(block.shape[0])[:, np.newaxis], idxs]
+
+
+def _block_par_helper(task):
+	idx, r, c, block_size = task
+	return idx, compute_block(_worker_rows, _worker_cols, _worker_func, _worker_mode, r, c, block_size)
+
+
+def _stripe_par_helper(task):
+	'''
+	Computes a stripe of rows tile by tile, keeping only the top k of each row
+	'''
+	idx, r, block_size, k = task
+	stripe = np.concatenate(map(lambda c: compute_block(_worker_rows, _worker_cols, _worker_func, 'asymmetric', r, c, block_size),
+		xrange(0, len(_worker_cols), block_size)), axis=1)
+	return idx, top_k(stripe, k)
+
+
+def _progress_file(out_file, mode, block_size):
+	return "%s.%s_%d.done.npy" % (os.path.splitext(out_file)[0], mode, block_size)
+
+
+def _manifest_file(out_file, mode, block_size):
+	return "%s.%s_%d.manifest.txt" % (os.path.splitext(out_file)[0], mode, block_size)
+
+
+def _manifest(items, key, mode, block_size):
+	'''
+	returns str - a digest of what a matrix was computed over: the id of each item (or the
+		item itself), the key of func, mode and block_size
+	'''
+	ids = map(lambda item: getattr(item, '_id', item), items)
+	return artifacts.digest( (ids, key, mode, block_size) )
+
+
+def _open_matrix(out_file, items, key, mode, block_size, num_blocks):
+	'''
+	returns (np.array, np.array) - the matrix and the mask of which tiles are done.  A
+		file backed matrix of an interrupted run over the same items, key, mode and tiles
+		is reopened, otherwise it is started afresh.
+	'''
+	n = len(items)
+	if out_file is None:
+		return np.zeros( (n, n) ), np.zeros(num_blocks, dtype=np.uint8)
+	progress_file = _progress_file(out_file, mode, block_size)
+	manifest_file = _manifest_file(out_file, mode, block_size)
+	manifest = _manifest(items, key, mode, block_size)
+	if os.path.exists(out_file) and os.path.exists(progress_file) and os.path.exists(manifest_file) and \
+			open(manifest_file).read().strip() == manifest:
+		mat = np.load(out_file, mmap_mode='r+')
+		done = np.load(progress_file, mmap_mode='r+')
+		if mat.shape == (n, n) and done.shape == (num_blocks,):
+			return mat, done
+		del mat, done
+	mat = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.float64, shape=(n, n))
+	done = np.lib.format.open_memmap(progress_file, mode='w+', dtype=np.uint8, shape=(num_blocks,))
+	# written once the new progress file is empty, so a stale mask never matches it
+	f = open(manifest_file, 'w')
+	f.write("%s\n" % manifest)
+	f.close()
+	return mat, done
+
+
+def _checkpoint(mat, done):
+	# tiles must be on disk before they are marked done
+	if isinstance(mat, np.memmap):
+		mat.flush()
+		done.flush()
+
+
+def _results(rows, cols, func, mode, tasks, processes, helper=_block_par_helper):
+	if processes <= 1:
+		_init_worker(rows, cols, func, mode)
+		for task in tasks:
+			yield helper(task)
+		return
+
+	# items and func reach the workers by fork, so they need not be picklable
+	pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(rows, cols, func, mode))
+	try:
+		for result in pool.imap_unordered(helper, tasks):
+			yield result
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+
+def pairwise_matrix(items, func, mode='symmetric', processes=1, block_size=_block_size, out_file=None,
+		key=None, _print=False):
+	'''
+	returns np.array - n x n matrix of func over every pair of items (see modes above)
+		processes - tiles are computed by this many worker processes
+		out_file - str .npy file the matrix is written to as tiles finish.  Rerunning with the
+			same out_file, items, key, mode and block_size only computes the unfinished tiles
+		key - required with out_file: anything with a stable repr that names func and every
+			parameter it depends on, e.g. ("doc_similarity", feature_type, weights).  A
+			function can't be told apart from itself (lambdas share a name and bound methods
+			hide their instance), so a mismatched key is the only thing that stops a rerun
+			from resuming a matrix of another func.
+	'''
+	assert mode in _modes
+	if out_file is not None and key is None:
+		raise Exception("pairwise_matrix needs a key naming func to resume %s" % out_file)
+	items = list(items)
+	n = len(items)
+	origins = blocks(n, block_size, mode)
+	mat, done = _open_matrix(out_file, items, key, mode, block_size, len(origins))
+	tasks = [(idx, r, c, block_size) for idx, (r, c) in enumerate(origins) if not done[idx]]
+
+	start_time = time.time()
+	num_pairs = 0
+	try:
+		for x, (idx, block) in enumerate(_results(items, items, func, mode, tasks, processes)):
+			r, c = origins[idx]
+			mat[r:r + block.shape[0], c:c + block.shape[1]] = block
+			done[idx] = 1
+			num_pairs += block.size if mode != 'symmetric' or r != c else block.shape[0] * (block.shape[0] + 1) / 2
+			if (x + 1) % _checkpoint_interval == 0:
+				_checkpoint(mat, done)
+	finally:
+		_checkpoint(mat, done)
+
+	if _print:
+		elapsed = time.time() - start_time
+		print "\tPairwise: %d pairs in %.2fs (%.0f pairs/s)" % (num_pairs, elapsed, num_pairs / max(elapsed, 1e-6))
+
+	mat = np.array(mat)
+	if mode == 'symmetric':
+		lower = np.tril_indices(n, -1)
+		mat[lower] = mat.T[lower]
+	elif mode == 'max':
+		mat = np.maximum(mat, mat.T)
+	elif mode == 'min':
+		mat = np.minimum(mat, mat.T)
+	return mat
+
+
+def cross_matrix(row_items, col_items, func, processes=1, block_size=_block_size, k=None):
+	'''
+	returns np.array - len(row_items) x len(col_items) matrix of func(row_item, col_item), or
+		with k, (np.array, np.array) the column indices and values of the k largest entries of
+		each row, largest first.  Only block_size rows are held at a time to find the top k.
+	'''
+	row_items = list(row_items)
+	col_items = list(col_items)
+	n = len(row_items)
+	if k is not None:
+		k = min(k, len(col_items))
+		idxs = np.zeros( (n, k), dtype=np.int64)
+		vals = np.zeros( (n, k) )
+		if not k:
+			return idxs, vals
+		tasks = [(idx, r, block_size, k) for idx, r in enumerate(xrange(0, n, block_size))]
+		for idx, (stripe_idxs, stripe_vals) in _results(row_items, col_items, func, 'asymmetric', tasks, processes,
+				_stripe_par_helper):
+			r = idx * block_size
+			idxs[r:r + block_size] = stripe_idxs
+			vals[r:r + block_size] = stripe_vals
+		return idxs, vals
+
+	mat = np.zeros( (n, len(col_items)) )
+	starts = range(0, len(col_items), block_size)
+	tasks = [(idx, r, c, block_size) for idx, (r, c) in enumerate([(r, c) for r in xrange(0, n, block_size) for c in starts])]
+	for idx, block in _results(row_items, col_items, func, 'asymmetric', tasks, processes):
+		r, c = tasks[idx][1:3]
+		mat[r:r + block.shape[0], c:c + block.shape[1]] = block
+	return mat
+
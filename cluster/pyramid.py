@@ -0,0 +1,68 @@
+
+import numpy as np
+
+# Spatial pyramid of codeword histograms over horizontal and vertical strips of a page.
+#   The finest level splits the page into 2 ** (partitions - 1) strips and each coarser
+#   level merges neighboring pairs of strips.  The vertical pyramid leaves out the whole
+#   page histogram, which the horizontal pyramid already has.
+
+
+def num_histograms(h_partitions, v_partitions):
+	return (2 ** h_partitions - 1) + (2 ** v_partitions - 1) - 1
+
+
+def num_features(codebook_size, h_partitions, v_partitions):
+	return codebook_size * num_histograms(h_partitions, v_partitions)
+
+
+def strip_histograms(coords, codes, length, num_strips, codebook_size):
+	'''
+	returns np.array - num_strips x codebook_size counts of the codes falling in each strip
+		coords - np.array of the position of each code along the page
+		length - the width or height of the page
+	'''
+	histos = np.zeros( (num_strips, codebook_size) )
+	if len(codes):
+		stride = (length // num_strips) + 1
+		strips = (np.asarray(coords) / stride).astype(np.int64)
+		np.add.at(histos, (strips, np.asarray(codes)), 1)
+	return histos
+
+
+def pyramid_levels(fine_histos, include_whole=True):
+	'''
+	returns np.array - the rows of fine_histos followed by the sums of successive pairs of
+		rows, then pairs of those, etc., finishing with the sum of all rows if include_whole
+	'''
+	levels = [fine_histos]
+	while levels[-1].shape[0] > 1:
+		prev = levels[-1]
+		levels.append(prev.reshape(prev.shape[0] / 2, 2, prev.shape[1]).sum(axis=1))
+	if not include_whole:
+		levels.pop()
+	if not levels:
+		# a single strip is the whole page
+		return np.zeros( (0, fine_histos.shape[1]) )
+	return np.concatenate(levels)
+
+
+def normalize(histos):
+	''' scales each row of histos to sum to 1.  Empty rows are left as 0 '''
+	sums = histos.sum(axis=1)
+	sums[sums == 0] = 1
+	return histos / sums[:, np.newaxis]
+
+
+def pyramid_features(pts, codes, width, height, codebook_size, h_partitions, v_partitions):
+	'''
+	returns np.array - the normalized histograms of the horizontal pyramid followed by
+		those of the vertical pyramid, as one feature vector.
+		pts - N x 2 np.array of the (x, y) position of each code
+		codes - np.array of the codeword index of each point
+	'''
+	pts = np.asarray(pts).reshape(-1, 2)
+	horz_histos = strip_histograms(pts[:, 0], codes, width, 2 ** (h_partitions - 1), codebook_size)
+	vert_histos = strip_histograms(pts[:, 1], codes, height, 2 ** (v_partitions - 1), codebook_size)
+	histos = np.concatenate( (pyramid_levels(horz_histos, True), pyramid_levels(vert_histos, False)) )
+	return normalize(histos).ravel()
+
@@ -10,10 +10,14 @@ import random
 import time
 import heapq
 import itertools
+import multiprocessing
 import numpy as np
+import scipy.spatial.distance
 from cluster import Cluster
 from cluster import BaseCONFIRM
 import metric 
+import hac
+import medoids
 import matplotlib.pyplot as pyplot
 #from image.signalutils import blur_bilateral
 
@@ -123,45 +127,110 @@ def streamSelector(clustering):
 
 
 
-def pseudoDistance(clustering):
-#   for each cluster, returns the estimated pairwise distances of every point to every point in the cluster
+def memberVectors(cluster):
+    '''
+    returns np.array - one minus the similarity vector of the center to itself and to each member,
+        in that order.  Kept on the cluster and reused while its center and members are the same
+        documents, unmodified.
+    '''
+    vectors = cachedVectors(cluster)
+    if (vectors is None):
+        vectors = 1 - np.array(map(lambda x: cluster.center.global_region_sim(x), [cluster.center] + cluster.members),
+            dtype=np.float64)
+        cacheVectors(cluster, vectors)
+    return vectors
+
+def _vectorDocs(cluster):
+    '''
+    returns (list, list) - the center and members, and the version of each
+    '''
+    docs = [cluster.center] + cluster.members
+    return docs, map(lambda x: getattr(x, 'version', 0), docs)
 
-    distances = []
-    total = 0.0
-    count = 0
-    
+def cacheVectors(cluster, vectors):
+    docs, versions = _vectorDocs(cluster)
+    cluster.pseudoVectors = (docs, versions, vectors)
+
+def cachedVectors(cluster):
+    '''
+    returns np.array - the memberVectors kept on the cluster, or None if there are none or the
+        center or members have been replaced or modified in place (e.g. by aggregate()) since
+    '''
+    cached = getattr(cluster, 'pseudoVectors', None)
+    if (cached == None or len(cached) != 3):
+        return None
+    cachedDocs, cachedVersions, vectors = cached
+    docs, versions = _vectorDocs(cluster)
+    if (len(cachedDocs) != len(docs) or not all(map(lambda (x, y): x is y, zip(cachedDocs, docs)))
+            or cachedVersions != versions):
+        return None
+    return vectors
+
+# set in the parent before the pool forks, so workers reach the clusters without pickling docs
+_workerClustering = None
+_workerDistances = None
+
+def _initWorker(clustering, distances):
+    global _workerClustering, _workerDistances
+    _workerClustering = clustering
+    _workerDistances = distances
+
+def _vectorsParHelper(i):
+    return i, memberVectors(_workerClustering[i])
+
+def _opticsParHelper(task):
+    i, minPts = task
+    return i, OPTICS(_workerDistances[i], minPts)
+
+def _parResults(helper, tasks, processes, clustering=None, distances=None):
+    '''
+    Generator of helper(task) for each task, in order
+    '''
+    if (processes <= 1):
+        _initWorker(clustering, distances)
+        try:
+            for task in tasks:
+                yield helper(task)
+        finally:
+            # don't keep the clusters alive after the serial run
+            _initWorker(None, None)
+        return
+    
+    pool = multiprocessing.Pool(processes, initializer=_initWorker, initargs=(clustering, distances))
+    try:
+        for result in pool.imap(helper, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def pseudoDistance(clustering, processes=1):
+    '''
+    for each cluster, returns the estimated pairwise distances of every point to every point in the cluster,
+        the center first: the euclidean distances between their memberVectors
+    processes - the vectors of clusters that are not cached are computed by this many worker processes
+    '''
     startTime = time.time()
-    for cluster in clustering:
     
-      #  print "Cluster Size:", len(cluster.members)
-        '''
-        print "Starting True Similarities"
-        startTime = time.time()
-        trueSimilarities = map(lambda r: map(lambda c: 1-c, r) ,utils.pairwise(cluster.members, lambda x,y: x.similarity(y)))
-        endTime = time.time()
-        print "Done. Elapsed Time:", endTime-startTime 
-        '''
-        
-        #Order Matters here.
-        '''
-        namedSims = map(lambda x: cluster.center.similarities_by_name(x).items(), [cluster.center] + cluster.members)
-        distToCenter = map(lambda x: [1-i[1] for i in x], namedSims)
-        euclid = utils.pairwise(distToCenter, lambda x,y: utils.euclideanDistance(x,y))
-        
-        distances.append(euclid)
-        '''
-        
-        vectors = map(lambda x: cluster.center.similarity_vector(x), [cluster.center] + cluster.members)
-        distToCenter = map(lambda x: map(lambda i: 1-i, x), vectors)
-        euclid = utils.pairwise(distToCenter, lambda x,y: utils.euclideanDistance(x,y))
-        
-        distances.append(euclid)
+    missing = filter(lambda i: cachedVectors(clustering[i]) is None, range(len(clustering)))
+    for i, vectors in _parResults(_vectorsParHelper, missing, processes, clustering):
+        cacheVectors(clustering[i], vectors)
+    
+    distances = map(lambda cluster: scipy.spatial.distance.cdist(memberVectors(cluster), memberVectors(cluster)), clustering)
     
     endTime = time.time()
     print "Done. Elapsed Time:", endTime-startTime
     
     return distances
 
+def runOPTICS(distances, minPts, processes=1):
+    '''
+    returns list - the OPTICS output of each distance matrix, run by this many worker processes
+    '''
+    return map(lambda (i, output): output, _parResults(_opticsParHelper, map(lambda i: (i, minPts), range(len(distances))),
+        processes, distances=distances))
+
 #######################################################################################################################################
 
 class heap:
@@ -212,11 +281,10 @@ class dataPoint:
     
     def core_distance(self, distances, minPts):
         if(self.core == -1):
-            try:
-                 d = sorted(distances)
-            except:
-                 d = sorted(distances.tolist())
-            self.core = d[ minPts ] if (minPts < len(d)) else -1
+            if (minPts < len(distances)):
+                self.core = np.partition(np.asarray(distances), minPts)[minPts]
+            else:
+                self.core = -1
         
         return self.core
     
@@ -502,7 +570,23 @@ def completeLink(distances, x,y):
     
     return maximum
 
+def averageLink(distances, x,y):
+    total = 0.0
+    
+    for i in x:
+        for j in y:
+            total += distances[i][j]
+    
+    return total / (len(x) * len(y))
+
+# linkages with a Lance-Williams update in hac
+_hacMethods = {singleLink: 'single', completeLink: 'complete', averageLink: 'average'}
+
 def HAC(distances, k=10, func=singleLink):
+    if func in _hacMethods:
+        return hac.HAC(distances, k, _hacMethods[func])
+    
+    # arbitrary linkage functions rescan every pair of clusters
     clusters = [[i] for i in range(len(distances))]
     
     while (len(clusters) > k):
@@ -531,32 +615,23 @@ def HAC(distances, k=10, func=singleLink):
 
 
 def selectRepresentatives(distances, clusters):
+    distances = np.asarray(distances, dtype=np.float64)
     reps = []
     
     for cluster in clusters:
-        minDist = 99999
-        minIdx = -1
-        for x in cluster:
-            dist = 0.0
-            for y in cluster:
-                dist += distances[x][y]
-            if(minIdx == -1 or dist < minDist):
-                minDist = dist
-                minIdx = x
-        
-        if(minIdx != -1):
-            reps.append(minIdx)
-        
+        if(len(cluster)):
+            reps.append(medoids.medoid(cluster, distances))
     
     return reps
 
-def selectWithHac(clustering, k=10):
+def selectWithHac(clustering, k=10, processes=1):
     
-    distances = pseudoDistance(clustering)
+    distances = pseudoDistance(clustering, processes)
     representatives = []
     
     for c, cluster in enumerate(clustering):
-        dist = distances[c]
+        #the center comes first, representatives are only chosen from the members
+        dist = distances[c][1:, 1:]
     
         subClusters = HAC(dist, k, completeLink)
     
@@ -757,12 +832,13 @@ def mergeClusters(clusters, N):
     return result
 
 
-def reclusterWithOPTICS(clustering, resolution=5, display=9):
+def reclusterWithOPTICS(clustering, resolution=5, display=9, processes=1):
     print "Aproximating Distances"
-    distances = pseudoDistance(clustering)
+    distances = pseudoDistance(clustering, processes)
 
     
     print "Running OPTICS"
+    outputs = runOPTICS(distances, resolution, processes)
     newClusters = []
     clusters = []
     centers = map(lambda x: x.center, clustering)
@@ -781,7 +857,7 @@ def reclusterWithOPTICS(clustering, resolution=5, display=9):
         print
         print "Cluster:", i
         #Output is a list of reachability points
-        output = OPTICS(d,resolution, clustering[i])
+        output = outputs[i]
         
         displayTruePlot(output, clustering[i], resolution, display)
         
@@ -875,7 +951,7 @@ def main(args):
 
     #map(lambda c: c.set_label(), clustering)
     for i in [5]:  
-        clusters = reclusterWithOPTICS(clusters, i)
+        clusters = reclusterWithOPTICS(clusters, i, processes=multiprocessing.cpu_count())
     
         _docs = reduce(lambda x,y: x+y, map(lambda c: c.members, clusters))
     
@@ -0,0 +1,89 @@
+
+import os
+import artifacts
+import cv2
+import numpy as np
+
+
+def halving_thresholds(threshold, num_halvings):
+	''' returns list(float) - threshold, threshold / 2, ... halved num_halvings times '''
+	return map(lambda x: threshold / float(2 ** x), xrange(num_halvings + 1))
+
+
+class SurfDetector:
+	'''
+	SURF extraction that runs keypoint detection once per image, at the lowest threshold
+		that would ever be tried.  A keypoint's response is its hessian, so the keypoints a
+		higher threshold would find are those with a higher response, and retrying a higher
+		threshold is emulated by cutting the keypoints sorted by response.  Detections can be
+		kept in memory or in an artifacts.ArtifactStore, so sampling SURFs for a codebook and
+		computing histograms for the same page only detect once.
+	'''
+
+	def __init__(self, thresholds, min_features, max_features, upright=True, extended=False,
+			store=None, memoize=False):
+		'''
+		thresholds - list(float) decreasing hessian thresholds.  The keypoints of the first
+			threshold with at least min_features keypoints are kept, or those of the last
+		max_features - int at most this many keypoints (with the highest responses) are kept
+		store - artifacts.ArtifactStore to keep detections in across runs
+		memoize - bool to keep detections in memory
+		'''
+		self.thresholds = thresholds
+		self.min_features = min_features
+		self.max_features = max_features
+		self.upright = upright
+		self.extended = extended
+		self.store = store
+		self.memo = dict() if memoize else None
+		self.surf = cv2.SURF(thresholds[-1])
+		self.surf.upright = upright
+		self.surf.extended = extended
+
+	def _detect(self, im_file):
+		'''
+		returns (np.array, np.array, np.array, int, int) - the points, responses and descriptors
+			of the max_features strongest keypoints, strongest first, and the image width, height
+		'''
+		im = cv2.imread(im_file, 0)
+		height = im.shape[0]
+		width = im.shape[1]
+		kps = self.surf.detect(im, None)
+		kps = sorted(kps, key=lambda kp: -kp.response)[:self.max_features]
+		kps, deses = self.surf.compute(im, kps)
+		if deses is None or not len(kps):
+			return np.zeros( (0, 2) ), np.zeros(0), np.zeros( (0, 128 if self.extended else 64), dtype=np.float32), width, height
+
+		# compute() can drop keypoints near the border, so sort what is left
+		responses = np.array(map(lambda kp: kp.response, kps))
+		order = np.argsort(-responses, kind='mergesort')
+		pts = np.array(map(lambda kp: kp.pt, kps))[order]
+		return pts, responses[order], deses[order], width, height
+
+	def detections(self, im_file):
+		if self.memo is not None and im_file in self.memo:
+			return self.memo[im_file]
+		if self.store is not None:
+			key = self.store.key("surf", artifacts.file_digest(im_file), self.thresholds[-1],
+				self.max_features, self.upright, self.extended)
+			result = self.store.cached(key, lambda: self._detect(im_file))
+		else:
+			result = self._detect(im_file)
+		if self.memo is not None:
+			self.memo[im_file] = result
+		return result
+
+	def features(self, im_file):
+		'''
+		returns (np.array, np.array, int, int) - points, descriptors, width and height, as
+			detectAndCompute at the first threshold with enough keypoints would give them
+			(the strongest max_features of them)
+		'''
+		pts, responses, deses, width, height = self.detections(im_file)
+		for threshold in self.thresholds:
+			num_features = (responses >= threshold).sum()
+			if num_features >= self.min_features:
+				break
+		num_features = min(num_features, self.max_features)
+		return pts[:num_features], deses[:num_features] + 0, width, height
+
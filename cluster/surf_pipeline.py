@@ -0,0 +1,157 @@
+
+import os
+import collections
+import multiprocessing
+import numpy as np
+
+# rows written between flushes of the feature matrices and the progress mask
+_checkpoint_interval = 200
+
+_manifest_file = "manifest.txt"
+_progress_file = "progress.npy"
+_matrix_file = "data_matrix_%d.npy"
+
+# set once in each worker by _init_worker so tasks only carry an image file
+_worker_codebooks = None
+_worker_surf_fn = None
+_worker_feature_fn = None
+
+
+def _init_worker(codebook_list, surf_fn, feature_fn):
+	global _worker_codebooks, _worker_surf_fn, _worker_feature_fn
+	_worker_codebooks = codebook_list
+	_worker_surf_fn = surf_fn
+	_worker_feature_fn = feature_fn
+
+
+def _calc_features(im_file):
+	pts, deses, width, height = _worker_surf_fn(im_file)
+	return map(lambda codebook: _worker_feature_fn(pts, deses, width, height, codebook), _worker_codebooks)
+
+
+def _extract_par_helper(task):
+	idx, im_file = task
+	return idx, _calc_features(im_file)
+
+
+def matrix_paths(out_dir, num_codebooks):
+	return map(lambda y: os.path.join(out_dir, _matrix_file % y), xrange(num_codebooks))
+
+
+def _can_resume(out_dir, im_files, shapes):
+	'''
+	returns True if out_dir holds the matrices and progress of a run over the same images
+	'''
+	manifest = os.path.join(out_dir, _manifest_file)
+	progress = os.path.join(out_dir, _progress_file)
+	if not os.path.exists(manifest) or not os.path.exists(progress):
+		return False
+	if open(manifest).read().splitlines() != list(im_files):
+		return False
+	for path, shape in zip(matrix_paths(out_dir, len(shapes)), shapes):
+		if not os.path.exists(path) or np.load(path, mmap_mode='r').shape != shape:
+			return False
+	return True
+
+
+def _open_outputs(out_dir, im_files, shapes):
+	'''
+	returns (list(np.memmap), np.memmap) - a feature matrix for each codebook and the mask
+		of which rows are done.  Outputs of an interrupted run over the same images are
+		reopened, otherwise they are created.
+	'''
+	paths = matrix_paths(out_dir, len(shapes))
+	if _can_resume(out_dir, im_files, shapes):
+		matrices = map(lambda path: np.load(path, mmap_mode='r+'), paths)
+		done = np.load(os.path.join(out_dir, _progress_file), mmap_mode='r+')
+		return matrices, done
+
+	matrices = map(lambda (path, shape): np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape),
+		zip(paths, shapes))
+	done = np.lib.format.open_memmap(os.path.join(out_dir, _progress_file), mode='w+',
+		dtype=np.uint8, shape=(len(im_files),))
+	f = open(os.path.join(out_dir, _manifest_file), 'w')
+	f.write("".join(map(lambda im_file: "%s\n" % im_file, im_files)))
+	f.close()
+	return matrices, done
+
+
+def _checkpoint(matrices, done):
+	# rows must be on disk before they are marked done
+	for matrix in matrices:
+		matrix.flush()
+	done.flush()
+
+
+def _results(tasks, codebook_list, surf_fn, feature_fn, processes, max_in_flight):
+	'''
+	Generator of (idx, list(np.array)) for each task.  With worker processes, at most
+		max_in_flight images are being processed or waiting to be written at a time.
+	'''
+	if processes <= 1:
+		_init_worker(codebook_list, surf_fn, feature_fn)
+		for task in tasks:
+			yield _extract_par_helper(task)
+		return
+
+	pool = multiprocessing.Pool(processes, initializer=_init_worker,
+		initargs=(codebook_list, surf_fn, feature_fn))
+	try:
+		tasks = iter(tasks)
+		pending = collections.deque()
+		for task in tasks:
+			pending.append(pool.apply_async(_extract_par_helper, (task,)))
+			if len(pending) >= max_in_flight:
+				break
+		while pending:
+			result = pending.popleft().get()
+			for task in tasks:
+				pending.append(pool.apply_async(_extract_par_helper, (task,)))
+				break
+			yield result
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+
+def extract_data_matrices(im_files, codebook_list, num_features, surf_fn, feature_fn, out_dir,
+		processes=1, max_in_flight=None, checkpoint_interval=_checkpoint_interval, _print=True):
+	'''
+	Computes the feature vector of every image for every codebook into memory-mapped
+		data_matrix_N.npy files in out_dir.  Progress is checkpointed, so rerunning with the
+		same images after a crash only processes the images that were not finished.
+		im_files - list(str) the ith image fills the ith row of each matrix
+		codebook_list - list(np.array) copied once to each worker
+		num_features - list(int) the length of the feature vector for each codebook
+		surf_fn - im_file -> (pts, deses, width, height)
+		feature_fn - (pts, deses, width, height, codebook) -> np.array
+		max_in_flight - images submitted to the workers but not yet written. Default 2 * processes
+		returns list(str) - the path of each data matrix
+	'''
+	if max_in_flight is None:
+		max_in_flight = 2 * processes
+	n = len(im_files)
+	shapes = map(lambda width: (n, width), num_features)
+	matrices, done = _open_outputs(out_dir, im_files, shapes)
+
+	tasks = [(x, im_files[x]) for x in xrange(n) if not done[x]]
+	if _print and len(tasks) < n:
+		print "Resuming: %d/%d Images already done" % (n - len(tasks), n)
+
+	num_done = n - len(tasks)
+	try:
+		for x, (idx, rows) in enumerate(_results(tasks, codebook_list, surf_fn, feature_fn, processes, max_in_flight)):
+			for matrix, row in zip(matrices, rows):
+				matrix[idx,:] = row
+			done[idx] = 1
+			num_done += 1
+			if (x + 1) % checkpoint_interval == 0:
+				_checkpoint(matrices, done)
+			if _print and num_done % 10 == 0:
+				print "Processing (%d/%d) %.2f%% Images" % (num_done, n, 100. * num_done / n)
+	finally:
+		_checkpoint(matrices, done)
+
+	return matrix_paths(out_dir, len(codebook_list))
+
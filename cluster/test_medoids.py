@@ -0,0 +1,71 @@
+
+import random
+import unittest
+import numpy as np
+import scipy.spatial.distance
+import medoids
+
+
+def reference_cluster(distances, k=3, maxIters=100000):
+	''' The k-medoids loop kumar/kmedoids.py had before it moved to medoids.py '''
+	m = distances.shape[0]
+	curr_medoids = np.array([-1]*k)
+	while not len(np.unique(curr_medoids)) == k:
+		curr_medoids = np.array(random.sample(xrange(m), k))
+	old_medoids = np.array([-1]*k)
+	new_medoids = np.array([-1]*k)
+	iter_num = 1
+	while not ((old_medoids == curr_medoids).all()):
+		iter_num += 1
+		clusters = curr_medoids[np.argmin(distances[:, curr_medoids], axis=1)]
+		for curr_medoid in curr_medoids:
+			cluster = np.where(clusters == curr_medoid)[0]
+			costs = distances[np.ix_(cluster, cluster)].sum(axis=1)
+			new_medoids[curr_medoids == curr_medoid] = cluster[costs.argmin(axis=0)]
+		old_medoids[:] = curr_medoids[:]
+		curr_medoids[:] = new_medoids[:]
+		if iter_num > maxIters:
+			break
+	return clusters, curr_medoids
+
+
+def random_distances(rng, m, grid=None):
+	if grid is None:
+		points = rng.rand(m, 2)
+	else:
+		# distinct points of a coarse grid give many tied distances and costs.  Repeated
+		#   points are left out as they can leave a medoid without members, which the old
+		#   loop could not handle.
+		cells = rng.permutation(grid * grid)[:m]
+		points = np.column_stack( (cells / grid, cells % grid) ) / float(grid)
+	return scipy.spatial.distance.cdist(points, points)
+
+
+class ClusterTest(unittest.TestCase):
+
+	def compare(self, distances, k, seed):
+		random.seed(seed)
+		expected = reference_cluster(distances, k)
+		random.seed(seed)
+		actual = medoids.cluster(distances, k)
+		self.assertTrue(np.array_equal(expected[0], actual[0]))
+		self.assertTrue(np.array_equal(expected[1], actual[1]))
+
+	def test_matches_reference(self):
+		rng = np.random.RandomState(0)
+		for trial in xrange(300):
+			self.compare(random_distances(rng, rng.randint(10, 80)), rng.randint(2, 8), trial)
+
+	def test_matches_reference_with_ties(self):
+		rng = np.random.RandomState(1)
+		for trial in xrange(300):
+			self.compare(random_distances(rng, rng.randint(10, 80), 11), rng.randint(2, 8), trial)
+
+	def test_matches_reference_across_chunks(self):
+		rng = np.random.RandomState(2)
+		for trial in xrange(3):
+			self.compare(random_distances(rng, 2 * medoids._chunk_size + 50, 40), 2, trial)
+
+
+if __name__ == '__main__':
+	unittest.main()
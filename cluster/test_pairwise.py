@@ -0,0 +1,53 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pairwise
+
+
+class ResumeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp_dir = tempfile.mkdtemp()
+		self.out_file = os.path.join(self.tmp_dir, "mat.npy")
+		self.calls = 0
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp_dir)
+
+	def product(self, x, y):
+		self.calls += 1
+		return x * y
+
+	def total(self, x, y):
+		self.calls += 1
+		return x + y
+
+	def matrix(self, func, key):
+		return pairwise.pairwise_matrix(range(1, 11), func, block_size=4, out_file=self.out_file, key=key)
+
+	def test_same_key_resumes(self):
+		first = self.matrix(self.product, "product")
+		self.calls = 0
+		second = self.matrix(self.product, "product")
+		self.assertEqual(self.calls, 0)
+		self.assertTrue(np.array_equal(first, second))
+
+	def test_other_func_does_not_resume(self):
+		self.matrix(self.product, "product")
+		mat = self.matrix(self.total, "total")
+		self.assertTrue(np.array_equal(mat, np.add.outer(range(1, 11), range(1, 11))))
+
+	def test_lambdas_with_other_keys_do_not_resume(self):
+		self.matrix(lambda x, y: x * y, ("scaled", 1))
+		mat = self.matrix(lambda x, y: 2 * x * y, ("scaled", 2))
+		self.assertTrue(np.array_equal(mat, 2 * np.outer(range(1, 11), range(1, 11))))
+
+	def test_out_file_needs_key(self):
+		self.assertRaises(Exception, self.matrix, self.product, None)
+
+
+if __name__ == '__main__':
+	unittest.main()
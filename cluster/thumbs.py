@@ -0,0 +1,187 @@
+
+import os
+import Queue
+import threading
+import collections
+import artifacts
+from PIL import Image
+
+# Thumbnails of Document.draw() renderings for the Tk cluster browsers.  Each document is
+#   drawn once and kept as a pyramid of sizes, each level resized from the one above it.
+#   Levels are stored as PNGs on disk and the recently used ones in memory.  Requests are
+#   served by a background thread, so the UI thread only turns finished images into
+#   PhotoImages in poll().
+
+# the largest dimension of each level of the pyramid
+_levels = [100, 200, 400, 800]
+
+# priorities of the request queue, lowest first
+_interactive = 0
+_prefetch = 1
+
+
+def resize_image(img, scale):
+	'''
+	returns Image - img resized so its larger dimension is scale, keeping its aspect ratio
+	'''
+	wsize = hsize = scale
+	width = img.size[0]
+	height = img.size[1]
+	if width > height:
+		hsize = max(1, int(float(height) * scale / width))
+	else:
+		wsize = max(1, int(float(width) * scale / height))
+
+	i = img.resize((4 * wsize, 4 * hsize), Image.NEAREST)
+	i = i.resize((2 * wsize, 2 * hsize), Image.BILINEAR)
+	return i.resize((wsize, hsize), Image.ANTIALIAS)
+
+
+class ThumbnailCache:
+	'''
+	Pyramids of thumbnails on disk under cache_dir with an LRU of max_images of them
+		in memory.  Safe to use from several threads.
+	'''
+
+	def __init__(self, cache_dir=None, context=None, max_images=500):
+		'''
+		cache_dir - str directory for the pyramids, or None to keep them only in memory
+		context - mixed into the key of every document.  Prototypes made by Document.copy()
+			have no feature file, so pass something that changes with the clustering they
+			came from (e.g. its path and mtime)
+		'''
+		self.cache_dir = cache_dir
+		self.context = context
+		self.max_images = max_images
+		self.images = collections.OrderedDict()
+		self.lock = threading.Lock()
+		# one lock per document so a pyramid is only ever built once
+		self.doc_locks = collections.defaultdict(threading.Lock)
+		if cache_dir:
+			try:
+				os.makedirs(cache_dir)
+			except:
+				pass
+
+	def key(self, _doc):
+		source_file = getattr(_doc, 'source_file', None)
+		mtime = os.path.getmtime(source_file) if source_file and os.path.exists(source_file) else None
+		return "thumb-%s" % artifacts.digest( (_doc._id, source_file, mtime, self.context) )
+
+	def _path(self, key, level):
+		return os.path.join(self.cache_dir, "%s_%d.png" % (key, level))
+
+	def _remember(self, key, level, img):
+		with self.lock:
+			self.images.pop((key, level), None)
+			self.images[(key, level)] = img
+			while len(self.images) > self.max_images:
+				self.images.popitem(last=False)
+
+	def _lookup(self, key, level):
+		with self.lock:
+			img = self.images.pop((key, level), None)
+			if img is not None:
+				self.images[(key, level)] = img
+		if img is None and self.cache_dir and os.path.exists(self._path(key, level)):
+			try:
+				img = Image.open(self._path(key, level))
+				img.load()
+			except Exception as e:
+				print "\tError loading thumbnail %s: %s" % (self._path(key, level), e)
+				return None
+			self._remember(key, level, img)
+		return img
+
+	def _build(self, _doc, key):
+		''' Draws _doc once and stores every level of its pyramid '''
+		img = _doc.draw()
+		for level in reversed(_levels):
+			img = resize_image(img, level)
+			self._remember(key, level, img)
+			if self.cache_dir:
+				# written under a temporary name so a crash never leaves a truncated thumbnail
+				path = self._path(key, level)
+				tmp_path = "%s.%d.tmp" % (path, os.getpid())
+				img.save(tmp_path, "PNG")
+				os.rename(tmp_path, path)
+
+	def get(self, _doc, size):
+		'''
+		returns Image - the rendering of _doc with larger dimension size
+		'''
+		if size > _levels[-1]:
+			return resize_image(_doc.draw(), size)
+		level = filter(lambda level: level >= size, _levels)[0]
+		key = self.key(_doc)
+		img = self._lookup(key, level)
+		if img is None:
+			with self.doc_locks[key]:
+				img = self._lookup(key, level)
+				if img is None:
+					self._build(_doc, key)
+					img = self._lookup(key, level)
+		if level == size:
+			return img
+		return resize_image(img, size)
+
+
+class ThumbnailService:
+	'''
+	Loads thumbnails from a ThumbnailCache on a background thread.  Callbacks are run
+		by poll(), which the UI thread calls periodically (e.g. with Tk's after), because
+		Tk may only be used from the thread it runs in.
+	'''
+
+	def __init__(self, cache):
+		self.cache = cache
+		self.requests = Queue.PriorityQueue()
+		self.done = Queue.Queue()
+		self.count = 0
+		self.thread = threading.Thread(target=self._run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _put(self, priority, _doc, size, callback):
+		# count keeps requests of the same priority first in first out
+		self.count += 1
+		self.requests.put( (priority, self.count, _doc, size, callback) )
+
+	def request(self, _doc, size, callback):
+		'''
+		Loads the thumbnail of _doc ahead of any prefetching and calls callback(Image)
+			from poll() when it is ready
+		'''
+		self._put(_interactive, _doc, size, callback)
+
+	def prefetch(self, docs, size):
+		''' Builds the thumbnails of docs in the background '''
+		for _doc in docs:
+			self._put(_prefetch, _doc, size, None)
+
+	def _run(self):
+		while True:
+			priority, count, _doc, size, callback = self.requests.get()
+			try:
+				img = self.cache.get(_doc, size)
+			except Exception as e:
+				print "\tError rendering thumbnail of %s: %s" % (_doc._id, e)
+				continue
+			if callback is not None:
+				self.done.put( (callback, img) )
+
+	def poll(self):
+		'''
+		Runs the callbacks of every finished request.  A failing callback (e.g. a TclError
+			for a widget closed meanwhile) is reported and does not stop the others.
+		'''
+		while True:
+			try:
+				callback, img = self.done.get_nowait()
+			except Queue.Empty:
+				return
+			try:
+				callback(img)
+			except Exception as e:
+				print "\tError in thumbnail callback: %s" % e
+
@@ -7,8 +7,8 @@ import ImageFont
 import collections
 import Levenshtein
 import cPickle
-import networkx as nx
 import numpy
+from pairwise import pairwise_matrix
 
 colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255),
 			 (255, 255, 0), (255, 0, 255), (0, 255, 255),
@@ -216,18 +216,12 @@ def format_as_mat(mat):
 	return new_mat
 
 
-def pairwise(args, func, symmetric=True):
-	mat = []
-	for x, arg1 in enumerate(args):
-		row = []
-		for y, arg2 in enumerate(args):
-			if symmetric and y < x:
-				val = mat[y][x]
-			else:
-				val = func(arg1, arg2)
-			row.append(val)
-		mat.append(row)
-	return mat
+def pairwise(args, func, symmetric=True, processes=1):
+	'''
+	returns list(list) - func(x, y) for every pair of args.  See pairwise.pairwise_matrix
+	'''
+	mode = 'symmetric' if symmetric else 'asymmetric'
+	return pairwise_matrix(args, func, mode, processes).tolist()
 
 
 def insert_indices(mat, row_start=0, col_start=0):
@@ -356,117 +350,142 @@ def get_font(text, width):
 	return font
 
 def get_sorted_edges(sim_mat):
-	edges = list()
-	for x in xrange(len(sim_mat)):
-		for y in xrange(len(sim_mat)):
-			if y >= x:
-				continue
-			edges.append( (x, y, sim_mat[x][y]) )
-	edges.sort(key=lambda tup: tup[2])
-	return edges
-			
+	'''
+	returns list( (idx1, idx2, sim) *) - every pair idx2 < idx1, ordered by sim.  Ties
+		keep row major order.
+	'''
+	sim_mat = numpy.asarray(sim_mat)
+	idx1s, idx2s = numpy.tril_indices(len(sim_mat), -1)
+	sims = sim_mat[idx1s, idx2s]
+	order = numpy.argsort(sims, kind='mergesort')
+	return zip(idx1s[order].tolist(), idx2s[order].tolist(), sims[order].tolist())
+
+
+class UnionFind:
+	'''
+	Disjoint sets over the ints 0..n-1 with union by size and path compression
+	'''
+
+	def __init__(self, n):
+		self.parents = range(n)
+		self.sizes = [1] * n
+
+	def find(self, x):
+		root = x
+		while self.parents[root] != root:
+			root = self.parents[root]
+		while self.parents[x] != root:
+			self.parents[x], x = root, self.parents[x]
+		return root
+
+	def union(self, x, y):
+		'''
+		returns bool - False if x and y were already in the same set
+		'''
+		x = self.find(x)
+		y = self.find(y)
+		if x == y:
+			return False
+		if self.sizes[x] < self.sizes[y]:
+			x, y = y, x
+		self.parents[y] = x
+		self.sizes[x] += self.sizes[y]
+		return True
+
+	def sets(self):
+		'''
+		returns list(set) - the sets, ordered by their smallest member
+		'''
+		by_root = collections.OrderedDict()
+		for x in xrange(len(self.parents)):
+			by_root.setdefault(self.find(x), set()).add(x)
+		return by_root.values()
+
 
 def minimum_spanning_tree(sim_mat):
 	'''
 	Returns the minimum spanning tree of the similarity matrix
 	:return: list( (idx1, idx2, sim) *)
 	'''
-	edges = get_sorted_edges(sim_mat)
-	ccs = {x : x for x in xrange(len(sim_mat))}
+	components = UnionFind(len(sim_mat))
 	edges_added = list()
-	for edge in edges:
+	for edge in get_sorted_edges(sim_mat):
 		if len(edges_added) == (len(sim_mat) - 1):
 			break
-		idx1 = edge[0]
-		idx2 = edge[1]
-		if ccs[idx1] != ccs[idx2]:
+		if components.union(edge[0], edge[1]):
 			edges_added.append(edge)
-			val = ccs[idx2]
-			for x in ccs:
-				if ccs[x] == val:
-					ccs[x] = ccs[idx1]
 	return edges_added
 
 def get_ccs(vertices, edges):
 	'''
-	return: list(list(v1, v2, ...), ...)
+	return: list(set(v1, v2, ...), ...)
 	'''
-	ccs = list()
+	vertices = list(vertices)
+	idxs = {vertex: x for x, vertex in enumerate(vertices)}
 	for edge in edges:
-		idx1 = edge[0]
-		idx2 = edge[1]
-		cc1 = None
-		cc2 = None
-		for cc in ccs:
-			if idx1 in cc:
-				cc1 = cc
-			if idx2 in cc:
-				cc2 = cc
-		if cc1 is cc2:
-			if cc1 is None:
-				# new cc
-				ccs.append(set([idx1, idx2]))
-			else:
-				pass
-		elif cc1 is None:
-			# add leaf
-			cc2.add(idx1)
-		elif cc2 is None:
-			# add leaf
-			cc1.add(idx2)
-		else:
-			# merge
-			ccs.remove(cc2)
-			cc1.update(cc2)
-	for vertex in vertices:
-		has_cc = False
-		for cc in ccs:
-			if vertex in cc:
-				has_cc = True
-				break
-		if not has_cc:
-			ccs.append(set([vertex]))
-	return ccs
-
-def max_weight_clique(sim_mat, idxs):
-	m = 0
-	for idx1 in idxs:
-		for idx2 in idxs:
-			if idx1 != idx2:
-				m = max(m, sim_mat[idx1][idx2])
-	return m
-
-def find_best_clique(sim_mat, size):
-	G = nx.Graph()
-	for x in xrange(len(sim_mat)):
-		G.add_node(x)
-	edges = get_sorted_edges(sim_mat)
-	x = 0
-	thresh = 0.05
-	while thresh <= 1:
-		while x < len(edges) and edges[x][2] <= thresh:
-			G.add_edge(edges[x][0], edges[x][1])
-			x += 1
-		max_cliques = nx.find_cliques(G)
-
-		# bucket sort
-		by_size = collections.defaultdict(list)
-		for clique in max_cliques:
-			by_size[len(clique)].append(clique)
-
-		biggest = max(by_size.keys())
-		if biggest >= size:
-			# do tie breaking
-			cliques = by_size[biggest]
-			best_clique = None
-			best_score = 1000000
-			for clique in cliques:
-				score = max_weight_clique(sim_mat, clique)
-				if score < best_score:
-					best_score = score
-					best_clique = clique
-			return best_clique
-		thresh += 0.05
+		for vertex in edge[:2]:
+			if vertex not in idxs:
+				idxs[vertex] = len(vertices)
+				vertices.append(vertex)
+	components = UnionFind(len(vertices))
+	for edge in edges:
+		components.union(idxs[edge[0]], idxs[edge[1]])
+	return map(lambda cc: set(map(lambda x: vertices[x], cc)), components.sets())
+
+
+class ForestComponents:
+	'''
+	Connected components of a forest (e.g. a spanning tree) over the vertices 0..n-1,
+		kept up to date as edges are removed.  Removing an edge splits one tree in two,
+		so only the vertices of that tree are relabeled.
+	'''
+
+	def __init__(self, n, edges):
+		self.neighbors = [set() for x in xrange(n)]
+		for edge in edges:
+			self.neighbors[edge[0]].add(edge[1])
+			self.neighbors[edge[1]].add(edge[0])
+		self.labels = [None] * n
+		self.components = dict()
+		self.next_label = 0
+		for x in xrange(n):
+			if self.labels[x] is None:
+				self._relabel(x)
+
+	def _relabel(self, start):
+		'''
+		Gives the tree containing start a new label
+		'''
+		label = self.next_label
+		self.next_label += 1
+		members = set([start])
+		stack = [start]
+		while stack:
+			x = stack.pop()
+			old = self.labels[x]
+			if old is not None and old in self.components:
+				self.components[old].discard(x)
+				if not self.components[old]:
+					del self.components[old]
+			self.labels[x] = label
+			for y in self.neighbors[x]:
+				if y not in members:
+					members.add(y)
+					stack.append(y)
+		self.components[label] = members
+
+	def remove_edge(self, edge):
+		idx1, idx2 = edge[0], edge[1]
+		self.neighbors[idx1].discard(idx2)
+		self.neighbors[idx2].discard(idx1)
+		self._relabel(idx2)
+
+	def ccs(self):
+		return self.components.values()
+
+	def largest_cc(self):
+		return max(self.components.values(), key=len)
+
 
 def euclideanDistance(x,y):
     assert(len(x) == len(y))
@@ -9,7 +9,9 @@ import shutil
 import metric
 import cPickle
 import cluster
-import kmedoids
+import pyramid
+import codebooks
+import surf_detect
 import numpy as np
 import collections
 import sklearn.cluster
@@ -25,6 +27,8 @@ _surf_upright = True
 _surf_extended = False
 _surf_threshold = 30000
 _num_surf_features = 10000
+# the threshold is halved at most this many times to find _num_surf_features keypoints
+_surf_halvings = 6
 
 # Codebook & Features
 _codebook_sizes = [100, 300, 500, 750]
@@ -36,109 +40,24 @@ _H_partitions = 3
 _V_partitions = 4
 
 # not parameters
-_num_histograms = ( (2 ** (_H_partitions) - 1) + (2 ** (_V_partitions) - 1) - 1 )
-_surf_instance = cv2.SURF(_surf_threshold)
-_surf_instance.upright = _surf_upright
-_surf_instance.extended = _surf_extended
-_surf_features = dict()
+_num_histograms = pyramid.num_histograms(_H_partitions, _V_partitions)
+_surf_detector = surf_detect.SurfDetector(surf_detect.halving_thresholds(_surf_threshold, _surf_halvings),
+	_num_surf_features, _num_surf_features, _surf_upright, _surf_extended, memoize=True)
 _print_interval = 20
 
 
 def calc_surf_features(im_file):
-	if im_file not in _surf_features:
-		im = cv2.imread(im_file, 0)
-		height = im.shape[0]
-		width = im.shape[1]
-		# surf_features[0] is the array of keypoints
-		# surf_features[1] is the array of descriptors
-		_surf_instance.hessianThreshold = _surf_threshold
-		kps, deses = _surf_instance.detectAndCompute(im, None)
-		while len(kps) < _num_surf_features:
-			_surf_instance.hessianThreshold /= 2
-			kps, deses = _surf_instance.detectAndCompute(im, None)
-		pts = np.array(map(lambda kp: kp.pt, kps[:_num_surf_features]))
-		deses = deses[:_num_surf_features] + 0
-		_surf_features[im_file] = (pts, deses, width, height)
-	return _surf_features[im_file]
+	return _surf_detector.features(im_file)
 	
 def calc_features(im_file, codebook):
 	# calc the surf features
 	codebook_size = len(codebook)
-	num_features = codebook_size * _num_histograms
 	pts, deses, width, height = calc_surf_features(im_file)
 
-	# the most fine grained partitions
-	horz_histos = np.zeros(2 ** (_H_partitions - 1) * codebook_size)
-	vert_histos = np.zeros(2 ** (_V_partitions - 1) * codebook_size)
-	horz_stride = (width / 2 ** (_H_partitions - 1)) + 1
-	vert_stride = (height / 2 ** (_V_partitions - 1)) + 1
-
-	#print "Image dims", (width, height)
-	#print "horz_stride", horz_stride
-	#print "vert_stride", vert_stride
-	#print "horz_histo shape", horz_histos.shape
-	#print "vert_histo shape", vert_histos.shape
-
-	closest_code = lambda feature: scipy.spatial.distance.cdist(codebook, [feature], metric='cityblock').argmin()
-
-	# populate the most fine grained partitions
-	for pt, des in zip(pts, deses):
-		#print pt
-		#print des
-		idx = closest_code(des)
-		#print "Closest code:", idx
-		horz_histos[idx + ( int(pt[0] / horz_stride)  * codebook_size)] += 1
-		vert_histos[idx + ( int(pt[1] / vert_stride)  * codebook_size)] += 1
-
-	#print "Horz Histo:"
-	#print horz_histos
-	#print
-	#print "Vert Histo:"
-	#print vert_histos
-
-	# aggregate the statistics
-	histos = np.zeros(num_features)
-	histo_offset = 0
-	stride = 1
-	while stride <= horz_histos.shape[0] / codebook_size:
-		horz_offset = 0
-		while horz_offset < horz_histos.shape[0] / codebook_size:
-			horz_cur = horz_offset
-			while horz_cur < (horz_offset + stride):
-				histos[histo_offset * codebook_size : (histo_offset + 1) * codebook_size] += (
-					horz_histos[horz_cur * codebook_size: (horz_cur + 1) * codebook_size])
-				horz_cur += 1
-			horz_offset += stride
-			histo_offset += 1
-		stride *= 2
-	stride = 1
-	while stride < vert_histos.shape[0] / codebook_size:
-		vert_offset = 0
-		while vert_offset < vert_histos.shape[0] / codebook_size:
-			vert_cur = vert_offset
-			while vert_cur < (vert_offset + stride):
-				histos[histo_offset * codebook_size : (histo_offset + 1) * codebook_size] += (
-					vert_histos[vert_cur * codebook_size: (vert_cur + 1) * codebook_size])
-				vert_cur += 1
-			vert_offset += stride
-			histo_offset += 1
-		stride *= 2
-
-	#print
-	#print "Whole Histo"
-	#print histos
-
-	# normalize
-	for offset in xrange(num_features / codebook_size):
-		s = histos[offset * codebook_size : (offset + 1) * codebook_size].sum()
-		if s:
-			histos[offset * codebook_size : (offset + 1) * codebook_size] /= float(s)
-	features = histos
-
-	#print
-	#print "Normalized"
-	#print self.features
-	#exit()
+	codes = codebooks.quantize(deses, codebook, metric='cityblock')
+
+	# histograms of the codes over the spatial pyramid, each normalized
+	features = pyramid.pyramid_features(pts, codes, width, height, codebook_size, _H_partitions, _V_partitions)
 	return features
 
 # an instance is a (im_filename, label) tuple
@@ -177,11 +96,7 @@ def construct_codebook(instances, codebook_size):
 
 	surf_feature_samples = sample_surf_features(instances)
 
-	distances = scipy.spatial.distance.pdist(surf_feature_samples, 'cityblock')
-	distances = scipy.spatial.distance.squareform(distances)
-
-	indices = kmedoids.cluster(distances, k=codebook_size, maxIters=_max_k_medoids_iters)[1]
-	codebook = surf_feature_samples[indices]
+	codebook = codebooks.build_codebook(surf_feature_samples, codebook_size, 'cityblock', _max_k_medoids_iters)
 
 	return codebook
 
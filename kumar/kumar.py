@@ -7,9 +7,11 @@ import label
 import random
 import shutil
 import metric
-import cPickle
+import artifacts
 import cluster
-import kmedoids
+import pyramid
+import codebooks
+import surf_detect
 import numpy as np
 import collections
 import sklearn.cluster
@@ -36,7 +38,7 @@ _V_partitions = 4
 _use_k_medoids = True
 _max_k_medoids_iters = 30
 
-_num_features = _codebook_size * ( (2 ** (_H_partitions) - 1) + (2 ** (_V_partitions) - 1) - 1 )
+_num_features = pyramid.num_features(_codebook_size, _H_partitions, _V_partitions)
 print "Codebook Size", _codebook_size
 print "Num Features", _num_features
 
@@ -45,15 +47,6 @@ _num_tree_features = int(math.sqrt(_num_features))
 _rf_threads = 8
 _perc_random_data = float(sys.argv[2])
 
-
-_surf_instance = cv2.SURF(_surf_threshold)
-_surf_instance.upright = _surf_upright
-_surf_instance.extended = _surf_extended
-
-_surf_instance_low = cv2.SURF(_surf_threshold_low)
-_surf_instance_low.upright = _surf_upright
-_surf_instance_low.extended = _surf_extended
-
 _number_of_clusters = int(sys.argv[3])
 
 _print_interval = 20
@@ -63,13 +56,7 @@ _clear_cache = False
 _read_cache = True
 _write_cache = True
 _cache_dir = ".kumar_cache"
-_cache_instances_file = os.path.join(_cache_dir, "instances.pckl")
-_cache_codebook_file = os.path.join(_cache_dir, "codebook.pckl")
-_cache_data_matrix_file = os.path.join(_cache_dir, "data_matrix.pckl")
-_cache_random_matrix_file = os.path.join(_cache_dir, "random_matrix.pckl")
-_cache_rf_file = os.path.join(_cache_dir, "rf.pckl")
-_cache_sim_matrix_file = os.path.join(_cache_dir, "sim_matrix.pckl")
-_cache_cluster_assignments_file = os.path.join(_cache_dir, "assignments.pckl")
+_cache_max_bytes = 50 * 2 ** 30
 
 if _clear_cache:
 	try:
@@ -77,100 +64,24 @@ if _clear_cache:
 	except:
 		print "Could not clear the cache"
 
-try:
-	os.makedirs(_cache_dir)
-except:
-	pass
+_store = artifacts.ArtifactStore(_cache_dir, _cache_max_bytes, _read_cache, _write_cache)
+
+# detections are cached with the other artifacts, so codebook sampling and feature
+# computation detect each page once
+_surf_detector = surf_detect.SurfDetector([_surf_threshold, _surf_threshold_low], _min_surf_features,
+	_num_surf_features, _surf_upright, _surf_extended, store=_store)
 
 def calc_surf_features(im_file):
-	im = cv2.imread(im_file, 0)
-	height = im.shape[0]
-	width = im.shape[1]
-	# surf_features[0] is the array of keypoints
-	# surf_features[1] is the array of descriptors
-	kps, deses = _surf_instance.detectAndCompute(im, None)
-	if len(kps) < _min_surf_features:
-		kps, deses = _surf_instance_low.detectAndCompute(im, None)
-	pts = np.array(map(lambda kp: kp.pt, kps[:_num_surf_features]))
-	deses = deses[:_num_surf_features] + 0
-	return pts, deses, width, height
+	return _surf_detector.features(im_file)
 	
 def calc_features(im_file, codebook):
 	# calc the surf features
 	pts, deses, width, height = calc_surf_features(im_file)
 
-	# the most fine grained partitions
-	horz_histos = np.zeros(2 ** (_H_partitions - 1) * _codebook_size)
-	vert_histos = np.zeros(2 ** (_V_partitions - 1) * _codebook_size)
-	horz_stride = (width / 2 ** (_H_partitions - 1)) + 1
-	vert_stride = (height / 2 ** (_V_partitions - 1)) + 1
-
-	#print "Image dims", (width, height)
-	#print "horz_stride", horz_stride
-	#print "vert_stride", vert_stride
-	#print "horz_histo shape", horz_histos.shape
-	#print "vert_histo shape", vert_histos.shape
-
-	closest_code = lambda feature: scipy.spatial.distance.cdist(codebook, [feature], metric='cityblock').argmin()
-
-	# populate the most fine grained partitions
-	for pt, des in zip(pts, deses):
-		#print pt
-		#print des
-		idx = closest_code(des)
-		#print "Closest code:", idx
-		horz_histos[idx + ( int(pt[0] / horz_stride)  * _codebook_size)] += 1
-		vert_histos[idx + ( int(pt[1] / vert_stride)  * _codebook_size)] += 1
-
-	#print "Horz Histo:"
-	#print horz_histos
-	#print
-	#print "Vert Histo:"
-	#print vert_histos
-
-	# aggregate the statistics
-	histos = np.zeros(_num_features)
-	histo_offset = 0
-	stride = 1
-	while stride <= horz_histos.shape[0] / _codebook_size:
-		horz_offset = 0
-		while horz_offset < horz_histos.shape[0] / _codebook_size:
-			horz_cur = horz_offset
-			while horz_cur < (horz_offset + stride):
-				histos[histo_offset * _codebook_size : (histo_offset + 1) * _codebook_size] += (
-					horz_histos[horz_cur * _codebook_size: (horz_cur + 1) * _codebook_size])
-				horz_cur += 1
-			horz_offset += stride
-			histo_offset += 1
-		stride *= 2
-	stride = 1
-	while stride < vert_histos.shape[0] / _codebook_size:
-		vert_offset = 0
-		while vert_offset < vert_histos.shape[0] / _codebook_size:
-			vert_cur = vert_offset
-			while vert_cur < (vert_offset + stride):
-				histos[histo_offset * _codebook_size : (histo_offset + 1) * _codebook_size] += (
-					vert_histos[vert_cur * _codebook_size: (vert_cur + 1) * _codebook_size])
-				vert_cur += 1
-			vert_offset += stride
-			histo_offset += 1
-		stride *= 2
-
-	#print
-	#print "Whole Histo"
-	#print histos
-
-	# normalize
-	for offset in xrange(_num_features / _codebook_size):
-		s = histos[offset * _codebook_size : (offset + 1) * _codebook_size].sum()
-		if s:
-			histos[offset * _codebook_size : (offset + 1) * _codebook_size] /= float(s)
-	features = histos
-
-	#print
-	#print "Normalized"
-	#print self.features
-	#exit()
+	codes = codebooks.quantize(deses, codebook, metric='cityblock')
+
+	# histograms of the codes over the spatial pyramid, each normalized
+	features = pyramid.pyramid_features(pts, codes, width, height, _codebook_size, _H_partitions, _V_partitions)
 	return features
 
 #class Instance:
@@ -279,19 +190,6 @@ def calc_features(im_file, codebook):
 # an instance is a (im_filename, label) tuple
 def load_instances(in_dir):
 	print "Loading Instances"
-	if _read_cache and os.path.exists(_cache_instances_file):
-		print "\tReading Cache"
-		f = open(_cache_instances_file)
-		try:
-			instances = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return instances
-		except Exception as e:
-			print "\tError loading instances:", e
-			print "\tComputing From scratch"
-			f.close()
-
 	instances = list()
 	for sdir in os.listdir(in_dir):
 		#if sdir not in ["UK1911Census_EnglandWales_Household15Names_03_01",
@@ -306,14 +204,6 @@ def load_instances(in_dir):
 	#random.seed(123456)
 	random.shuffle(instances)
 
-	if _write_cache:
-		print "\tWriting Instances to Cache"
-		f = open(_cache_instances_file, 'w')
-		try:
-			cPickle.dump(instances, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
 	print "Done\n"
 	return instances
 
@@ -333,61 +223,22 @@ def sample_surf_features(instances):
 
 def construct_codebook(instances):
 	print "Constructing Codebook"
-	if _read_cache and os.path.exists(_cache_codebook_file):
-		print "\tReading Cache"
-		f = open(_cache_codebook_file)
-		try:
-			codebook = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return codebook
-		except Exception as e:
-			print "\tError loading codebook:", e
-			print "\tComputing From scratch"
-			f.close()
-
 	surf_feature_samples = sample_surf_features(instances)
 	print "\tNumber of SURFs for codebook construction: ", surf_feature_samples.shape[0]
 
 	if _use_k_medoids:
-		print "\tComputing Distances"
-		distances = scipy.spatial.distance.pdist(surf_feature_samples, 'cityblock')
-		distances = scipy.spatial.distance.squareform(distances)
-		print "\tDone\n"
-
 		print "\tRunning Kmedoids"
-		indices = kmedoids.cluster(distances, k=_codebook_size, maxIters=_max_k_medoids_iters)[1]
-		codebook = surf_feature_samples[indices]
+		codebook = codebooks.build_codebook(surf_feature_samples, _codebook_size, 'cityblock',
+			_max_k_medoids_iters, _print=True)
 		print "\tDone\n"
 	else:
 		codebook = surf_feature_samples[:_codebook_size]
 
-	if _write_cache:
-		print "\tWriting Codebook to Cache"
-		f = open(_cache_codebook_file, 'w')
-		try:
-			cPickle.dump(codebook, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
 	print "Done\n"
 	return codebook
 
 def compute_features(instances, codebook):
 	print "Computing histogram features for each instance"
-	if _read_cache and os.path.exists(_cache_data_matrix_file):
-		print "\tReading Cache"
-		f = open(_cache_data_matrix_file)
-		try:
-			features = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return features
-		except Exception as e:
-			print "\tError loading Data Matrix:", e
-			print "\tComputing From scratch"
-			f.close()
-
 	features = list()
 	total = len(instances)
 	for x, instance in enumerate(instances):
@@ -397,15 +248,6 @@ def compute_features(instances, codebook):
 	features = np.array(features)
 	#features = np.array(map(lambda instance: instance.calc_features(codebook), instances))
 
-	if _write_cache:
-		print "\tWriting Data Matrix to Cache"
-		f = open(_cache_data_matrix_file, 'w')
-		try:
-			cPickle.dump(features, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
-
 	print "Done\n"
 	return features
 
@@ -413,19 +255,6 @@ def compute_features(instances, codebook):
 def compute_random_matrix(data_matrix):
 	print "Constructing Random Training Set"
 
-	if _read_cache and os.path.exists(_cache_random_matrix_file):
-		print "\tReading Cache"
-		f = open(_cache_random_matrix_file)
-		try:
-			rand_mat = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return rand_mat
-		except Exception as e:
-			print "\tError loading Random Matrix:", e
-			print "\tComputing From scratch"
-			f.close()
-
 	rand_shape = (int(data_matrix.shape[0] * _perc_random_data), data_matrix.shape[1])
 	rand_mat = np.zeros(rand_shape)
 	#np.random.seed(12345)
@@ -434,115 +263,38 @@ def compute_random_matrix(data_matrix):
 		for row in xrange(rand_mat.shape[0]):
 			rand_mat[row, col] = np.random.choice(vals)
 
-	if _write_cache:
-		print "\tWriting Random Matrix to Cache"
-		f = open(_cache_random_matrix_file, 'w')
-		try:
-			cPickle.dump(rand_mat, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
-
 	print "Done\n"
 	return rand_mat
 
 def train_classifier(real_data, fake_data):
 	print "Training Random Forest"
 
-	if _read_cache and os.path.exists(_cache_rf_file):
-		print "\tReading Cache"
-		f = open(_cache_rf_file)
-		try:
-			rf = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return rf
-		except Exception as e:
-			print "\tError loading Random Forest:", e
-			print "\tComputing From scratch"
-			f.close()
-
-
-
 	rf = sklearn.ensemble.RandomForestClassifier(n_estimators=_num_trees, max_features=_num_tree_features,
 												bootstrap=False, n_jobs=_rf_threads)
 	combined_data = np.concatenate( (real_data, fake_data) )
 	labels = np.concatenate( (np.ones(real_data.shape[0]), np.zeros(fake_data.shape[0])) )
 	rf.fit(combined_data, labels)
 
-	if _write_cache:
-		print "\tWriting Random Forest to Cache"
-		f = open(_cache_rf_file, 'w')
-		try:
-			cPickle.dump(rf, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
-
 	print "Done\n"
 	return rf
 
 def compute_sim_mat(data_matrix, random_forest):
 	print "Computing the Similarity Matrix"
-	if _read_cache and os.path.exists(_cache_sim_matrix_file):
-		print "\tReading Cache"
-		f = open(_cache_sim_matrix_file)
-		try:
-			sim_mat = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return sim_mat
-		except Exception as e:
-			print "\tError loading Random Matrix:", e
-			print "\tComputing From scratch"
-			f.close()
-
 	leaf_nodes = random_forest.apply(data_matrix)
 	sim_mat = scipy.spatial.distance.pdist(leaf_nodes, "hamming")
 	sim_mat = scipy.spatial.distance.squareform(sim_mat)
 	sim_mat = 1 - sim_mat
 
-	if _write_cache:
-		print "\tWriting Similarity Matrix to Cache"
-		f = open(_cache_sim_matrix_file, 'w')
-		try:
-			cPickle.dump(sim_mat, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
-
 	print "Done\n"
 	return sim_mat
 
 def spectral_cluster(affinity_matrix):
 	print "Performing Spectral Clustering"
 
-	if _read_cache and os.path.exists(_cache_cluster_assignments_file):
-		print "\tReading Cache"
-		f = open(_cache_cluster_assignments_file)
-		try:
-			assignments = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return assignments
-		except Exception as e:
-			print "\tError loading Cluster Assignments:", e
-			print "\tComputing From scratch"
-			f.close()
-
 	sc = sklearn.cluster.SpectralClustering(n_clusters=_number_of_clusters, affinity="precomputed",
 											assign_labels="discretize")
 	assignments = sc.fit_predict(affinity_matrix)
 
-	if _write_cache:
-		print "\tWriting Cluster Assignments to Cache"
-		f = open(_cache_cluster_assignments_file, 'w')
-		try:
-			cPickle.dump(assignments, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
-
 	print "Done\n"
 	return assignments
 
@@ -566,34 +318,49 @@ def form_clusters(instances, assignments):
 	return clusters
 
 def get_clusters(in_dir):
-	instances = load_instances(in_dir)
+	# each stage is cached under its parameters and the key of the stage it depends on.
+	#   The first stage is keyed on the contents of the images, wherever they are.
+	instances_key = _store.key("instances", artifacts.tree_digest(in_dir, _image_ext), _image_ext)
+	instances = _store.cached(instances_key, lambda: map(lambda (path, _label): (os.path.relpath(path, in_dir), _label),
+		load_instances(in_dir)))
+	instances = map(lambda (path, _label): (os.path.join(in_dir, path), _label), instances)
 	print "Num Instanes", len(instances)
 
-	codebook = construct_codebook(instances)
+	surf_params = (_surf_upright, _surf_extended, _surf_threshold, _surf_threshold_low,
+		_num_surf_features, _min_surf_features)
+	codebook_key = _store.key("codebook", instances_key, surf_params, _codebook_size,
+		_perc_docs_for_codebook, _max_surf_features, _use_k_medoids, _max_k_medoids_iters)
+	codebook = _store.cached(codebook_key, lambda: construct_codebook(instances))
 	print "Codebook Shape", codebook.shape
 	print codebook
 	print
 
-	data_matrix = compute_features(instances, codebook)
+	data_matrix_key = _store.key("data_matrix", codebook_key, _H_partitions, _V_partitions)
+	data_matrix = _store.cached(data_matrix_key, lambda: compute_features(instances, codebook))
 	print "Data Matrix Shape", data_matrix.shape
 	print data_matrix
 	print
 
-	random_matrix = compute_random_matrix(data_matrix)
+	random_matrix_key = _store.key("random_matrix", data_matrix_key, _perc_random_data)
+	random_matrix = _store.cached(random_matrix_key, lambda: compute_random_matrix(data_matrix))
 	print "Random Matrix Shape", random_matrix.shape
 	print random_matrix
 	print
 
-	random_forest = train_classifier(data_matrix, random_matrix)
-	sim_mat = compute_sim_mat(data_matrix, random_forest)
+	rf_key = _store.key("rf", random_matrix_key, _num_trees, _num_tree_features)
+	random_forest = _store.cached(rf_key, lambda: train_classifier(data_matrix, random_matrix))
+	sim_mat_key = _store.key("sim_matrix", rf_key)
+	sim_mat = _store.cached(sim_mat_key, lambda: compute_sim_mat(data_matrix, random_forest))
 	print "Sim Matrix Shape", sim_mat.shape
 	print sim_mat
 	print
 
-	cluster_assignments = spectral_cluster(sim_mat)
+	assignments_key = _store.key("assignments", sim_mat_key, _number_of_clusters)
+	cluster_assignments = _store.cached(assignments_key, lambda: spectral_cluster(sim_mat))
 	print "Cluster Assignments"
 	print cluster_assignments
 	print
+	_store.print_stats()
 
 	clusters = form_clusters(instances, cluster_assignments) 
 	clusters = filter(lambda cluster: cluster.members, clusters)
@@ -0,0 +1,275 @@
+
+import os
+import sys
+import random
+import metric
+import cluster
+import numpy as np
+import collections
+import multiprocessing
+import sklearn.cluster
+import sklearn.metrics
+import sklearn.manifold
+import sklearn.ensemble
+import sklearn.cluster.spectral
+import scipy.spatial.distance
+
+# Runs the trials of the kumar experiment scripts.  A trial trains a random forest on one
+#   data matrix against one random matrix and spectrally clusters its similarity matrix for
+#   every number of clusters.  Trials run in worker processes, and the parent writes each
+#   trial's rows to the results file as soon as the trial finishes.
+
+
+class Sweep:
+	'''
+	Parameters shared by every trial of an experiment
+	'''
+
+	def __init__(self, cluster_range, num_trees, rf_threads, assignment_method='discretize',
+			true_silhouette=True, verbose=True):
+		'''
+		cluster_range - (int, int) the smallest and largest number of clusters, inclusive
+		true_silhouette - bool whether rows end with the silhouette of the true labels
+		'''
+		self.cluster_range = cluster_range
+		self.num_trees = num_trees
+		self.rf_threads = rf_threads
+		self.assignment_method = assignment_method
+		self.true_silhouette = true_silhouette
+		self.verbose = verbose
+
+	def cluster_nums(self):
+		return range(self.cluster_range[0], self.cluster_range[1] + 1)
+
+
+class Trial:
+	'''
+	One data matrix clustered with one random matrix.  The row written for each number
+		of clusters is: key_cols, Num_Clusters, Num_Trees, params, then the metrics.
+	'''
+
+	def __init__(self, data_matrix_file, labels_file, random_fn, random_args=(), key_cols=(),
+			params=(), assignments_file=None):
+		'''
+		random_fn - (data_matrix, *random_args) -> np.array the random matrix.  Must be a
+			module level function so it can be sent to the workers
+		key_cols - list(str) the already formatted leading columns
+		params - list(float) written after Num_Trees
+		assignments_file - str with a %d for the number of clusters to save each predicted
+			labeling to, or None
+		'''
+		self.data_matrix_file = data_matrix_file
+		self.labels_file = labels_file
+		self.random_fn = random_fn
+		self.random_args = tuple(random_args)
+		self.key_cols = list(key_cols)
+		self.params = list(params)
+		self.assignments_file = assignments_file
+
+
+class ResultsWriter:
+	'''
+	Tab separated results file with a header row.  Every row is flushed when it is
+		written, so the results of finished trials survive a crash.
+	'''
+
+	def __init__(self, out_file, columns):
+		self.out = open(out_file, 'w')
+		self.write_row(columns)
+
+	def write_row(self, row):
+		self.out.write("%s\n" % "\t".join(row))
+		self.out.flush()
+
+	def close(self):
+		self.out.close()
+
+
+def train_classifier(real_data, fake_data, num_trees, rf_threads):
+	rf = sklearn.ensemble.RandomForestClassifier(n_estimators=num_trees, max_features='auto',
+												bootstrap=False, n_jobs=rf_threads)
+	combined_data = np.concatenate( (real_data, fake_data) )
+	labels = np.concatenate( (np.ones(real_data.shape[0]), np.zeros(fake_data.shape[0])) )
+	rf.fit(combined_data, labels)
+
+	return rf
+
+def compute_sim_mat(data_matrix, random_forest):
+
+	leaf_nodes = random_forest.apply(data_matrix)
+	sim_mat = scipy.spatial.distance.pdist(leaf_nodes, "hamming")
+	sim_mat = scipy.spatial.distance.squareform(sim_mat)
+	sim_mat = 1 - sim_mat
+
+	return sim_mat
+
+def spectral_cluster_range(affinity_matrix, cluster_nums, assignment_method='discretize'):
+	'''
+	returns dict(int -> np.array) - the labels SpectralClustering(n_clusters=K, affinity="precomputed")
+		would give for each K in cluster_nums.  The eigenvectors for the largest K are computed
+		once and the first K of them are the embedding for K.
+	'''
+	embedding = sklearn.manifold.spectral_embedding(affinity_matrix, n_components=max(cluster_nums),
+		drop_first=False)
+	assignments = dict()
+	for num_clusters in cluster_nums:
+		maps = embedding[:, :num_clusters]
+		if assignment_method == 'kmeans':
+			assignments[num_clusters] = sklearn.cluster.k_means(maps, num_clusters)[1]
+		else:
+			assignments[num_clusters] = sklearn.cluster.spectral.discretize(maps)
+	return assignments
+
+def calc_acc(true_labels, predicted_labels):
+	_num_clusters = predicted_labels.max() + 1
+	counters = {x: collections.Counter() for x in xrange(_num_clusters)}
+	for true_label, predicted_label in zip(true_labels, predicted_labels):
+		counters[predicted_label][true_label] += 1
+
+	num_correct = 0
+	for counter in counters.values():
+		if counter:
+			num_correct += counter.most_common(1)[0][1]
+
+	return num_correct / float(len(true_labels))
+
+def form_clusters(true_labels, predicted_labels):
+	cluster_map = dict()
+	class Mock:
+		pass
+	for x in xrange(predicted_labels.max() + 1):
+		m = Mock()
+		m.label = None
+		cluster_map[x] = cluster.Cluster(list(), m, x)
+	count = 0
+	for true, predicted in zip(true_labels, predicted_labels):
+		m = Mock()
+		m._id = count
+		count += 1
+		m.label = true
+		cluster_map[predicted].members.append(m)
+	clusters = filter(lambda cluster: cluster.members, cluster_map.values())
+	map(lambda cluster: cluster.set_label(), clusters)
+	return clusters
+
+def print_analysis(clusters):
+	class Mock:
+		pass
+	m = Mock()
+	m.get_clusters = lambda: clusters
+	analyzer = metric.KnownClusterAnalyzer(m)
+	analyzer.print_general_info()
+	analyzer.print_histogram_info()
+	analyzer.print_label_conf_mat()
+	analyzer.print_label_cluster_mat()
+	analyzer.print_label_info()
+	analyzer.print_metric_info()
+
+
+# set once in each worker by _init_worker
+_worker_sweep = None
+
+
+def _init_worker(sweep):
+	global _worker_sweep
+	_worker_sweep = sweep
+	# forked workers start with the parent's random state and would draw the same
+	#   random matrices
+	np.random.seed()
+	random.seed()
+
+
+def run_trial(sweep, trial):
+	'''
+	returns (list(list(str)), dict(int -> np.array)) - the results row and the predicted
+		labels for each number of clusters
+	'''
+	data_matrix = np.load(trial.data_matrix_file)
+	true_labels = np.load(trial.labels_file)
+	random_matrix = trial.random_fn(data_matrix, *trial.random_args)
+	random_forest = train_classifier(data_matrix, random_matrix, sweep.num_trees, sweep.rf_threads)
+	sim_mat = compute_sim_mat(data_matrix, random_forest)
+	dist_mat = 1 - sim_mat
+
+	cluster_nums = sweep.cluster_nums()
+	assignments = spectral_cluster_range(sim_mat, cluster_nums, sweep.assignment_method)
+	silhouettes = list()
+	if sweep.true_silhouette:
+		silhouettes.append(sklearn.metrics.silhouette_score(dist_mat, true_labels, metric='precomputed'))
+
+	rows = list()
+	for num_clusters in cluster_nums:
+		predicted_labels = assignments[num_clusters]
+		acc = calc_acc(true_labels, predicted_labels)
+		h, c, v = sklearn.metrics.homogeneity_completeness_v_measure(true_labels, predicted_labels)
+		ari = sklearn.metrics.adjusted_rand_score(true_labels, predicted_labels)
+		predicted_silhouette = sklearn.metrics.silhouette_score(dist_mat, predicted_labels, metric='precomputed')
+		rows.append(trial.key_cols +
+			map(lambda x: "%d" % x, [num_clusters, sweep.num_trees]) +
+			map(lambda x: "%.3f" % x, trial.params + [acc, v, c, h, ari, predicted_silhouette] + silhouettes))
+	return rows, assignments
+
+def _trial_par_helper(task):
+	idx, trial = task
+	return idx, run_trial(_worker_sweep, trial)
+
+def _results(sweep, trials, processes):
+	'''
+	Generator of (idx, (rows, assignments)) for each trial, in the order they finish
+	'''
+	tasks = list(enumerate(trials))
+	if processes <= 1:
+		for task in tasks:
+			yield _trial_par_helper(task)
+		return
+
+	pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(sweep,))
+	try:
+		for result in pool.imap_unordered(_trial_par_helper, tasks):
+			yield result
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+
+def _save_assignments(trial, assignments):
+	for num_clusters, predicted_labels in assignments.iteritems():
+		try:
+			np.save(trial.assignments_file % num_clusters, predicted_labels)
+		except Exception as e:
+			print "Error occured saving assignments"
+			print e
+			print sys.exc_info()[0]
+
+def _print_verbose(rows, true_labels, assignments):
+	for row, num_clusters in zip(rows, sorted(assignments.keys())):
+		try:
+			print "\t".join(row)
+			clusters = form_clusters(true_labels, assignments[num_clusters])
+			print_analysis(clusters)
+		except Exception as e:
+			print "Error occured in verbose output"
+			print e
+			print sys.exc_info()[0]
+
+def run(sweep, trials, out_file, columns, processes=1):
+	'''
+	Runs every trial, processes at a time, and writes its rows to out_file as it finishes.
+		Only this process writes to out_file, saves assignments and prints the analysis.
+		columns - list(str) the header of out_file
+	'''
+	_init_worker(sweep)
+	results = ResultsWriter(out_file, columns)
+	num_trials = len(trials)
+	try:
+		for num_done, (idx, (rows, assignments)) in enumerate(_results(sweep, trials, processes)):
+			trial = trials[idx]
+			map(results.write_row, rows)
+			if trial.assignments_file:
+				_save_assignments(trial, assignments)
+			if sweep.verbose:
+				_print_verbose(rows, np.load(trial.labels_file), assignments)
+			print "\t%d/%d (%2.1f%%) Trials processed" % (num_done + 1, num_trials, 100.0 * (num_done + 1) / num_trials)
+	finally:
+		results.close()
+
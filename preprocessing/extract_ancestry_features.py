@@ -6,12 +6,14 @@ import Image
 import string
 import image.line_extract_lib as line_lib
 import ocr.ocr as ocr
-import kmedoids
+sys.path.append("../cluster")
+import codebooks
+import artifacts
+import surf_detect
 import random
 import numpy as np
 import scipy.spatial.distance
 import multiprocessing
-import cPickle
 
 # Parameters
 _surf_upright = True
@@ -26,17 +28,13 @@ _perc_docs_for_codebook = 0.05
 _max_surf_features = _codebook_size * 100
 _max_k_medoids_iters = 30
 
-_surf_instance = cv2.SURF(_surf_threshold)
-_surf_instance.upright = _surf_upright
-_surf_instance.extended = _surf_extended
+_surf_detector = surf_detect.SurfDetector([_surf_threshold, _surf_threshold_low], _min_surf_features,
+	_num_surf_features, _surf_upright, _surf_extended)
 
-_surf_instance_low = cv2.SURF(_surf_threshold_low)
-_surf_instance_low.upright = _surf_upright
-_surf_instance_low.extended = _surf_extended
-
-_cache_codebook_file = "./codebook.pckl"
+_cache_dir = "./.codebook_cache"
 _read_cache = True
 _write_cache = False
+_store = artifacts.ArtifactStore(_cache_dir, None, _read_cache, _write_cache)
 
 def get_id(img_file):
 	return os.path.splitext(img_file)[0]
@@ -88,17 +86,23 @@ def get_text_lines(ocr_file):
 def get_surfs(im_file, codebook):
 	surfs = list()
 	pts, ds = extract_surf_features(im_file)
-	closest_code = lambda feature: scipy.spatial.distance.cdist(codebook, [feature], metric='cityblock').argmin()
+	codes = codebooks.quantize(ds, codebook, metric='cityblock')
 
 	# populate the most fine grained partitions
-	for pt, des in zip(pts, ds):
-		idx = closest_code(des)
+	for pt, idx in zip(pts, codes):
 		surfs.append( (int(pt[0]), int(pt[1]), idx) )
 
 	return surfs
 
+# set once in each worker so the codebook is not pickled into every task
+_worker_codebook = None
+
+def _init_worker(codebook):
+	global _worker_codebook
+	_worker_codebook = codebook
+
 def transfer2(args):
-	transfer(*args)
+	transfer(*(args + (_worker_codebook,)))
 
 def transfer(img_file, h_line_file, v_line_file, label, ocr_file, out_file, line_verify_file, codebook):
 	print out_file
@@ -109,7 +113,10 @@ def transfer(img_file, h_line_file, v_line_file, label, ocr_file, out_file, line
 	create_verify_file(h_lines, v_lines, line_verify_file, size)
 	text_lines = get_text_lines(ocr_file)
 	surfs = get_surfs(img_file, codebook)
-	f = open(out_file, 'w')
+	# written under a temporary name so an interrupted run never leaves a partial out_file,
+	# which would be skipped when the run is restarted
+	part_file = out_file + ".part"
+	f = open(part_file, 'w')
 	f.write("%s\n" % _id)
 	f.write("%s\n" % label)
 	f.write("%d %d\n\n" % (size[0], size[1]))
@@ -131,33 +138,30 @@ def transfer(img_file, h_line_file, v_line_file, label, ocr_file, out_file, line
 		f.write("%d %d %d\n" % line)
 
 	f.write("\n")
+	f.close()
+	os.rename(part_file, out_file)
 
 
 def extract_surf_features(im_file):
-	im = cv2.imread(im_file, 0)
-	kps, deses = _surf_instance.detectAndCompute(im, None)
-	if len(kps) < _min_surf_features:
-		kps, deses = _surf_instance_low.detectAndCompute(im, None)
-	pts = np.array(map(lambda kp: kp.pt, kps[:_num_surf_features]))
-	ds = deses[:_num_surf_features] + 0
-	del deses
+	pts, ds = _surf_detector.features(im_file)[:2]
 	return (pts, ds)
 	
 
 def create_codebook(indir):
-	if _read_cache and os.path.exists(_cache_codebook_file):
-		print "\tReading Cache"
-		f = open(_cache_codebook_file)
-		try:
-			codebook = cPickle.load(f)
-			f.close()
-			print "Done\n"
-			return codebook
-		except Exception as e:
-			print "\tError loading codebook:", e
-			print "\tComputing From scratch"
-			f.close()
+	if not _store.read and not _store.write:
+		codebook = construct_codebook(indir)
+	else:
+		# the codebook is reused for as long as the images and codebook parameters stay the
+		#   same.  Only the images are sampled for it, and they are keyed by size and mtime
+		#   rather than read in full on every run.
+		key = _store.key("codebook", artifacts.tree_stat_digest(indir, ".jpg"), _surf_upright, _surf_extended,
+			_surf_threshold, _surf_threshold_low, _num_surf_features, _min_surf_features, _codebook_size,
+			_perc_docs_for_codebook, _max_surf_features, _max_k_medoids_iters)
+		codebook = _store.cached(key, lambda: construct_codebook(indir))
+	print "Done\n"
+	return codebook
 
+def construct_codebook(indir):
 	# sample some files
 	im_files = list()
 	for subdir in os.listdir(indir):
@@ -172,22 +176,7 @@ def create_codebook(indir):
 	surfs = np.concatenate(map(lambda x: extract_surf_features(x)[1], codebook_files))
 	np.random.shuffle(surfs)
 	surfs = surfs[:_max_surf_features]
-	distances = scipy.spatial.distance.pdist(surfs, 'cityblock')
-	distances = scipy.spatial.distance.squareform(distances)
-	indices = kmedoids.cluster(distances, k=_codebook_size, maxIters=_max_k_medoids_iters)[1]
-	codebook = surfs[indices]
-
-	if _write_cache:
-		print "\tWriting Codebook to Cache"
-		f = open(_cache_codebook_file, 'w')
-		try:
-			cPickle.dump(codebook, f)
-		except Exception as e:
-			print "\tCould not write to cache:", e
-		f.close()
-	print "Done\n"
-
-	return codebook
+	return codebooks.build_codebook(surfs, _codebook_size, 'cityblock', _max_k_medoids_iters, _print=True)
 
 if __name__ == "__main__":
 	indir = sys.argv[1]
@@ -215,8 +204,8 @@ if __name__ == "__main__":
 					#print out_file
 					#transfer(img_file, h_line_file, v_line_file, label_file, ocr_file, out_file, verify_file, codebook)
 					#args.append( (img_file, h_line_file, v_line_file, label_file, ocr_file, out_file, verify_file, codebook) )
-					args.append( (img_file, h_line_file, v_line_file, label, ocr_file, out_file, verify_file, codebook) )
-	pool = multiprocessing.Pool(7)
+					args.append( (img_file, h_line_file, v_line_file, label, ocr_file, out_file, verify_file) )
+	pool = multiprocessing.Pool(7, initializer=_init_worker, initargs=(codebook,))
 	pool.map(transfer2, args, 10)
 	
 	
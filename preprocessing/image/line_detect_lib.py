@@ -1,16 +1,8 @@
 
 import Image
-from collections import deque
 import sys
-
-
-# Enum
-START = 0
-BETWEEN = 1
-CONSEC = 2
-GAP = 3
-LABELING = 4
-END = 5
+import numpy as np
+import scipy.ndimage
 
 
 # Constants
@@ -25,85 +17,75 @@ COLOR_LABEL = (0, 255, 0)
 SMOOTH_KERNEL = 7
 
 class CC:
+	'''
+	A connected component of the labels found by find_ccs.  Its coordinates and mask
+		are computed from the label array the first time they are used.
+	'''
 	
-	def __init__(self, im, label, coords):
+	def __init__(self, im, label, labels, slices):
+		'''
+		im - Image('I') of the labels
+		labels - np.array of the labels indexed by [x, y]
+		slices - (slice, slice) the x and y ranges of the component in labels
+		'''
 		self.im = im
 		self.label = label
-		self.coords = coords
-		self.bounding_box = self.calc_bb()
+		self.labels = labels
+		self.slices = slices
+		self._coords = None
+
+	@property
+	def bounding_box(self):
+		return self.calc_bb()
+
+	@property
+	def coords(self):
+		''' list( (x, y) ) in the order find_ccs scans the image '''
+		if self._coords is None:
+			ul = self.bounding_box[0]
+			xs, ys = np.nonzero(self.pixels())
+			self._coords = zip((xs + ul[0]).tolist(), (ys + ul[1]).tolist())
+		return self._coords
 
 	def calc_bb(self):
-		maxx = 0
-		minx = 10e5
-		maxy = 0
-		miny = 10e5
+		xs, ys = self.slices
+		ul = (xs.start, ys.start)
+		lr = (xs.stop - 1, ys.stop - 1)
 
-		for p in self.coords:
-			maxx = max(maxx, p[0])
-			minx = min(minx, p[0])
-			maxy = max(maxy, p[1])
-			miny = min(miny, p[1])
+		return (ul, lr)
 
-		ul = (minx, miny)
-		lr = (maxx, maxy)
+	def pixels(self):
+		''' returns np.array(bool) - which pixels of the bounding box are in the component '''
+		return self.labels[self.slices] == self.label
 
-		return (ul, lr)
+	def contains(self, p):
+		x, y = p
+		return 0 <= x < self.labels.shape[0] and 0 <= y < self.labels.shape[1] and self.labels[x, y] == self.label
 
 	def get_size(self):
 		ul, lr = self.bounding_box
 		return lr[0] - ul[0] + 1, lr[1] - ul[1] + 1
 
 	def make_mask(self):
-		size = self.get_size()
-		ul, lr = self.bounding_box
-		im = Image.new("L", size, "black")
-		pix = im.load()
-		for p in self.coords:
-			#print p, ul, size
-			pix[p[0] - ul[0], p[1] - ul[1]] = 255
-		self.mask = im
+		self.mask = Image.fromarray(np.ascontiguousarray(self.pixels().T.astype(np.uint8) * 255), 'L')
 
 	def display(self):
 		print "CC %s: size %d\tbounding box %s" % (self.label, len(self.coords), self.bounding_box)
 		
 
 
-def label_component(x, y, pix, mask, label):
-	pix_queue = deque([(x, y)])
-	pix[x, y] = label
-	cc_coords = []
-
-	while pix_queue:
-		x, y = pix_queue.popleft()
-		for _x in [-1, 0, 1]:
-			for _y in [-1, 0, 1]:
-				__x = x + _x
-				__y = y + _y
-				try:
-					if mask[__x, __y] not in [BLACK, WHITE]:
-						print __x, __y, mask[__x, __y]
-					if pix[__x , __y] != label and mask[__x, __y] == BLACK:
-						pix[__x, __y] = label
-						cc_coords.append( (__x, __y) )
-						pix_queue.append( (__x, __y) )
-				except:
-					pass
-	return cc_coords
-
-
 def find_ccs(im):
-	pix = im.load()
-	mut = Image.new('I', im.size, color='black') # assign all 0s
-	mut_pix = mut.load()
-	cur_idx = 1
-	ccs = list()
-	for x in xrange(im.size[0]):
-		for y in xrange(im.size[1]):
-			if pix[x, y] == BLACK and mut_pix[x, y] == BLACK:
-				coords = label_component(x, y, mut_pix, pix, cur_idx)
-				cc = CC(mut, cur_idx, coords)
-				ccs.append(cc)
-				cur_idx += 1
+	'''
+	Labels the 8-connected components of the BLACK pixels of im.  Components are
+		numbered from 1 in the order their first pixel is reached going down each column,
+		left to right.
+	returns (Image('I'), list(CC)) - the labels (0 for the background) and the components
+	'''
+	# indexed by [x, y], so labels are numbered in column order
+	black = np.asarray(im.convert('L')).T == BLACK
+	labels, num_ccs = scipy.ndimage.label(black, structure=np.ones( (3, 3) ))
+	mut = Image.fromarray(np.ascontiguousarray(labels.T.astype(np.int32)), 'I')
+	ccs = map(lambda (idx, slices): CC(mut, idx + 1, labels, slices), enumerate(scipy.ndimage.find_objects(labels)))
 	return mut, ccs
 	
 
@@ -111,14 +93,13 @@ def color_components(orig, ccs, colors):
 	n = len(colors)
 	#mut = Image.new('RGB', o.size, color='white') 
 	mut = orig.convert('RGB')
-	pix = ccs.load()
-	mut_pix = mut.load()
-	for x in xrange(orig.size[0]):
-		for y in xrange(orig.size[1]):
-			if pix[x, y] != 0:
-				mut_pix[x, y] = colors[ pix[x, y] % n]
+	labels = np.asarray(ccs, dtype=np.int64)
+	rgb = np.array(mut)
+	palette = np.array(colors, dtype=np.uint8)
+	labeled = labels != 0
+	rgb[labeled] = palette[labels[labeled] % n]
 
-	return mut
+	return Image.fromarray(rgb, 'RGB')
 
 def get_value(pix, x, y):
 	try:
@@ -193,110 +174,62 @@ def smooth_median(im, lines):
 				line_pix[x, y] = new_val
 			
 			
-def label_horz_lines(im):
+def run_labels(black, max_gap=MAX_GAP):
+	'''
+	Labels the consecutive regions of each row of black.  A region is a run of pixels
+		and the runs after it in the row that are separated by at most max_gap pixels.
+	returns np.array(int32) - each pixel of black labeled with the number of black pixels
+		in its region, 0 elsewhere
+	'''
+	height, width = black.shape
+	# a white column after each row ends the runs of the row
+	padded = np.zeros( (height, width + 1), dtype=np.int8)
+	padded[:, :width] = black
+	edges = np.diff(np.concatenate( ([0], padded.ravel()) ))
+	starts = np.flatnonzero(edges == 1)
+	ends = np.flatnonzero(edges == -1)
+	lengths = ends - starts
+
+	# runs join the region of the run before them if they are close enough in the same row
+	joined = np.zeros(len(starts), dtype=bool)
+	joined[1:] = (starts[1:] - ends[:-1] <= max_gap) & (starts[1:] / (width + 1) == ends[:-1] / (width + 1))
+	regions = np.cumsum(~joined) - 1
+	consec = np.bincount(regions, weights=lengths).astype(np.int32)
+
+	labels = np.zeros(padded.size, dtype=np.int32)
+	labels[padded.ravel() != 0] = np.repeat(consec[regions], lengths)
+	return labels.reshape(padded.shape)[:, :width]
+
+
+def _black(im):
+	return np.asarray(im.convert('1').convert('L')) == BLACK
+
+
+def label_horz_lines(im, max_gap=MAX_GAP):
 	'''
 	Takes an Image (thresholded) and returns an 'I' image with the horizontal
 	consecutive regions labeled
 	'''
-	im = im.convert('1')
-	width, height = im.size
-	mut = Image.new('I', im.size, color='black') # assign all 0s
-	pix_orig = im.load()
-	pix_mut = mut.load()
-
-	x = 0 # iterator index
-	_x = 0 # marks start of consecutive region
-	y = 0 # iterator index
-	gapped = 0
-	consec = 0
-
-	for y in xrange(height):
-		state = START
-		x = 0
-		while state != END:
-			#print "(%d, %d)" % (x, y)
-
-			if state == START:
-				# decide which state to go to
-				if pix_orig[x, y] == BLACK:
-					consec = 0
-					state = CONSEC
-					_x = x
-				elif pix_orig[x, y] == WHITE:
-					state = BETWEEN
-				else:
-					print "pix_orig[%d, %d] = %s" % (x, y, pix_orig[x, y])
-					assert(False)
-
-			elif state == BETWEEN:
-				# burn through pixels
-				if pix_orig[x, y] == BLACK:
-					state = CONSEC
-					consec = 0
-					_x = x # record the start of a new consecutive block
-				elif pix_orig[x, y] == WHITE:
-					x += 1
-					if x >= width:
-						state = END
-				else:
-					print "pix_orig[%d, %d] = %s" % (x, y, pix_orig[x, y])
-					assert(False)
-
-			elif state == CONSEC:
-				# burn through pixels, detect gap and end
-				if pix_orig[x, y] == BLACK:
-					consec += 1
-					x += 1
-					if x >= width:
-						state = LABELING
-				elif pix_orig[x, y] == WHITE:
-					gapped = 0
-					state = GAP
-				else:
-					print "pix_orig[%d, %d] = %s" % (x, y, pix_orig[x, y])
-					assert(False)
-
-			elif state == GAP:
-				# go for a few pixels to see if we get BLACK again
-				if pix_orig[x, y] == BLACK:
-					state = CONSEC
-				elif pix_orig[x, y] == WHITE:
-					x += 1
-					gapped += 1
-					if x >= width or gapped > MAX_GAP:
-						state = LABELING
-				else:
-					print "pix_orig[%d, %d] = %s" % (x, y, pix_orig[x, y])
-					assert(False)
-
-			elif state == LABELING:
-				for __x in xrange(_x, x):
-					if pix_orig[__x, y] == BLACK:
-						pix_mut[__x, y] = consec
-				if x >= width:
-					state = END
-				else:
-					state = START
-			elif state == END:
-				continue # exit condition
-			else:
-				print "State is %d" % state
-				assert(False)
-	# end loops
-	return mut
-
-
-def paint_lines(canvas, lines):
+	return Image.fromarray(run_labels(_black(im), max_gap), 'I')
+
+
+def label_vert_lines(im, max_gap=MAX_GAP):
+	'''
+	Takes an Image (thresholded) and returns an 'I' image with the vertical
+	consecutive regions labeled
+	'''
+	labels = run_labels(_black(im).T, max_gap)
+	return Image.fromarray(np.ascontiguousarray(labels.T), 'I')
+
+
+def paint_lines(canvas, lines, thresh=CONSEC_THRESHOLD, color=COLOR_LABEL):
 	'''
 	:param canvas: Image 'RGB' to paint on.  This is modified
 	:param lines: Image 'I' line data.  This is not modified
 	'''
-	pix_canvas = canvas.load()
-	pix_lines = lines.load()
-	for x in xrange(lines.size[0]):
-		for y in xrange(lines.size[1]):
-			if pix_lines[x, y] > CONSEC_THRESHOLD:
-				pix_canvas[x, y] = COLOR_LABEL
+	rgb = np.array(canvas)
+	rgb[np.asarray(lines) > thresh] = color
+	canvas.paste(Image.fromarray(rgb, 'RGB'))
 
 
 def line_detect(im, thresh=None, noise_gap=None, color=None):
@@ -307,26 +240,24 @@ def line_detect(im, thresh=None, noise_gap=None, color=None):
 	:param noise_gap: int minimum number of pixels between separate contiguous regions
 	:param color: color to mark the lines in the returned Image
 	'''
-	if thresh is not None:
-		CONSEC_THRESHOLD = thresh
-	if noise_gap is not None:
-		MAX_GAP = noise_gap
-	if color is not None:
-		COLOR_LABEL = color
+	if thresh is None:
+		thresh = CONSEC_THRESHOLD
+	if noise_gap is None:
+		noise_gap = MAX_GAP
+	if color is None:
+		color = COLOR_LABEL
 
 	im = im.copy()
-	rotated = im.rotate(90)
-	horz_lines = label_horz_lines(im)
-	vert_lines = label_horz_lines(rotated)
+	horz_lines = label_horz_lines(im, noise_gap)
+	vert_lines = label_vert_lines(im, noise_gap)
 	print "raw lines done"
 	#for x in xrange(1):
-	#	smooth_median(rotated, vert_lines)
+	#	smooth_median(im, vert_lines)
 	#	smooth_median(im, horz_lines)
 	#	print "done with round of median filter"
-	vert_lines = vert_lines.rotate(270)
 	canvas = im.convert('RGB')
-	paint_lines(canvas, horz_lines)
-	paint_lines(canvas, vert_lines)
+	paint_lines(canvas, horz_lines, thresh, color)
+	paint_lines(canvas, vert_lines, thresh, color)
 	return canvas
 
 
@@ -70,9 +70,8 @@ def extract_line_from_cc(cc):
 	return line_orientation, line_len, line_thick, line_center, line_start
 		
 def cc_contains_any(cc, points):
-	s = set(cc.coords)
 	for p in points:
-		if p in s:
+		if cc.contains(p):
 			return True
 	return False
 